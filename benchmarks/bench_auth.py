@@ -0,0 +1,51 @@
+"""Authenticated requests/sec with and without the verified credentials cache.
+
+python benchmarks/bench_auth.py --requests 200 --concurrency 20
+"""
+
+import argparse
+import asyncio
+
+from common import Timer, basic_auth, create_schema, make_client
+
+from utils.credentials import credentials_cache
+
+
+async def run(requests: int, concurrency: int, cached: bool) -> float:
+    async with make_client() as client:
+        headers = basic_auth("bench", "bench-password")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call() -> None:
+            async with semaphore:
+                if not cached:
+                    credentials_cache.clear()
+                response = await client.get("/v1/reader/", headers=headers)
+                response.raise_for_status()
+
+        credentials_cache.clear()
+        (await client.get("/v1/reader/", headers=headers)).raise_for_status()
+        with Timer() as timer:
+            await asyncio.gather(*(call() for _ in range(requests)))
+    return requests / timer.elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    await create_schema()
+    async with make_client() as client:
+        response = await client.post("/v1/reader/", params={"username": "bench", "password": "bench-password"})
+        response.raise_for_status()
+
+    uncached = await run(args.requests, args.concurrency, cached=False)
+    cached = await run(args.requests, args.concurrency, cached=True)
+    print(f"bcrypt on every request: {uncached:10.1f} req/s")
+    print(f"verified credentials cache: {cached:8.1f} req/s ({cached / uncached:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
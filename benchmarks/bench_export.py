@@ -0,0 +1,92 @@
+"""Catalogue export: throughput and peak memory per format, for two catalogue sizes.
+
+    python benchmarks/bench_export.py --books 100000
+
+Exports ``--books`` and then four times as many books with every format and
+compression available and fails if the traced peak memory grows with the
+catalogue: the export must hold one partition at a time, not the table.
+"""
+
+import argparse
+import asyncio
+import sys
+import tracemalloc
+
+from sqlalchemy import delete, insert
+
+from common import Timer, create_schema
+
+from api.v1.schemas.export import ExportCompression, ExportFormat
+from db.database import session_local
+from db.models.author import Author
+from db.models.book import EXPORT_COLUMNS, Book
+from utils.bulk import chunks
+from utils.export import encode, missing_package
+
+BOOKS_PER_AUTHOR = 10
+
+
+async def fill(books: int) -> None:
+    async with session_local() as session:
+        await session.execute(delete(Book))
+        await session.execute(delete(Author))
+        authors = books // BOOKS_PER_AUTHOR
+        for chunk in chunks([{"id": i + 1, "name": f"author {i}"} for i in range(authors)]):
+            await session.execute(insert(Author), chunk)
+        for chunk in chunks(
+            [
+                {"name": f"book {i}", "is_age_limit": i % 2 == 0, "author_id": i // BOOKS_PER_AUTHOR + 1}
+                for i in range(books)
+            ]
+        ):
+            await session.execute(insert(Book), chunk)
+        await session.commit()
+
+
+async def export(export_format: ExportFormat, compression: ExportCompression) -> tuple[int, float, int]:
+    """Bytes written, seconds and traced peak memory of one export."""
+    size = 0
+    tracemalloc.start()
+    with Timer() as timer:
+        async for chunk in encode(Book.iter_export(None, False), EXPORT_COLUMNS, export_format, compression):
+            size += len(chunk)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, timer.elapsed, peak
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--growth", type=float, default=1.5, help="allowed peak memory ratio between the two sizes")
+    args = parser.parse_args()
+
+    cases = [
+        (export_format, compression)
+        for export_format in ExportFormat
+        for compression in ExportCompression
+        if not missing_package(export_format, compression)
+    ]
+    await create_schema()
+    peaks = {}
+    for books in (args.books, args.books * 4):
+        await fill(books)
+        print(f"{books} books:")
+        for export_format, compression in cases:
+            size, elapsed, peak = await export(export_format, compression)
+            peaks.setdefault((export_format, compression), []).append(peak)
+            print(
+                f"  {export_format:<8} {compression:<5} {size / 2**20:8.1f} MiB  {books / elapsed:9.0f} rows/s"
+                f"  peak {peak / 2**20:6.1f} MiB"
+            )
+
+    failed = False
+    for (export_format, compression), (small, large) in peaks.items():
+        if large > small * args.growth:
+            print(f"FAIL {export_format} {compression}: peak memory {small / 2**20:.1f} -> {large / 2**20:.1f} MiB")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
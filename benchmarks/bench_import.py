@@ -0,0 +1,66 @@
+"""Import time of the application, checked against a budget.
+
+    python benchmarks/bench_import.py --budget-ms 2000
+
+Runs ``python -X importtime -c "import app"`` in a fresh interpreter a few times
+and reports the best total and the slowest modules. Fails if the total is over
+the budget or if a module that must stay lazy (database drivers, passlib, the
+server) is imported: they are loaded on first use, not when a worker starts.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Not taken from common, which points DATABASE_URL at SQLite: the app is measured as configured
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+LAZY_MODULES = ("asyncpg", "psycopg2", "passlib", "uvicorn", "alembic", "pyinstrument")
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """Module name -> (self, cumulative) import time in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        env={**os.environ, "PYTHONPATH": SRC_DIR},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=2000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    times = min(runs, key=lambda run: run[args.module][1])
+    total_ms = times[args.module][1] / 1000
+    print(f"import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, (own, cumulative) in sorted(times.items(), key=lambda item: item[1][0], reverse=True)[: args.top]:
+        print(f"  {own / 1000:7.1f} ms self {cumulative / 1000:8.1f} ms total  {name}")
+
+    failed = total_ms > args.budget_ms
+    for module in LAZY_MODULES:
+        if module in times:
+            print(f"FAIL {module} is imported by {args.module}, it should be loaded on first use")
+            failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL over the import budget by {total_ms - args.budget_ms:.0f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Catalogue import: python3 -m db.ingest against Book.create_book once per row.
+
+    python benchmarks/bench_ingest.py --books 1000000
+
+Writes a CSV feed of ``--books`` books by ``--books / --books-per-author``
+authors, imports it into an empty catalogue and then again, when every book
+already exists. Fails if either import takes longer than ``--max-seconds``.
+``--row-by-row`` books are also created through Book.create_book for comparison.
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+
+from common import Timer, create_schema
+
+from api.v1.schemas.book import BookSchemaRequest
+from db.database import session_local
+from db.ingest import run
+from db.models.book import Book
+
+
+def write_feed(path: str, books: int, books_per_author: int) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as feed:
+        writer = csv.writer(feed)
+        writer.writerow(("name", "is_age_limit", "author_name"))
+        writer.writerows(
+            (f"Книга{number}", "true" if number % 2 else "false", f"Автор{number // books_per_author}")
+            for number in range(books)
+        )
+
+
+async def row_by_row(books: int) -> float:
+    async with session_local() as session:
+        with Timer() as timer:
+            for number in range(books):
+                book = BookSchemaRequest(name=f"Отдельная{number}", is_age_limit=False, author_id=1)
+                await Book.create_book(session, book)
+    return books / timer.elapsed
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=1_000_000)
+    parser.add_argument("--books-per-author", type=int, default=10)
+    parser.add_argument("--row-by-row", type=int, default=1000)
+    parser.add_argument("--max-seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bookcrud-ingest-"), "books.csv")
+    write_feed(path, args.books, args.books_per_author)
+    await create_schema()
+    feed = argparse.Namespace(authors=[], books=[path], format=None)
+    results = {}
+    for label in ("empty catalogue", "all existing"):
+        with Timer() as timer:
+            report = await run(feed)
+        results[label] = timer.elapsed
+        print(f"{label:<16} {timer.elapsed:6.1f} s  {args.books / timer.elapsed:9.0f} rows/s  {report}")
+    if args.row_by_row:
+        print(f"{'create_book':<16} {'':8}  {await row_by_row(args.row_by_row):9.0f} rows/s")
+    os.remove(path)
+    return 1 if max(results.values()) > args.max_seconds else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,228 @@
+"""Latency and throughput of the API under list, get, search, browse, auth and write mixes.
+
+Seeds the catalogue with ``seed.py``, runs every scenario against ``app.make_app()``
+in process and writes p50/p95/p99 latency and req/s per scenario as JSON.
+
+    python benchmarks/bench_load.py --output baseline.json
+    python benchmarks/bench_load.py --baseline baseline.json --tolerance 0.2
+
+With ``--baseline`` the run fails if a scenario got slower at p95 or lost
+throughput by more than the tolerance. The response cache is off unless
+``--response-cache`` is given, otherwise the list and search scenarios mostly
+measure cache hits. The browse scenario searches without filters, which the
+catalogue snapshot serves, unless ``CATALOGUE_SNAPSHOT_MAX_BOOKS=0``.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+from common import basic_auth, create_schema, make_client
+from seed import READER_PASSWORD, Catalogue, seed
+
+from db.database import engine
+from utils.pagination import encode_cursor
+from utils.response_cache import response_cache
+
+Request = Callable[[httpx.AsyncClient, random.Random], Awaitable[httpx.Response]]
+
+
+class Scenarios:
+    """Request mixes, each request picks its target from the seeded catalogue."""
+
+    def __init__(self, catalogue: Catalogue):
+        self.catalogue = catalogue
+        self.full_text = engine.url.get_backend_name() == "postgresql"
+        self.created_books: list[int] = []
+
+    def reader_headers(self, rnd: random.Random) -> dict[str, str]:
+        return basic_auth(f"reader{rnd.randrange(self.catalogue.readers)}", READER_PASSWORD)
+
+    async def list_books(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        params = {"limit": rnd.choice((10, 100)), "cursor": encode_cursor(rnd.randrange(self.catalogue.books))}
+        return await client.get("/v1/internal/book/", params=params)
+
+    async def list_authors(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        params = {"limit": rnd.choice((10, 100)), "cursor": encode_cursor(rnd.randrange(self.catalogue.authors))}
+        return await client.get("/v1/internal/author/", params=params)
+
+    async def get_book(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        return await client.get(f"/v1/internal/book/{rnd.randint(1, self.catalogue.books)}")
+
+    async def get_author(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        return await client.get(f"/v1/internal/author/{rnd.randint(1, self.catalogue.authors)}")
+
+    async def search_books(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        params = {"sorting_by": rnd.choice(("author", "book_name")), "book_name": f"книга{rnd.randint(1, 99)}"}
+        if self.full_text and rnd.random() < 0.5:
+            params = {"sorting_by": "book_name", "query": f"Книга{rnd.randint(1, self.catalogue.books)}"}
+        return await client.get("/v1/reader/books", params=params, headers=self.reader_headers(rnd))
+
+    async def search_authors(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        params = {"sorting_by": rnd.choice(("author", "book_name")), "author": f"автор{rnd.randint(1, 99)}"}
+        return await client.get("/v1/reader/authors", params=params, headers=self.reader_headers(rnd))
+
+    async def browse(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        # Searches without filters, served from the catalogue snapshot
+        endpoint = rnd.choice(("books", "authors"))
+        params = {"sorting_by": rnd.choice(("author", "book_name")), "is_age_limit": rnd.random() < 0.5}
+        return await client.get(f"/v1/reader/{endpoint}", params=params, headers=self.reader_headers(rnd))
+
+    async def auth(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        return await client.get("/v1/reader/", headers=self.reader_headers(rnd))
+
+    async def create_book(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        params = {"name": f"bench {rnd.random()}", "is_age_limit": rnd.random() < 0.5}
+        response = await client.post(
+            "/v1/internal/book/", params={**params, "author_id": rnd.randint(1, self.catalogue.authors)}
+        )
+        if response.status_code == 201:
+            self.created_books.append(response.json()["id"])
+        return response
+
+    async def update_book(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        book_id = rnd.randint(1, self.catalogue.books)
+        return await client.patch(f"/v1/internal/book/{book_id}", params={"name": f"Книга{book_id}"})
+
+    async def delete_book(self, client: httpx.AsyncClient, rnd: random.Random) -> httpx.Response:
+        if not self.created_books:
+            return await self.create_book(client, rnd)
+        return await client.delete(f"/v1/internal/book/{self.created_books.pop()}")
+
+    async def warm_up(self, client: httpx.AsyncClient) -> None:
+        # Log every reader in once, so search and auth measure the cached credentials path, not bcrypt
+        for number in range(self.catalogue.readers):
+            headers = basic_auth(f"reader{number}", READER_PASSWORD)
+            (await client.get("/v1/reader/", headers=headers)).raise_for_status()
+
+    def mixes(self) -> dict[str, list[tuple[Request, int]]]:
+        return {
+            "list": [(self.list_books, 2), (self.list_authors, 1)],
+            "get": [(self.get_book, 2), (self.get_author, 1)],
+            "search": [(self.search_books, 2), (self.search_authors, 1)],
+            "browse": [(self.browse, 1)],
+            "auth": [(self.auth, 1)],
+            "write": [(self.create_book, 5), (self.update_book, 3), (self.delete_book, 2)],
+        }
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, mix: list[tuple[Request, int]], requests: int, concurrency: int, seed_value: int
+) -> dict:
+    rnd = random.Random(seed_value)
+    calls, weights = zip(*mix)
+    plan = rnd.choices(calls, weights=weights, k=requests)
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(request: Request) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await request(client, rnd)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    # Warm the connection pool and the caches of this mix before timing
+    await asyncio.gather(*(call(request) for request in plan[:concurrency]))
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    await asyncio.gather(*(call(request) for request in plan))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {base['rps']:.1f} -> {result['rps']:.1f} req/s")
+    return regressions
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--authors", type=int, default=1000)
+    parser.add_argument("--books-per-author", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=500, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenario", action="append", help="run only these scenarios, can be repeated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--response-cache", action="store_true", help="keep the configured response cache")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if not args.response_cache:
+        response_cache.backend = None
+    await create_schema()
+    catalogue = await seed(args.authors, args.books_per_author, args.readers)
+    scenarios = Scenarios(catalogue)
+    mixes = scenarios.mixes()
+    names = args.scenario or list(mixes)
+
+    results = {
+        "meta": {
+            "database": engine.url.get_backend_name(),
+            "async": engine.url.get_driver_name() in ("aiosqlite", "asyncpg"),
+            "python": platform.python_version(),
+            "response_cache": args.response_cache,
+            "catalogue": vars(catalogue),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": {},
+    }
+    async with make_client() as client:
+        await scenarios.warm_up(client)
+        for number, name in enumerate(names):
+            result = await run_scenario(client, mixes[name], args.requests, args.concurrency, args.seed + number)
+            results["scenarios"][name] = result
+            print(
+                f"{name:<8} {result['rps']:8.1f} req/s  p50 {result['p50_ms']:7.1f}  p95 {result['p95_ms']:7.1f}"
+                f"  p99 {result['p99_ms']:7.1f} ms  errors {result['errors']}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
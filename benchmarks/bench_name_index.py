@@ -0,0 +1,111 @@
+"""The in-process name index: memory and lookups at scale, then searches against the SQL path.
+
+    python benchmarks/bench_name_index.py --names 1000000 --authors 1000
+
+The first part builds an index of ``--names`` generated titles without a
+database and reports its size and the lookup time of hits, misses and short
+needles. The second part seeds the catalogue with ``seed.py`` and times
+``Reader.search_books_by_params`` with the index and with the SQL filters only.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from itertools import islice
+
+from common import Timer, create_schema
+from seed import seed
+
+from api.v1.schemas.book import BookSearch
+from api.v1.schemas.reader import ReaderSchemaResponse
+from db.database import session_local
+from db.models.reader import Reader
+from settings import settings
+from utils.name_index import NGramIndex, name_index
+
+WORDS = ("война", "мир", "анна", "каренина", "idiot", "brothers", "karamazov", "demons", "night", "garden", "river")
+READER = ReaderSchemaResponse(id=0, username="bench", age=settings.AGE_LIMIT + 10)
+
+
+def title(rnd: random.Random, number: int) -> str:
+    return f"{' '.join(rnd.choices(WORDS, k=3)).capitalize()} {number}"
+
+
+def timed_ms(call, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def bench_index(names: int, repeat: int) -> None:
+    rnd = random.Random(0)
+    index = NGramIndex()
+    with Timer() as timer:
+        for number in range(1, names + 1):
+            index.add(number, title(rnd, number), number % 2 == 0, number // 10 + 1)
+    print(
+        f"index of {names} names built in {timer.elapsed:.1f} s,"
+        f" {index.nbytes() / 2**20:.0f} MiB of arrays, {len(index.postings)} trigrams"
+    )
+    for label, needle in (
+        ("unique hit", f" {names // 2}"),
+        ("miss", "tolstoy"),
+        ("frequent", "karamazov"),
+        ("short", "an"),
+    ):
+        found = index.search(needle)
+        count = "declined" if found is None else f"{len(list(found))} found"
+        # Searches through NameIndex stop after NAME_INDEX_MAX_IDS matches
+        elapsed = timed_ms(lambda: list(islice(index.search(needle) or (), name_index.max_ids + 1)), repeat)
+        print(f"  {label:<12} {needle!r:<14} {elapsed:9.3f} ms  {count}")
+
+
+async def bench_search(authors: int, books_per_author: int, repeat: int) -> None:
+    await create_schema()
+    catalogue = await seed(authors, books_per_author, readers=0)
+    await Reader.load_name_index()
+    # Lower-case needles: SQLite lower() leaves Cyrillic alone, Postgres folds it
+    cases = {
+        "book hit": BookSearch(sorting_by="book_name", book_name=f"нига{catalogue.books // 2}"),
+        "book miss": BookSearch(sorting_by="book_name", book_name="нет такой"),
+        "author hit": BookSearch(sorting_by="author", author=f"втор{authors // 2}"),
+        "many hits": BookSearch(sorting_by="book_name", book_name="нига1"),
+    }
+    print(f"search over {catalogue.books} books, median of {repeat}:")
+    async with session_local() as session:
+        for label, params in cases.items():
+            results = {}
+            for mode, ready in (("sql", False), ("index", True)):
+                name_index.ready = ready
+                times = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    found = await Reader.search_books_by_params(session, params, READER)
+                    times.append(time.perf_counter() - started)
+                results[mode] = (statistics.median(times) * 1000, len(found))
+            print(
+                f"  {label:<11} sql {results['sql'][0]:8.3f} ms  index {results['index'][0]:8.3f} ms"
+                f"  ({results['index'][1]} books)"
+            )
+            assert results["sql"][1] == results["index"][1], "the index changed the result"
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--names", type=int, default=1_000_000)
+    parser.add_argument("--authors", type=int, default=1000)
+    parser.add_argument("--books-per-author", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    bench_index(args.names, args.repeat)
+    await bench_search(args.authors, args.books_per_author, args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""SQL statements issued per endpoint, checked against the number of rows.
+
+Seeds the catalogue at two sizes and fails if any endpoint issues more
+statements on the larger catalogue, which is how an N+1 shows up. Writes are
+checked against a fixed budget: a single statement plus a single commit, with
+no existence check before the write and no refresh after it. On SQLite the
+writes to two tables take a statement per table.
+
+    python benchmarks/bench_queries.py
+"""
+
+import asyncio
+import sys
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from common import basic_auth, create_schema, make_client
+
+from db.database import engine, session_local
+from db.models.author import Author
+from db.models.book import Book
+from utils.catalogue import catalogue_snapshot
+from utils.response_cache import response_cache
+
+ENDPOINTS = (
+    ("/v1/internal/book/", {}),
+    ("/v1/internal/book/1", {}),
+    ("/v1/internal/author/", {}),
+    ("/v1/internal/author/1", {}),
+    ("/v1/reader/books", {"sorting_by": "book_name"}),
+    ("/v1/reader/books", {"sorting_by": "author", "book_name": "book"}),
+    ("/v1/reader/authors", {"sorting_by": "author"}),
+    ("/v1/reader/authors", {"sorting_by": "book_name", "author": "author"}),
+)
+# Method, path, params, expected status and statements. {empty} is an author without books.
+WRITES = (
+    # UPDATE ... RETURNING with the bump of the authors embedding the book in a CTE
+    ("PATCH", "/v1/internal/book/1", {"name": "renamed"}, 200, 1),
+    ("PATCH", "/v1/internal/book/999999", {"name": "renamed"}, 404, 1),
+    # DELETE ... RETURNING with the bump of its author in a CTE
+    ("DELETE", "/v1/internal/book/2", {}, 204, 1),
+    ("DELETE", "/v1/internal/book/999999", {}, 404, 1),
+    # UPDATE ... RETURNING in a CTE joined with the books embedded in the response
+    ("PATCH", "/v1/internal/author/1", {"name": "renamed"}, 200, 1),
+    ("PATCH", "/v1/internal/author/999999", {"name": "renamed"}, 404, 1),
+    # Soft delete: UPDATE ... WHERE EXISTS (books) and DELETE ... WHERE NOT EXISTS (books) in CTEs
+    ("DELETE", "/v1/internal/author/1", {}, 204, 1),
+    # Hard delete: the same statement, the DELETE matches
+    ("DELETE", "/v1/internal/author/{empty}", {}, 204, 1),
+    ("PATCH", "/v1/reader/", {"age": 13}, 200, 1),
+)
+# SQLite only takes SELECT in WITH, these writes run their parts as separate statements there
+SQLITE_WRITES = {
+    ("PATCH", "/v1/internal/book/1"): 2,
+    ("PATCH", "/v1/internal/book/999999"): 2,
+    ("DELETE", "/v1/internal/book/2"): 2,
+    ("PATCH", "/v1/internal/author/1"): 2,
+    ("DELETE", "/v1/internal/author/{empty}"): 2,
+}
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        self.commits = 0
+        sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+        event.listen(sync_engine, "before_cursor_execute", self.on_execute)
+        event.listen(sync_engine, "commit", self.on_commit)
+
+    def on_execute(self, *args) -> None:
+        self.count += 1
+
+    def on_commit(self, *args) -> None:
+        self.commits += 1
+
+
+async def seed(authors: int, books_per_author: int) -> None:
+    async with session_local() as session:
+        for author_number in range(authors):
+            author = Author(name=f"author {author_number}")
+            author.books = [
+                Book(name=f"book {author_number}-{book_number}", is_age_limit=book_number % 2 == 0)
+                for book_number in range(books_per_author)
+            ]
+            session.add(author)
+        await session.commit()
+
+
+async def measure(authors: int, books_per_author: int, counter: StatementCounter) -> dict[str, int]:
+    await create_schema()
+    await seed(authors, books_per_author)
+    counts = {}
+    async with make_client() as client:
+        response = await client.post("/v1/reader/", params={"username": "bench", "password": "bench", "age": 12})
+        response.raise_for_status()
+        headers = basic_auth("bench", "bench")
+        for path, params in ENDPOINTS:
+            # The first call warms the credentials cache
+            (await client.get(path, params=params, headers=headers)).raise_for_status()
+            counter.count = 0
+            (await client.get(path, params=params, headers=headers)).raise_for_status()
+            counts[f"{path} {params}"] = counter.count
+    return counts
+
+
+async def measure_writes(counter: StatementCounter) -> bool:
+    """Statements and commits of every write against its budget, True when all of them are within."""
+    failed = False
+    async with make_client() as client:
+        headers = basic_auth("bench", "bench")
+        # Warms the credentials cache for the reader update
+        (await client.get("/v1/reader/", headers=headers)).raise_for_status()
+        empty = (await client.post("/v1/internal/author/", params={"name": "no books"})).json()["id"]
+        for method, path, params, expected_status, budget in WRITES:
+            if engine.url.get_backend_name() == "sqlite":
+                budget = SQLITE_WRITES.get((method, path), budget)
+            path = path.format(empty=empty)
+            counter.count = counter.commits = 0
+            response = await client.request(method, path, params=params, headers=headers)
+            commits = 1 if expected_status < 400 else 0
+            ok = response.status_code == expected_status and counter.count <= budget and counter.commits == commits
+            failed = failed or not ok
+            print(
+                f"{'ok' if ok else 'FAIL':4} {counter.count:3} statements, {counter.commits} commits,"
+                f" {response.status_code}  {method} {path} {params}"
+            )
+    return not failed
+
+
+async def main() -> int:
+    # Cached responses and searches served from the catalogue snapshot issue no statements at all
+    response_cache.backend = None
+    catalogue_snapshot.max_books = 0
+    counter = StatementCounter()
+    small = await measure(authors=2, books_per_author=2, counter=counter)
+    large = await measure(authors=20, books_per_author=10, counter=counter)
+    failed = False
+    for endpoint, small_count in small.items():
+        large_count = large[endpoint]
+        grows = large_count > small_count
+        failed = failed or grows
+        print(f"{'FAIL' if grows else 'ok':4} {small_count:3} -> {large_count:3}  {endpoint}")
+    writes_ok = await measure_writes(counter)
+    return 1 if failed or not writes_ok else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,188 @@
+"""Rate limiting of one reader and admission control under a burst of concurrent requests.
+
+    python benchmarks/bench_rate_limit.py --seconds 2
+
+- one client sends requests back to back to ``/v1/reader/books``: the number
+  let through has to match the token bucket of its address, another username
+  from the same address has to be limited too and a client at another address
+  has to be served meanwhile. Then, with the address limit off, one reader
+  sends from two addresses in turn: the number let through has to match the
+  single bucket of the reader. Run with the memory backend and, when
+  ``fakeredis`` is installed, with the shared backend, alternating between two
+  clients of one server as two workers would
+- ``--requests`` concurrent requests to ``/v1/internal/book/`` with and
+  without ``ADMISSION_MAX_CONCURRENCY``: the connections checked out at once,
+  the requests refused and the latencies
+
+Fails if a limit lets more through than it should or a refusal has no
+``Retry-After``.
+"""
+
+import os
+
+# Read by make_app, the limits themselves are set below
+os.environ.setdefault("RATE_LIMIT_RATE", "20")
+os.environ.setdefault("ADMISSION_MAX_CONCURRENCY", "2")
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import statistics  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncEngine  # noqa: E402
+
+from common import basic_auth, create_schema, make_client  # noqa: E402
+from seed import seed  # noqa: E402
+
+from db.database import engine  # noqa: E402
+from utils.admission import admission  # noqa: E402
+from utils.rate_limit import InMemoryBackend, RedisBackend, rate_limiter  # noqa: E402
+from utils.response_cache import response_cache  # noqa: E402
+
+RATE = 20.0
+BURST = 5
+
+
+class CheckoutCounter:
+    """Connections checked out of the pool at once."""
+
+    def __init__(self):
+        self.current = self.peak = 0
+        sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+        event.listen(sync_engine, "checkout", self.on_checkout)
+        event.listen(sync_engine, "checkin", self.on_checkin)
+
+    def on_checkout(self, *args) -> None:
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+
+    def on_checkin(self, *args) -> None:
+        self.current -= 1
+
+
+async def hammer(clients: list, username: str, seconds: float, backends: list) -> tuple[int, int, float, bool]:
+    """Allowed and limited requests of one reader, the elapsed time and whether every 429 had Retry-After."""
+    headers = basic_auth(username, username)
+    allowed = limited = 0
+    retry_after = True
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        rate_limiter.backend = backends[(allowed + limited) % len(backends)]
+        client = clients[(allowed + limited) % len(clients)]
+        response = await client.get("/v1/reader/books", params={"sorting_by": "book_name"}, headers=headers)
+        if response.status_code == 429:
+            limited += 1
+            retry_after = retry_after and int(response.headers.get("retry-after", "0")) >= 1
+        else:
+            response.raise_for_status()
+            allowed += 1
+    return allowed, limited, time.perf_counter() - started, retry_after
+
+
+def within_bucket(allowed: int, elapsed: float) -> bool:
+    expected = BURST + RATE * elapsed
+    return expected * 0.8 <= allowed <= expected + 1
+
+
+async def bench_rate_limit(client, other_client, label: str, backends: list, seconds: float) -> bool:
+    usernames = (f"bench-{label}", f"bench-{label}-moving")
+    # Created and authenticated before the limit is measured, bcrypt would slow the first requests down
+    rate_limiter.backend = None
+    for username in usernames:
+        response = await client.post("/v1/reader/", params={"username": username, "password": username, "age": 30})
+        response.raise_for_status()
+        (await client.get("/v1/reader/", headers=basic_auth(username, username))).raise_for_status()
+    # Tokens come back every 1 / RATE from the first request, ending between two keeps the next request refused
+    allowed, limited, elapsed, retry_after = await hammer([client], usernames[0], seconds + 0.5 / RATE, backends)
+    # Another username does not get a fresh bucket, a client at another address is not held back
+    params = {"sorting_by": "author"}
+    renamed = await client.get("/v1/reader/books", params=params, headers=basic_auth("bench", "bench"))
+    other = await other_client.get("/v1/reader/books", params=params, headers=basic_auth("bench", "bench"))
+    ok = within_bucket(allowed, elapsed) and retry_after and renamed.status_code == 429 and other.status_code == 200
+    print(
+        f"{'ok' if ok else 'FAIL':4} {label:<8} address: {allowed} let through, {limited} limited in {elapsed:.1f} s"
+        f" (bucket allows {BURST + RATE * elapsed:.0f}), other username {renamed.status_code},"
+        f" other address {other.status_code}"
+    )
+    # Changing address does not give the reader a fresh bucket
+    rate_limiter.rate = 0
+    try:
+        allowed, limited, elapsed, retry_after = await hammer([client, other_client], usernames[1], seconds, backends)
+    finally:
+        rate_limiter.rate = RATE
+    reader_ok = within_bucket(allowed, elapsed) and retry_after
+    print(
+        f"{'ok' if reader_ok else 'FAIL':4} {label:<8} reader from two addresses: {allowed} let through,"
+        f" {limited} limited in {elapsed:.1f} s (bucket allows {BURST + RATE * elapsed:.0f})"
+    )
+    return ok and reader_ok
+
+
+async def burst(client, requests: int) -> tuple[dict[int, int], list[float], bool]:
+    async def one() -> tuple[int, float, bool]:
+        started = time.perf_counter()
+        response = await client.get("/v1/internal/book/")
+        has_retry_after = response.status_code != 503 or "retry-after" in response.headers
+        return response.status_code, time.perf_counter() - started, has_retry_after
+
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    statuses = {}
+    for status_code, _, _ in results:
+        statuses[status_code] = statuses.get(status_code, 0) + 1
+    return statuses, sorted(seconds for _, seconds, _ in results), all(retry for _, _, retry in results)
+
+
+async def bench_admission(client, requests: int, counter: CheckoutCounter) -> bool:
+    failed = False
+    for label, limit in (("unlimited", requests), ("admitted", 2)):
+        admission.limit, admission.queue, admission.timeout = limit, 4, 0.5
+        counter.peak = 0
+        statuses, latencies, retry_after = await burst(client, requests)
+        shed = statuses.get(503, 0)
+        ok = set(statuses) <= {200, 503} and retry_after and (label == "unlimited" or counter.peak <= limit)
+        failed = failed or not ok
+        print(
+            f"{'ok' if ok else 'FAIL':4} {label:<10} peak {counter.peak:3} connections, {shed:3} refused,"
+            f" p50 {statistics.median(latencies) * 1000:7.1f} ms, max {latencies[-1] * 1000:7.1f} ms  {statuses}"
+        )
+    return not failed
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    # Every request has to reach the limits
+    response_cache.backend = None
+    rate_limiter.rate, rate_limiter.reader_rate, rate_limiter.burst = RATE, RATE, BURST
+    await create_schema()
+    await seed(authors=50, books_per_author=20, readers=0)
+    counter = CheckoutCounter()
+    async with make_client() as client, make_client("127.0.0.2") as other_client:
+        admission.limit = args.requests
+        rate_limiter.backend = None
+        (
+            await client.post("/v1/reader/", params={"username": "bench", "password": "bench", "age": 30})
+        ).raise_for_status()
+        ok = await bench_rate_limit(
+            client, other_client, "memory", [InMemoryBackend(maxsize=100, ttl=BURST / RATE)], args.seconds
+        )
+        try:
+            import fakeredis
+        except ImportError:
+            print("skip redis, fakeredis is not installed")
+        else:
+            server = fakeredis.FakeServer()
+            workers = [RedisBackend(url="", client=fakeredis.FakeAsyncRedis(server=server)) for _ in range(2)]
+            ok = await bench_rate_limit(client, other_client, "redis", workers, args.seconds) and ok
+        rate_limiter.backend = None
+        ok = await bench_admission(client, args.requests, counter) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,146 @@
+"""CPU per search with the prebuilt search statements, against building them on every call.
+
+    python benchmarks/bench_search_statements.py --repeat 500
+
+Seeds a small catalogue, so the database takes little of the time, and runs
+``Reader.search_books_by_params`` and ``Reader.search_authors_by_params`` over
+a set of search shapes in three modes:
+
+- ``prebuilt`` - the statement of the shape is built once and reused
+- ``rebuilt`` - the statements are built on every call, SQLAlchemy finds the compiled form in its cache by the
+  structure of the statement (the behaviour before the prebuilt statements)
+- ``compiled`` - built and compiled on every call, with the compiled cache disabled
+
+Reports the process CPU time per call and the compiled cache hits of each
+mode, then searches by id lists of every length up to ``--ids`` as the name
+index does. Fails if a prebuilt statement misses the compiled cache once
+warmed up, or a new length of an id list compiles the statement again.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from common import create_schema
+from seed import seed
+
+from api.v1.schemas.book import BookSearch
+from api.v1.schemas.reader import ReaderSchemaResponse
+from db.database import SyncSession, engine, make_sessionmaker, session_local
+from db.models.reader import Reader, authors_statement, books_statement
+from settings import settings
+from utils.metrics import SEARCH_STATEMENTS
+
+MINOR = ReaderSchemaResponse(id=0, username="minor", age=settings.AGE_LIMIT - 5)
+ADULT = ReaderSchemaResponse(id=0, username="adult", age=settings.AGE_LIMIT + 10)
+# Lower-case needles: SQLite lower() leaves Cyrillic alone, Postgres folds it
+CASES = (
+    ("books", BookSearch(sorting_by="book_name"), MINOR),
+    ("books", BookSearch(sorting_by="author", book_name="нига1"), ADULT),
+    ("books", BookSearch(sorting_by="book_name", author="втор2", book_name="нига"), MINOR),
+    ("authors", BookSearch(sorting_by="author"), ADULT),
+    ("authors", BookSearch(sorting_by="book_name", book_name="нига1"), MINOR),
+    ("authors", BookSearch(sorting_by="author", author="втор", is_age_limit=True), MINOR),
+)
+
+
+class CacheCounter:
+    def __init__(self):
+        self.hits = self.total = 0
+        sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+        event.listen(sync_engine, "after_cursor_execute", self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.total += 1
+        self.hits += context.cache_hit == CacheStats.CACHE_HIT
+
+
+def make_session(compiled_cache: bool):
+    if compiled_cache:
+        return session_local()
+    session = make_sessionmaker(engine.execution_options(compiled_cache=None))()
+    return session if settings.DATABASE_ASYNC else SyncSession(session)
+
+
+async def search(session, kind: str, params: BookSearch, reader: ReaderSchemaResponse) -> list[int]:
+    if kind == "books":
+        return [book.id for book in await Reader.search_books_by_params(session, params, reader)]
+    return [author.id for author in await Reader.search_authors_by_params(session, params, reader)]
+
+
+async def run(mode: str, repeat: int, counter: CacheCounter) -> tuple[float, dict]:
+    """CPU seconds per call and the ids found per case."""
+    found = {}
+    async with make_session(compiled_cache=mode != "compiled") as session:
+        # Warms the statements and the compiled cache
+        for number, (kind, params, reader) in enumerate(CASES):
+            found[number] = await search(session, kind, params, reader)
+        counter.hits = counter.total = 0
+        started = time.process_time()
+        for _ in range(repeat):
+            for kind, params, reader in CASES:
+                if mode != "prebuilt":
+                    books_statement.cache_clear()
+                    authors_statement.cache_clear()
+                await search(session, kind, params, reader)
+        elapsed = time.process_time() - started
+    return elapsed / (repeat * len(CASES)), found
+
+
+async def id_lists(longest: int, counter: CacheCounter) -> tuple[int, int]:
+    """Compiled cache hits and statements of a search by ids with every list length, the IN lists expand on
+    execution."""
+    params = BookSearch(sorting_by="book_name", book_name="нига")
+    async with session_local() as session:
+        statement, values = Reader.search_books_query(params, ADULT, ([1], [1]), [1])
+        await session.scalars(statement, values)
+        counter.hits = counter.total = 0
+        for length in range(1, longest + 1):
+            ids = list(range(1, length + 1))
+            statement, values = Reader.search_books_query(params, ADULT, (ids, ids), ids)
+            await session.scalars(statement, values)
+    return counter.hits, counter.total
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--authors", type=int, default=20)
+    parser.add_argument("--books-per-author", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--ids", type=int, default=50)
+    args = parser.parse_args()
+
+    await create_schema()
+    await seed(args.authors, args.books_per_author, readers=0)
+    counter = CacheCounter()
+    results = {}
+    print(f"{len(CASES)} search shapes x {args.repeat}, CPU per call:")
+    for mode in ("prebuilt", "rebuilt", "compiled"):
+        per_call, found = await run(mode, args.repeat, counter)
+        results[mode] = (per_call, counter.hits / counter.total if counter.total else 0.0, found)
+        print(f"  {mode:<9} {per_call * 1e6:8.0f} us  compiled cache hits {results[mode][1]:6.1%}")
+        if mode == "prebuilt":
+            # The other modes clear the statements, search_statements_total counts the warm-up too
+            shapes = books_statement.cache_info().currsize + authors_statement.cache_info().currsize
+            statements = {result: SEARCH_STATEMENTS.values.get((result,), 0) for result in ("hit", "miss")}
+    for mode in ("rebuilt", "compiled"):
+        saved = results[mode][0] - results["prebuilt"][0]
+        print(f"  saved against {mode}: {saved * 1e6:.0f} us per call ({saved / results[mode][0]:.0%})")
+        assert results[mode][2] == results["prebuilt"][2], f"{mode} found other rows"
+    if settings.METRICS_ENABLED:
+        print(
+            f"search_statements_total after prebuilt: {statements['hit']} hits, {statements['miss']} misses,"
+            f" {shapes} shapes"
+        )
+    hits, total = await id_lists(args.ids, counter)
+    print(f"id lists of 1 to {args.ids} ids: compiled cache hits {hits}/{total}")
+    return 0 if results["prebuilt"][1] == 1.0 and hits == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
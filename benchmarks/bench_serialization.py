@@ -0,0 +1,116 @@
+"""Rendering a 10k book list: ORM objects through response_model versus rows dumped with orjson.
+
+    python benchmarks/bench_serialization.py --books 10000 --repeat 5
+
+``response_model`` is what every list route did before: load Book objects with
+their authors and let FastAPI validate, encode and dump them. ``adapter`` is the
+same load rendered with a prebuilt TypeAdapter. ``rows`` is the current path of
+the list and stream endpoints. The last lines time the endpoints end to end with
+the response cache off.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+
+import orjson
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+
+from common import Timer, create_schema, make_client
+
+from api.v1.schemas.book import BookSchemaResponse
+from db.database import session_local
+from db.models.author import Author
+from db.models.book import Book
+from utils.response_cache import response_cache
+
+BOOKS_FIELD = create_response_field(name="books", type_=list[BookSchemaResponse], mode="serialization")
+BOOKS_ADAPTER = TypeAdapter(list[BookSchemaResponse])
+
+
+async def seed(books: int) -> None:
+    async with session_local() as session:
+        await session.execute(insert(Author), [{"name": f"author {i}"} for i in range(books // 100 + 1)])
+        await session.execute(
+            insert(Book),
+            [{"name": f"book {i}", "is_age_limit": i % 2 == 0, "author_id": i // 100 + 1} for i in range(books)],
+        )
+        await session.commit()
+
+
+async def response_model(books: int) -> bytes:
+    async with session_local() as session:
+        content = (await session.scalars(Book.select_with_author().order_by(Book.id).limit(books))).all()
+        content = await serialize_response(field=BOOKS_FIELD, response_content=content, is_coroutine=True)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+async def adapter(books: int) -> bytes:
+    async with session_local() as session:
+        content = (await session.scalars(Book.select_with_author().order_by(Book.id).limit(books))).all()
+        return BOOKS_ADAPTER.dump_json(BOOKS_ADAPTER.validate_python(content, from_attributes=True))
+
+
+async def rows(books: int) -> bytes:
+    async with session_local() as session:
+        rows = (await session.execute(Book.select_rows().order_by(Book.id).limit(books))).all()
+        return orjson.dumps(await Book.to_response(session, rows))
+
+
+async def measure(render, books: int, repeat: int) -> tuple[float, bytes]:
+    timings = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            body = await render(books)
+        timings.append(timer.elapsed)
+    return statistics.median(timings), body
+
+
+async def measure_endpoints(books: int, repeat: int) -> None:
+    response_cache.backend = None
+    async with make_client() as client:
+        timings = []
+        for _ in range(repeat):
+            with Timer() as timer:
+                response = await client.get("/v1/internal/book/", params={"stream": "true"})
+                response.raise_for_status()
+            timings.append(timer.elapsed)
+        print(f"GET /v1/internal/book/?stream=true  {statistics.median(timings) * 1000:8.1f} ms")
+        timings = []
+        for _ in range(repeat):
+            with Timer() as timer:
+                params = {"limit": 1000}
+                while True:
+                    response = await client.get("/v1/internal/book/", params=params)
+                    response.raise_for_status()
+                    if "x-next-cursor" not in response.headers:
+                        break
+                    params["cursor"] = response.headers["x-next-cursor"]
+            timings.append(timer.elapsed)
+        print(f"GET /v1/internal/book/ by 1000      {statistics.median(timings) * 1000:8.1f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    await create_schema()
+    await seed(args.books)
+
+    baseline, expected = await measure(response_model, args.books, args.repeat)
+    print(f"response_model  {baseline * 1000:8.1f} ms")
+    for name, render in (("adapter", adapter), ("rows", rows)):
+        elapsed, body = await measure(render, args.books, args.repeat)
+        assert json.loads(body) == json.loads(expected), f"{name} renders a different body"
+        print(f"{name:<15} {elapsed * 1000:8.1f} ms ({baseline / elapsed:.1f}x)")
+    await measure_endpoints(args.books, args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
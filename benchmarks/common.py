@@ -0,0 +1,59 @@
+"""Shared helpers for the offline benchmarks.
+
+The benchmarks talk to the application built by ``app.make_app()`` through an
+in-process ASGI transport. Without ``DATABASE_URL`` they use a throwaway SQLite
+database, so no running Postgres is required.
+"""
+
+import base64
+import os
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+if not os.getenv("DATABASE_URL"):
+    _db_file = os.path.join(tempfile.mkdtemp(prefix="bookcrud-bench-"), "bench.db")
+    _async = os.getenv("DATABASE_ASYNC", "true").lower() in ("1", "true", "yes", "on")
+    os.environ["DATABASE_URL"] = ("sqlite+aiosqlite:///" if _async else "sqlite:///") + _db_file
+
+import httpx  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncEngine  # noqa: E402
+
+from db.base import BaseModel  # noqa: E402
+from db.database import engine  # noqa: E402
+from db.models.reader import Reader  # noqa: E402, F401
+
+
+async def create_schema() -> None:
+    if isinstance(engine, AsyncEngine):
+        async with engine.begin() as connection:
+            await connection.run_sync(BaseModel.metadata.drop_all)
+            await connection.run_sync(BaseModel.metadata.create_all)
+    else:
+        BaseModel.metadata.drop_all(engine)
+        BaseModel.metadata.create_all(engine)
+
+
+def make_client(address: str = "127.0.0.1") -> httpx.AsyncClient:
+    from app import make_app
+
+    transport = httpx.ASGITransport(app=make_app(), client=(address, 123))
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+def basic_auth(username: str, password: str) -> dict[str, str]:
+    token = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return {"Authorization": f"Basic {token}"}
+
+
+class Timer:
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.elapsed = time.perf_counter() - self.started
@@ -0,0 +1,80 @@
+"""Seed a catalogue the shape of the add_data migration, scaled up.
+
+Every third author is soft deleted and books alternate the age limit, like in
+``4f17404332e0_essage_add_data``. Readers share one password, so it is hashed
+only once; half of them are adults, a quarter minors and the rest have no age.
+
+    python benchmarks/seed.py --authors 1000 --books-per-author 10 --readers 100
+
+Run as a script it recreates the schema of ``DATABASE_URL`` first.
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+
+from sqlalchemy import func, insert, select
+
+from common import create_schema
+
+from db.database import session_local
+from db.models.author import Author
+from db.models.book import Book
+from db.models.reader import Reader
+from settings import settings
+from utils.bulk import chunks
+from utils.credentials import hash_password
+
+READER_PASSWORD = "bench-password"
+
+
+@dataclass
+class Catalogue:
+    authors: int
+    books: int
+    readers: int
+
+
+def reader_age(number: int) -> int | None:
+    return (settings.AGE_LIMIT + 10, settings.AGE_LIMIT + 10, settings.AGE_LIMIT - 6, None)[number % 4]
+
+
+async def seed(authors: int, books_per_author: int, readers: int) -> Catalogue:
+    async with session_local() as session:
+        for chunk in chunks([{"name": f"Автор{i + 1}", "is_deleted": i % 3 == 2} for i in range(authors)]):
+            await session.execute(insert(Author), chunk)
+        author_ids = (await session.scalars(select(Author.id).order_by(Author.id))).all()
+        books = (
+            {"name": f"Книга{n * books_per_author + i + 1}", "is_age_limit": i % 2 == 0, "author_id": author_id}
+            for n, author_id in enumerate(author_ids)
+            for i in range(books_per_author)
+        )
+        for chunk in chunks(list(books)):
+            await session.execute(insert(Book), chunk)
+        password = await hash_password(READER_PASSWORD)
+        for chunk in chunks(
+            [{"username": f"reader{i}", "password": password, "age": reader_age(i)} for i in range(readers)]
+        ):
+            await session.execute(insert(Reader), chunk)
+        await session.commit()
+        return Catalogue(
+            authors=await session.scalar(select(func.count(Author.id))),
+            books=await session.scalar(select(func.count(Book.id))),
+            readers=await session.scalar(select(func.count(Reader.id))),
+        )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--authors", type=int, default=1000)
+    parser.add_argument("--books-per-author", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=100)
+    args = parser.parse_args()
+
+    await create_schema()
+    catalogue = await seed(args.authors, args.books_per_author, args.readers)
+    print(f"seeded {catalogue.authors} authors, {catalogue.books} books, {catalogue.readers} readers")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,39 +1,126 @@
-from fastapi import Depends, status, APIRouter, Response
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import Body, Depends, Query, status, APIRouter, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.enums import ApiVersion, EndpointType
-from api.v1.schemas.author import AuthorSchemaResponse, AuthorSchemaRequest, AuthorSchemaPatch
-from db.database import get_db
+from api.v1.schemas.author import AuthorSchemaResponse, AuthorSchemaRequest, AuthorSchemaPatch, AuthorSchemaBulkPatch
+from api.v1.schemas.bulk import BulkItemResult, BulkStatus
+from api.v1.schemas.pagination import Pagination
+from db.database import get_db, get_read_db
 from db.models.author import Author
+from settings import settings
+from utils.bulk import id_results, parse_ids, read_bulk_items
+from utils.etag import etag_matches, make_etag, not_modified
+from utils.pagination import NDJSON_MEDIA_TYPE, decode_cursor, ndjson_lines, paginate
+from utils.read_your_writes import wants_primary
+from utils.response_cache import response_cache
 
 router = APIRouter(prefix=f"{ApiVersion.V1}/{EndpointType.internal}/author", tags=["Author"])
 
 
 @router.get("/", response_model=list[AuthorSchemaResponse])
-async def get_authors(db: Session = Depends(get_db)):
-    authors = await Author.get_all(db)
-    return authors
+async def get_authors(
+    request: Request, response: Response, pagination: Pagination = Depends(), db: AsyncSession = Depends(get_read_db)
+):
+    after_id = decode_cursor(pagination.cursor)
+    if pagination.stream:
+        return StreamingResponse(
+            ndjson_lines(Author.iter_all(after_id, wants_primary(request))),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+    if request.headers.get("if-none-match"):
+        etag = await Author.get_page_etag(db, pagination.limit, after_id)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    async def build():
+        rows = await Author.get_all(db, pagination.limit, after_id)
+        response.headers["ETag"] = Author.rows_etag(rows)
+        return await Author.to_response(db, paginate(rows, pagination, response))
+
+    # Rows are rendered straight to JSON, response_model is only used for the docs here
+    return await response_cache.respond("authors", pagination.model_dump(), build, None, response)
+
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=list[BulkItemResult])
+async def bulk_create_authors(request: Request, db: AsyncSession = Depends(get_db)):
+    """Create authors from a JSON array or an NDJSON body (`Content-Type: application/x-ndjson`)."""
+    items, results = await read_bulk_items(request, AuthorSchemaRequest)
+    ids = await Author.bulk_create_authors(db, [author for _, author in items])
+    results += [
+        BulkItemResult(index=index, id=author_id, status=BulkStatus.created)
+        for (index, _), author_id in zip(items, ids)
+    ]
+    return sorted(results, key=lambda result: result.index)
+
+
+@router.patch("/bulk", response_model=list[BulkItemResult])
+async def bulk_update_authors(request: Request, db: AsyncSession = Depends(get_db)):
+    """Patch authors by id from a JSON array or an NDJSON body."""
+    items, invalid = await read_bulk_items(request, AuthorSchemaBulkPatch)
+    updated_ids = await Author.bulk_update_authors(db, [author for _, author in items])
+    return id_results(
+        [(index, author.id) for index, author in items],
+        dict.fromkeys(updated_ids, BulkStatus.updated),
+        invalid,
+    )
+
+
+@router.delete("/bulk", response_model=list[BulkItemResult])
+async def bulk_delete_authors(
+    author_ids: list[int] = Body(max_length=settings.BULK_MAX_ITEMS), db: AsyncSession = Depends(get_db)
+):
+    """Authors with books are soft deleted, like in the single delete."""
+    deleted_ids, soft_deleted_ids = await Author.bulk_delete_authors(db, author_ids)
+    found = dict.fromkeys(deleted_ids, BulkStatus.deleted) | dict.fromkeys(soft_deleted_ids, BulkStatus.soft_deleted)
+    return id_results(list(enumerate(author_ids)), found, [])
+
+
+@router.get("/batch", response_model=list[AuthorSchemaResponse])
+async def get_authors_by_ids(
+    request: Request,
+    ids: str = Query(description="Comma separated ids, missing authors are left out"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    author_ids = parse_ids(ids)
+    found = await Author.get_by_ids(db, author_ids)
+    etag = make_etag(*(found[author_id][0] for author_id in author_ids if author_id in found))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    content = [found[author_id][1] for author_id in author_ids if author_id in found]
+    return Response(content=orjson.dumps(content), media_type="application/json", headers={"ETag": etag})
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=AuthorSchemaResponse)
-async def create_author(payload: AuthorSchemaRequest = Depends(), db: Session = Depends(get_db)):
-    new_author = Author.create_author(db, payload)
+async def create_author(payload: AuthorSchemaRequest = Depends(), db: AsyncSession = Depends(get_db)):
+    new_author = await Author.create_author(db, payload)
     return new_author
 
 
 @router.patch("/{author_id}", response_model=AuthorSchemaResponse)
-async def update_author(author_id: str, payload: AuthorSchemaPatch = Depends(), db: Session = Depends(get_db)):
+async def update_author(author_id: int, payload: AuthorSchemaPatch = Depends(), db: AsyncSession = Depends(get_db)):
     author = await Author.update_author(db, author_id, payload)
     return author
 
 
 @router.get("/{author_id}", response_model=AuthorSchemaResponse)
-async def get_author(author_id: str, db: Session = Depends(get_db)):
-    author = await Author.get_by_id(db, author_id)
-    return author
+async def get_author(author_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    if request.headers.get("if-none-match"):
+        # Answer from the version columns without loading the author
+        etag = await Author.get_etag_by_id(db, author_id)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    async def build():
+        etag, author = await Author.get_by_id(db, author_id)
+        response.headers["ETag"] = etag
+        return author
+
+    return await response_cache.respond("author", {"id": author_id}, build, None, response)
 
 
 @router.delete("/{author_id}")
-async def delete_author(author_id: str, db: Session = Depends(get_db)):
+async def delete_author(author_id: int, db: AsyncSession = Depends(get_db)):
     await Author.delete_author(db, author_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,39 +1,147 @@
-from fastapi import Depends, status, APIRouter, Response
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import Body, Depends, HTTPException, Query, status, APIRouter, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.enums import ApiVersion, EndpointType
-from api.v1.schemas.book import BookSchemaResponse, BookSchemaRequest, BookSchemaPatch
-from db.database import get_db
-from db.models.book import Book
+from api.v1.schemas.book import BookSchemaResponse, BookSchemaRequest, BookSchemaPatch, BookSchemaBulkPatch
+from api.v1.schemas.bulk import BulkItemResult, BulkStatus
+from api.v1.schemas.export import BookExport
+from api.v1.schemas.pagination import Pagination
+from db.database import get_db, get_read_db
+from db.models.book import EXPORT_COLUMNS, Book
+from settings import settings
+from utils.bulk import id_results, parse_ids, read_bulk_items
+from utils.etag import etag_matches, make_etag, not_modified
+from utils.export import encode, file_name, media_type, missing_package
+from utils.pagination import NDJSON_MEDIA_TYPE, decode_cursor, ndjson_lines, paginate
+from utils.read_your_writes import wants_primary
+from utils.response_cache import response_cache
 
 router = APIRouter(prefix=f"{ApiVersion.V1}/{EndpointType.internal}/book", tags=["Book"])
 
 
 @router.get("/", response_model=list[BookSchemaResponse])
-async def get_books(db: Session = Depends(get_db)):
-    books = await Book.get_all(db)
-    return books
+async def get_books(
+    request: Request, response: Response, pagination: Pagination = Depends(), db: AsyncSession = Depends(get_read_db)
+):
+    after_id = decode_cursor(pagination.cursor)
+    if pagination.stream:
+        return StreamingResponse(
+            ndjson_lines(Book.iter_all(after_id, wants_primary(request))),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+    if request.headers.get("if-none-match"):
+        etag = await Book.get_page_etag(db, pagination.limit, after_id)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    async def build():
+        rows = await Book.get_all(db, pagination.limit, after_id)
+        response.headers["ETag"] = Book.rows_etag(rows)
+        return await Book.to_response(db, paginate(rows, pagination, response))
+
+    # Rows are rendered straight to JSON, response_model is only used for the docs here
+    return await response_cache.respond("books", pagination.model_dump(), build, None, response)
+
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=list[BulkItemResult])
+async def bulk_create_books(request: Request, db: AsyncSession = Depends(get_db)):
+    """Create books from a JSON array or an NDJSON body (`Content-Type: application/x-ndjson`)."""
+    items, results = await read_bulk_items(request, BookSchemaRequest)
+    ids = await Book.bulk_create_books(db, [book for _, book in items])
+    results += [
+        BulkItemResult(index=index, id=book_id, status=BulkStatus.created) for (index, _), book_id in zip(items, ids)
+    ]
+    return sorted(results, key=lambda result: result.index)
+
+
+@router.patch("/bulk", response_model=list[BulkItemResult])
+async def bulk_update_books(request: Request, db: AsyncSession = Depends(get_db)):
+    """Patch books by id from a JSON array or an NDJSON body."""
+    items, invalid = await read_bulk_items(request, BookSchemaBulkPatch)
+    updated_ids = await Book.bulk_update_books(db, [book for _, book in items])
+    return id_results(
+        [(index, book.id) for index, book in items],
+        dict.fromkeys(updated_ids, BulkStatus.updated),
+        invalid,
+    )
+
+
+@router.delete("/bulk", response_model=list[BulkItemResult])
+async def bulk_delete_books(
+    book_ids: list[int] = Body(max_length=settings.BULK_MAX_ITEMS), db: AsyncSession = Depends(get_db)
+):
+    deleted_ids = await Book.bulk_delete_books(db, book_ids)
+    return id_results(list(enumerate(book_ids)), dict.fromkeys(deleted_ids, BulkStatus.deleted), [])
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_books(params: BookExport = Depends()):
+    """Every book with its author as CSV, NDJSON, Parquet or an Arrow stream, streamed from a server-side cursor."""
+    package = missing_package(params.format, params.compression)
+    if package:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{params.format} {params.compression} export requires the {package} package",
+        )
+    name = file_name("books", params.format, params.compression)
+    return StreamingResponse(
+        encode(
+            Book.iter_export(params.is_age_limit, params.include_deleted),
+            EXPORT_COLUMNS,
+            params.format,
+            params.compression,
+        ),
+        media_type=media_type(params.format, params.compression),
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+@router.get("/batch", response_model=list[BookSchemaResponse])
+async def get_books_by_ids(
+    request: Request,
+    ids: str = Query(description="Comma separated ids, missing books are left out"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    book_ids = parse_ids(ids)
+    found = await Book.get_by_ids(db, book_ids)
+    etag = make_etag(*(found[book_id][0] for book_id in book_ids if book_id in found))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    content = [found[book_id][1] for book_id in book_ids if book_id in found]
+    return Response(content=orjson.dumps(content), media_type="application/json", headers={"ETag": etag})
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=BookSchemaResponse)
-async def create_book(payload: BookSchemaRequest = Depends(), db: Session = Depends(get_db)):
+async def create_book(payload: BookSchemaRequest = Depends(), db: AsyncSession = Depends(get_db)):
     book = await Book.create_book(db, payload)
     return book
 
 
 @router.patch("/{book_id}", response_model=BookSchemaResponse)
-async def update_book(book_id: str, payload: BookSchemaPatch = Depends(), db: Session = Depends(get_db)):
+async def update_book(book_id: int, payload: BookSchemaPatch = Depends(), db: AsyncSession = Depends(get_db)):
     book = await Book.update_book(db, book_id, payload)
     return book
 
 
 @router.get("/{book_id}", response_model=BookSchemaResponse)
-async def get_book(book_id: str, db: Session = Depends(get_db)):
-    book = await Book.get_by_id(db, book_id)
-    return book
+async def get_book(book_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    if request.headers.get("if-none-match"):
+        # Answer from the version columns without loading the book
+        etag = await Book.get_etag_by_id(db, book_id)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    async def build():
+        etag, book = await Book.get_by_id(db, book_id)
+        response.headers["ETag"] = etag
+        return book
+
+    return await response_cache.respond("book", {"id": book_id}, build, None, response)
 
 
 @router.delete("/{book_id}")
-async def delete_book(book_id: str, db: Session = Depends(get_db)):
+async def delete_book(book_id: int, db: AsyncSession = Depends(get_db)):
     await Book.delete_book(db, book_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
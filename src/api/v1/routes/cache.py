@@ -0,0 +1,18 @@
+from fastapi import APIRouter, status, Response
+
+from api.enums import ApiVersion, EndpointType
+from api.v1.schemas.cache import CacheStatsSchemaResponse
+from utils.response_cache import response_cache
+
+router = APIRouter(prefix=f"{ApiVersion.V1}/{EndpointType.internal}/cache", tags=["Cache"])
+
+
+@router.get("/", response_model=CacheStatsSchemaResponse)
+async def get_cache_stats():
+    return response_cache.stats()
+
+
+@router.delete("/")
+async def invalidate_cache():
+    await response_cache.invalidate()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from loguru import logger
+
+from api.enums import ApiVersion, EndpointType
+from api.v1.schemas.database import PoolStatusSchemaResponse, ReplicaStatusSchemaResponse
+from db.database import pool_status, replicas
+
+router = APIRouter(prefix=f"{ApiVersion.V1}/{EndpointType.internal}/database", tags=["Database"])
+
+
+@router.get("/pool", response_model=PoolStatusSchemaResponse)
+async def get_pool_status():
+    status = pool_status()
+    logger.info("Database pool status: {}", status)
+    return status
+
+
+@router.get("/replicas", response_model=list[ReplicaStatusSchemaResponse])
+async def get_replicas_status():
+    return replicas.status()
@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from db.database import pool_status
+from utils import metrics
+from utils.admission import admission
+from utils.catalogue import catalogue_snapshot
+from utils.name_index import name_index
+from utils.rate_limit import rate_limiter
+from utils.response_cache import response_cache
+
+# Not versioned, Prometheus scrapes /metrics by default
+router = APIRouter(tags=["Metrics"])
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    for state, value in pool_status().items():
+        if state != "pool":
+            metrics.DB_POOL.set(value, state)
+    stats = response_cache.stats()
+    for result in ("hits", "misses", "errors"):
+        metrics.RESPONSE_CACHE.set(stats[result], result)
+    snapshot = catalogue_snapshot.stats()
+    for event in ("hits", "builds"):
+        metrics.CATALOGUE_SNAPSHOT.set(snapshot[event], event)
+    metrics.REQUESTS_SHED.set(rate_limiter.limited, "rate_limit")
+    admitted = admission.stats()
+    metrics.REQUESTS_SHED.set(admitted["rejected"], "overload")
+    for state in ("active", "waiting"):
+        metrics.ADMISSION.set(admitted[state], state)
+    if name_index.ready:
+        index = name_index.stats()
+        for kind in ("books", "authors"):
+            metrics.NAME_INDEX.set(index[kind], kind)
+        metrics.NAME_INDEX_BYTES.set(index["bytes"])
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
@@ -1,21 +1,42 @@
-from fastapi import Depends, status, APIRouter
+from fastapi import Depends, status, APIRouter, Request, Response as FastAPIResponse
 from fastapi.openapi.models import Response
-from sqlalchemy.orm import Session
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.enums import ApiVersion
 from api.v1.schemas.author import AuthorSchemaResponse
 from api.v1.schemas.book import BookSchemaResponse, BookSearch
 from api.v1.schemas.reader import ReaderSchemaResponse, ReaderSchemaRequest, ReaderSchemaPatch
-from db.database import get_db
+from db.database import get_db, get_read_db
 from db.models.reader import Reader
+from utils.catalogue import catalogue_snapshot
+from utils.etag import etag_matches, make_etag, not_modified
+from utils.response_cache import response_cache
 from utils.utils import verify_and_get_reader
 
 router = APIRouter(prefix=f"{ApiVersion.V1}/reader", tags=["Reader"])
 
+READER_ADAPTER = TypeAdapter(ReaderSchemaResponse)
+BOOKS_ADAPTER = TypeAdapter(list[BookSchemaResponse])
+AUTHORS_ADAPTER = TypeAdapter(list[AuthorSchemaResponse])
+
+
+def _search_cache_params(params: BookSearch, reader: ReaderSchemaResponse) -> dict:
+    # Name filters are case-insensitive, so are the cache keys
+    search = params.model_dump()
+    for field in ("author", "book_name", "query"):
+        if search[field]:
+            search[field] = search[field].lower()
+    return {**search, "age_bucket": Reader.age_bucket(reader)}
+
 
 @router.get("/", response_model=ReaderSchemaResponse)
-async def get_readers(reader: ReaderSchemaResponse = Depends(verify_and_get_reader)):
-    return reader
+async def get_readers(request: Request, reader: ReaderSchemaResponse = Depends(verify_and_get_reader)):
+    body = READER_ADAPTER.dump_json(READER_ADAPTER.validate_python(reader, from_attributes=True))
+    etag = make_etag(body)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return FastAPIResponse(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @router.post(
@@ -23,7 +44,7 @@ async def get_readers(reader: ReaderSchemaResponse = Depends(verify_and_get_read
     status_code=status.HTTP_201_CREATED,
     response_model=ReaderSchemaResponse,
 )
-async def create_reader(payload: ReaderSchemaRequest = Depends(), db: Session = Depends(get_db)):
+async def create_reader(payload: ReaderSchemaRequest = Depends(), db: AsyncSession = Depends(get_db)):
     reader = await Reader.create_reader(db, payload)
     return reader
 
@@ -32,14 +53,16 @@ async def create_reader(payload: ReaderSchemaRequest = Depends(), db: Session =
 async def update_reader(
     reader: ReaderSchemaResponse = Depends(verify_and_get_reader),
     payload: ReaderSchemaPatch = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     reader = await Reader.update_reader(db, reader, payload)
     return reader
 
 
 @router.delete("/", response_model=Response)
-async def delete_reader(reader: ReaderSchemaResponse = Depends(verify_and_get_reader), db: Session = Depends(get_db)):
+async def delete_reader(
+    reader: ReaderSchemaResponse = Depends(verify_and_get_reader), db: AsyncSession = Depends(get_db)
+):
     await Reader.delete_reader(db, reader)
     return Response(
         description="Reader deleted",
@@ -51,17 +74,31 @@ async def delete_reader(reader: ReaderSchemaResponse = Depends(verify_and_get_re
 async def get_reader_books(
     params: BookSearch = Depends(),
     reader: ReaderSchemaResponse = Depends(verify_and_get_reader),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    books = await Reader.search_books_by_params(db, params, reader)
-    return books
+    body = await catalogue_snapshot.books(params, reader)
+    if body is not None:
+        return FastAPIResponse(content=body, media_type="application/json")
+    return await response_cache.respond(
+        "reader_books",
+        _search_cache_params(params, reader),
+        lambda: Reader.search_books_by_params(db, params, reader),
+        BOOKS_ADAPTER,
+    )
 
 
 @router.get("/authors", response_model=list[AuthorSchemaResponse], summary="Get authors for Reader")
 async def get_reader_authors(
     params: BookSearch = Depends(),
     reader: ReaderSchemaResponse = Depends(verify_and_get_reader),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    authors = await Reader.search_authors_by_params(db, params, reader)
-    return authors
+    body = await catalogue_snapshot.authors(params, reader)
+    if body is not None:
+        return FastAPIResponse(content=body, media_type="application/json")
+    return await response_cache.respond(
+        "reader_authors",
+        _search_cache_params(params, reader),
+        lambda: Reader.search_authors_by_params(db, params, reader),
+        AUTHORS_ADAPTER,
+    )
@@ -16,6 +16,10 @@ class AuthorSchemaPatch(BaseModel):
     name: str | None = None
 
 
+class AuthorSchemaBulkPatch(AuthorSchemaPatch):
+    id: int
+
+
 from api.v1.schemas.book import BookSchema
 
 AuthorSchemaResponse.model_rebuild()
@@ -2,6 +2,7 @@ from enum import StrEnum
 
 from pydantic import (
     BaseModel,
+    Field,
 )
 
 
@@ -25,6 +26,10 @@ class BookSchemaPatch(BaseModel):
     author_id: int | None = None
 
 
+class BookSchemaBulkPatch(BookSchemaPatch):
+    id: int
+
+
 class SortingBookBy(StrEnum):
     author = "author"
     book_name = "book_name"
@@ -35,6 +40,7 @@ class BookSearch(BaseModel):
     author: str | None = None
     book_name: str | None = None
     is_age_limit: bool | None = None
+    query: str | None = Field(default=None, description="Full-text search by book name, results are ranked first")
 
 
 from api.v1.schemas.author import AuthorSchemaRequest
@@ -0,0 +1,21 @@
+from enum import StrEnum
+
+from pydantic import (
+    BaseModel,
+)
+
+
+class BulkStatus(StrEnum):
+    created = "created"
+    updated = "updated"
+    deleted = "deleted"
+    soft_deleted = "soft_deleted"
+    not_found = "not_found"
+    invalid = "invalid"
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: int | None = None
+    status: BulkStatus
+    detail: str | None = None
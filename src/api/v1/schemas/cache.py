@@ -0,0 +1,11 @@
+from pydantic import (
+    BaseModel,
+)
+
+
+class CacheStatsSchemaResponse(BaseModel):
+    backend: str | None
+    hits: int
+    misses: int
+    errors: int
+    hit_rate: float
@@ -0,0 +1,17 @@
+from pydantic import (
+    BaseModel,
+)
+
+
+class PoolStatusSchemaResponse(BaseModel):
+    pool: str
+    size: int
+    checked_out: int
+    idle: int
+    overflow: int
+
+
+class ReplicaStatusSchemaResponse(BaseModel):
+    url: str
+    healthy: bool
+    reads: int
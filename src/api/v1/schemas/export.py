@@ -0,0 +1,28 @@
+from enum import StrEnum
+
+from pydantic import (
+    BaseModel,
+    Field,
+)
+
+
+class ExportFormat(StrEnum):
+    csv = "csv"
+    ndjson = "ndjson"
+    parquet = "parquet"
+    arrow = "arrow"
+
+
+class ExportCompression(StrEnum):
+    none = "none"
+    gzip = "gzip"
+    zstd = "zstd"
+
+
+class BookExport(BaseModel):
+    format: ExportFormat = ExportFormat.ndjson
+    compression: ExportCompression = ExportCompression.none
+    is_age_limit: bool | None = Field(
+        default=None, description="Only books with this age limit, as a minor reader sees them with false"
+    )
+    include_deleted: bool = Field(default=False, description="Also books of soft deleted authors, hidden from readers")
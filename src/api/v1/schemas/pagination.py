@@ -0,0 +1,12 @@
+from pydantic import (
+    BaseModel,
+    Field,
+)
+
+from settings import settings
+
+
+class Pagination(BaseModel):
+    limit: int = Field(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX)
+    cursor: str | None = None
+    stream: bool = Field(default=False, description="Stream every row after the cursor as NDJSON, ignores limit")
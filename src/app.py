@@ -1,24 +1,98 @@
-import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
-from fastapi.security import HTTPBasic
+from fastapi.responses import ORJSONResponse
 from loguru import logger
-from passlib.context import CryptContext
-from uvicorn import Config
 
 from api.v1.routes import (
     book,
     reader,
     author,
+    database,
+    cache,
+    metrics,
 )
+from db.database import dispose_engine, replicas, warm_pool
+from db.models.reader import Reader
+from settings import settings
+from utils.admission import AdmissionMiddleware
+from utils.catalogue import catalogue_snapshot
+from utils.metrics import MetricsMiddleware
+from utils.name_index import name_index
+from utils.profiling import ProfilingMiddleware
+from utils.rate_limit import RateLimitMiddleware
+from utils.read_your_writes import ReadYourWritesMiddleware
+
+
+async def load_name_index() -> None:
+    try:
+        await Reader.load_name_index()
+    except Exception as e:
+        # Searches use the database until the next reload
+        logger.error(e)
+        name_index.disable()
+
+
+async def reload_name_index(refresh: float) -> None:
+    while True:
+        try:
+            # Early when the writes cleared too many slots of the index
+            await asyncio.wait_for(name_index.reload.wait(), name_index.reload_interval(refresh))
+        except asyncio.TimeoutError:
+            pass
+        await load_name_index()
+
+
+async def check_replicas(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        await replicas.check()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    if settings.DATABASE_POOL_WARM:
+        try:
+            await warm_pool()
+        except Exception as e:
+            # Requests will retry the connection, do not keep the worker from starting
+            logger.error(e)
+    tasks = []
+    if replicas:
+        await replicas.check()
+        tasks.append(asyncio.create_task(check_replicas(settings.DATABASE_REPLICA_CHECK_INTERVAL)))
+    if settings.NAME_INDEX_ENABLED:
+        await load_name_index()
+        tasks.append(asyncio.create_task(reload_name_index(settings.NAME_INDEX_REFRESH)))
+    yield
+    for task in tasks:
+        task.cancel()
+    catalogue_snapshot.stop()
+    await dispose_engine()
 
 
 def make_app() -> FastAPI:
     app = FastAPI(
-        debug=True,
+        debug=settings.DEBUG,
         title="CRUD BOOK",
         version="0.0.1",
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan,
     )
     include_routers(app=app)
+    if settings.PROFILING_ENABLED:
+        app.add_middleware(ProfilingMiddleware)
+    if replicas and settings.DATABASE_READ_YOUR_WRITES > 0:
+        app.add_middleware(ReadYourWritesMiddleware)
+    # The last one added runs first: requests over the rate limit never wait for admission
+    if settings.ADMISSION_MAX_CONCURRENCY > 0:
+        app.add_middleware(AdmissionMiddleware)
+    if settings.RATE_LIMIT_RATE > 0:
+        app.add_middleware(RateLimitMiddleware)
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
     return app
 
 
@@ -27,19 +101,38 @@ def include_routers(app: FastAPI) -> None:
         book.router,
         author.router,
         reader.router,
+        database.router,
+        cache.router,
+        metrics.router,
     )
     for router in routers:
         app.include_router(router=router)
 
 
-_app = make_app()
-
-
 def main() -> None:
-    for route in _app.routes:
-        logger.info(route)
-    server = uvicorn.Server(config=Config(app=_app, host="0.0.0.0", port=8000))
-    server.run()
+    # Only the launcher needs uvicorn, importing the app for the workers or the benchmarks does not
+    import uvicorn
+
+    if settings.DEBUG:
+        for route in make_app().routes:
+            logger.info(route)
+    # Every worker builds its own app from the factory, uvicorn drains them on SIGTERM
+    uvicorn.run(
+        "app:make_app",
+        factory=True,
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
+        workers=settings.SERVER_WORKERS,
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEP_ALIVE,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        limit_concurrency=settings.SERVER_LIMIT_CONCURRENCY or None,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+        access_log=settings.SERVER_ACCESS_LOG,
+        proxy_headers=settings.SERVER_PROXY_HEADERS,
+        forwarded_allow_ips=settings.SERVER_FORWARDED_ALLOW_IPS,
+    )
 
 
 if __name__ == "__main__":
@@ -1,20 +1,356 @@
-from passlib.context import CryptContext
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import functools
+import time
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from sqlalchemy import Engine, create_engine, event, make_url, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.requests import Request
 
 from settings import settings
+from utils import metrics, profiling
+from utils.read_your_writes import wants_primary
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
 
 POSTGRES_URL = f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOSTNAME}:{settings.DATABASE_PORT}/{settings.POSTGRES_DB}"
+POSTGRES_ASYNC_URL = POSTGRES_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+class SyncStreamResult:
+    """Blocking Result behind the AsyncResult partitions interface."""
+
+    def __init__(self, result):
+        self._result = result
+
+    async def partitions(self, size: int | None = None):
+        for partition in self._result.partitions(size):
+            yield partition
+
+
+class SyncSession:
+    """Blocking Session behind the AsyncSession interface.
+
+    Used when DATABASE_ASYNC is off, so the models keep a single code path
+    and both modes can be benchmarked side by side.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    async def __aenter__(self) -> "SyncSession":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    @property
+    def info(self) -> dict:
+        return self.sync_session.info
+
+    def add(self, instance) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances) -> None:
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        return self.sync_session.execute(statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return self.sync_session.scalar(statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        return self.sync_session.scalars(statement, *args, **kwargs)
+
+    async def stream(self, statement, *args, **kwargs) -> SyncStreamResult:
+        return SyncStreamResult(self.sync_session.execute(statement, *args, **kwargs))
+
+    async def connection(self):
+        return self.sync_session.connection()
+
+    async def get(self, entity, ident, **kwargs):
+        return self.sync_session.get(entity, ident, **kwargs)
+
+    async def delete(self, instance) -> None:
+        self.sync_session.delete(instance)
+
+    async def flush(self, objects=None) -> None:
+        self.sync_session.flush(objects)
+
+    async def refresh(self, instance, attribute_names=None) -> None:
+        self.sync_session.refresh(instance, attribute_names)
+
+    async def commit(self) -> None:
+        self.sync_session.commit()
+
+    async def rollback(self) -> None:
+        self.sync_session.rollback()
+
+    async def close(self) -> None:
+        self.sync_session.close()
+
+
+def engine_options(url: str) -> dict:
+    options = {
+        "echo": settings.DATABASE_ECHO,
+        "pool_pre_ping": settings.DATABASE_POOL_PRE_PING,
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+    }
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return options
+    options.update(
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+    )
+    if url.get_backend_name() == "postgresql" and settings.DATABASE_STATEMENT_TIMEOUT:
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": str(settings.DATABASE_STATEMENT_TIMEOUT)}
+            }
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={settings.DATABASE_STATEMENT_TIMEOUT}"}
+    return options
+
+
+def make_engine(url: str) -> AsyncEngine | Engine:
+    if settings.DATABASE_ASYNC:
+        engine = create_async_engine(url, **engine_options(url))
+        sync_engine = engine.sync_engine
+    else:
+        engine = sync_engine = create_engine(url, **engine_options(url))
+    if settings.METRICS_ENABLED:
+        metrics.instrument_engine(sync_engine)
+    if settings.PROFILING_ENABLED:
+        profiling.instrument_engine(sync_engine)
+    return engine
+
+
+def make_sessionmaker(engine: AsyncEngine | Engine) -> async_sessionmaker | sessionmaker:
+    if settings.DATABASE_ASYNC:
+        return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    return sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine | Engine:
+    """Build the engine on first use, importing the app does not load the driver or touch the database."""
+    if settings.DATABASE_ASYNC:
+        return make_engine(settings.DATABASE_URL or POSTGRES_ASYNC_URL)
+    return make_engine(settings.DATABASE_URL or POSTGRES_URL)
+
+
+@functools.cache
+def get_sessionmaker() -> async_sessionmaker | sessionmaker:
+    return make_sessionmaker(get_engine())
+
+
+def session_local() -> AsyncSession | SyncSession:
+    session = get_sessionmaker()()
+    return session if settings.DATABASE_ASYNC else SyncSession(session)
+
+
+class Replicas:
+    """Read replicas of DATABASE_REPLICA_URLS, used round-robin while they pass the health checks.
 
-engine = create_engine(POSTGRES_URL, echo=True)
-session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    A read session goes to the primary instead when no replica is healthy, when
+    the request asked for it (the client has just written, see
+    utils.read_your_writes) or when this worker committed a write less than
+    DATABASE_READ_YOUR_WRITES seconds ago: what it reads then may be cached for
+    everyone, it must not come from a replica that has not caught up yet.
+    """
 
+    def __init__(self, urls: list[str]):
+        self.urls = urls
+        self.healthy = [True] * len(urls)
+        self.reads = [0] * len(urls)
+        self.next = 0
+        self.primary_until = 0.0
+        # Engines are built on first use, like the primary one
+        self.engines: dict[int, AsyncEngine | Engine] = {}
+        self.sessionmakers: dict[int, async_sessionmaker | sessionmaker] = {}
 
-def get_db():
+    def __bool__(self) -> bool:
+        return bool(self.urls)
+
+    def engine(self, index: int) -> AsyncEngine | Engine:
+        if index not in self.engines:
+            self.engines[index] = make_engine(self.urls[index])
+            self.sessionmakers[index] = make_sessionmaker(self.engines[index])
+        return self.engines[index]
+
+    def pick(self) -> int | None:
+        for _ in range(len(self.urls)):
+            index = self.next % len(self.urls)
+            self.next += 1
+            if self.healthy[index]:
+                return index
+        return None
+
+    def session(self, primary: bool = False) -> AsyncSession | SyncSession:
+        index = None if primary or time.monotonic() < self.primary_until else self.pick()
+        if index is None:
+            session = session_local()
+            # Kept on the primary on purpose, so not served by the loaders shared with other requests
+            session.info["read_primary"] = primary and bool(self)
+            return session
+        self.engine(index)
+        self.reads[index] += 1
+        session = self.sessionmakers[index]()
+        session = session if settings.DATABASE_ASYNC else SyncSession(session)
+        session.info["replica"] = index
+        return session
+
+    def wrote(self) -> None:
+        self.primary_until = time.monotonic() + settings.DATABASE_READ_YOUR_WRITES
+
+    async def ping(self, index: int) -> None:
+        engine = self.engine(index)
+        if isinstance(engine, AsyncEngine):
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+        else:
+
+            def ping() -> None:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+
+            await asyncio.to_thread(ping)
+
+    async def check(self) -> None:
+        """Ping every replica, the ones failing or not answering within the check interval get no reads."""
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(self.ping(index), settings.DATABASE_REPLICA_CHECK_INTERVAL)
+                for index in range(len(self.urls))
+            ),
+            return_exceptions=True,
+        )
+        for index, error in enumerate(results):
+            healthy = error is None
+            if healthy != self.healthy[index]:
+                if healthy:
+                    logger.info("Replica {} is back", self.url(index))
+                else:
+                    logger.error("Replica {} is down: {!r}", self.url(index), error)
+            self.healthy[index] = healthy
+
+    def url(self, index: int) -> str:
+        return make_url(self.urls[index]).render_as_string(hide_password=True)
+
+    def status(self) -> list[dict]:
+        return [
+            {"url": self.url(index), "healthy": self.healthy[index], "reads": self.reads[index]}
+            for index in range(len(self.urls))
+        ]
+
+    async def dispose(self) -> None:
+        for engine in self.engines.values():
+            if isinstance(engine, AsyncEngine):
+                await engine.dispose()
+            else:
+                engine.dispose()
+
+
+replicas = Replicas([url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()])
+
+if replicas and settings.DATABASE_READ_YOUR_WRITES > 0:
+
+    @event.listens_for(Session, "after_commit")
+    def _read_primary_after_commit(session: Session) -> None:
+        replicas.wrote()
+
+
+def read_session_local(primary: bool = False) -> AsyncSession | SyncSession:
+    """Session for reads, on a replica unless ``primary`` is set or there is no healthy one."""
+    return replicas.session(primary)
+
+
+def reads_primary(session: AsyncSession | SyncSession) -> bool:
+    """Whether the session was kept on the primary although replicas are configured."""
+    return session.info.get("read_primary", False)
+
+
+def writes_in_cte() -> bool:
+    """Whether UPDATE and DELETE ... RETURNING can be nested in WITH, SQLite only takes SELECT there."""
+    return get_engine().url.get_backend_name() == "postgresql"
+
+
+@functools.cache
+def get_pwd_context() -> "CryptContext":
+    # passlib and its handler registry are only needed once a password is checked
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def __getattr__(name: str):
+    # Module level engine and pwd_context, built on first access
+    if name == "engine":
+        return get_engine()
+    if name == "pwd_context":
+        return get_pwd_context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def pool_status() -> dict:
+    # NullPool/StaticPool do not keep counters, report zeros for them
+    pool = get_engine().pool
+    return {
+        "pool": pool.__class__.__name__,
+        "size": pool.size() if hasattr(pool, "size") else 0,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else 0,
+        "idle": pool.checkedin() if hasattr(pool, "checkedin") else 0,
+        "overflow": max(pool.overflow(), 0) if hasattr(pool, "overflow") else 0,
+    }
+
+
+async def warm_pool() -> None:
+    """Check out DATABASE_POOL_SIZE connections at once and return them to the pool."""
+    engine = get_engine()
+    size = settings.DATABASE_POOL_SIZE if hasattr(engine.pool, "size") else 1
+    if isinstance(engine, AsyncEngine):
+
+        async def ping() -> None:
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        await asyncio.gather(*(ping() for _ in range(size)))
+    else:
+        with ExitStack() as stack:
+            for _ in range(size):
+                stack.enter_context(engine.connect()).execute(text("SELECT 1"))
+
+
+async def dispose_engine() -> None:
+    await replicas.dispose()
+    if not get_engine.cache_info().currsize:
+        return
+    engine = get_engine()
+    if isinstance(engine, AsyncEngine):
+        await engine.dispose()
+    else:
+        engine.dispose()
+
+
+async def get_db():
     db = session_local()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_read_db(request: Request):
+    """Session for GET requests, on a replica unless the client has just written."""
+    db = read_session_local(primary=wants_primary(request))
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -0,0 +1,60 @@
+"""Export every book with its author, the same stream as GET /v1/internal/book/export.
+
+    cd src && python3 -m db.export --format parquet --output books.parquet
+    cd src && python3 -m db.export --format csv --compression zstd --is-age-limit false > books.csv.zst
+
+Rows are read from a server-side cursor and written a partition at a time, so
+memory does not grow with the catalogue.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from api.v1.schemas.export import ExportCompression, ExportFormat
+from db.database import dispose_engine
+from db.models.reader import Reader  # noqa: F401
+from db.models.book import EXPORT_COLUMNS, Book
+from utils.export import encode, missing_package
+
+
+def age_limit(value: str) -> bool:
+    if value not in ("true", "false"):
+        raise argparse.ArgumentTypeError("expected true or false")
+    return value == "true"
+
+
+async def export(output, args: argparse.Namespace) -> None:
+    try:
+        partitions = Book.iter_export(args.is_age_limit, args.include_deleted)
+        async for chunk in encode(partitions, EXPORT_COLUMNS, args.format, args.compression):
+            output.write(chunk)
+    finally:
+        await dispose_engine()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", type=ExportFormat, choices=list(ExportFormat), default=ExportFormat.ndjson)
+    parser.add_argument(
+        "--compression", type=ExportCompression, choices=list(ExportCompression), default=ExportCompression.none
+    )
+    parser.add_argument("--is-age-limit", type=age_limit, help="only books with this age limit: true or false")
+    parser.add_argument("--include-deleted", action="store_true", help="also books of soft deleted authors")
+    parser.add_argument("--output", help="file to write, standard output by default")
+    args = parser.parse_args()
+
+    package = missing_package(args.format, args.compression)
+    if package:
+        parser.error(f"{args.format} {args.compression} export requires the {package} package")
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        asyncio.run(export(output, args))
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Import authors and books from CSV or NDJSON files, for publisher feeds and seeding.
+
+    cd src && python3 -m db.ingest --books books.csv
+    cd src && python3 -m db.ingest --authors authors.ndjson --books books.ndjson --books more.csv
+
+Author files have a ``name`` column, book files ``name``, ``author_name`` and
+``is_age_limit``, the columns of ``python3 -m db.export``. Authors are matched
+by name against the authors not deleted and created when missing, books by
+author and name: an existing book gets the imported age limit, the others are
+inserted. The rows are copied into temporary staging tables (COPY on Postgres,
+multi-row INSERT on SQLite) and merged with a few set-based statements in one
+transaction, instead of ``Book.create_book`` once per row.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from array import array
+from itertools import islice
+from typing import Iterable
+
+from loguru import logger
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    exists,
+    insert,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.schema import CreateIndex, CreateTable, DropTable
+
+from db.database import SyncSession, dispose_engine, session_local
+from db.models.author import Author
+from db.models.book import Book
+from settings import settings
+from utils.ingest import Catalogue, read_rows
+from utils.response_cache import RedisBackend, response_cache
+
+staging = MetaData()
+staging_author = Table("import_author", staging, Column("name", String, nullable=False), prefixes=["TEMPORARY"])
+staging_book = Table(
+    "import_book",
+    staging,
+    Column("name", String, nullable=False),
+    Column("is_age_limit", Boolean, nullable=False),
+    Column("author_id", Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+)
+# Created once the rows are copied, the merge looks the books up by author and name from both sides
+staging_book_index = Index("ix_import_book_author_id_name", staging_book.c.author_id, staging_book.c.name)
+
+
+async def driver_connection(session: AsyncSession | SyncSession):
+    """Name of the DBAPI driver and its connection, in the transaction of ``session``."""
+    connection = await session.connection()
+    if isinstance(connection, AsyncConnection):
+        return connection.dialect.driver, (await connection.get_raw_connection()).driver_connection
+    return connection.dialect.driver, connection.connection.driver_connection
+
+
+async def copy_rows(session: AsyncSession | SyncSession, table: Table, records: Iterable[tuple]) -> int:
+    """Load ``records`` into ``table`` IMPORT_BATCH_SIZE rows at a time, the fastest way the driver has."""
+    driver, connection = await driver_connection(session)
+    columns = [column.name for column in table.columns]
+    records = iter(records)
+    copied = 0
+    started = time.perf_counter()
+    while batch := list(islice(records, settings.IMPORT_BATCH_SIZE)):
+        if driver == "asyncpg":
+            await connection.copy_records_to_table(table.name, records=batch, columns=columns)
+        elif driver == "psycopg2":
+            copy_psycopg2(connection, table.name, columns, batch)
+        else:
+            await session.execute(insert(table), [dict(zip(columns, record)) for record in batch])
+        copied += len(batch)
+        logger.info("{}: {} rows, {:.0f} rows/s", table.name, copied, copied / (time.perf_counter() - started))
+    return copied
+
+
+def copy_psycopg2(connection, table: str, columns: list[str], batch: list[tuple]) -> None:
+    import csv
+    import io
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+async def resolve_authors(session: AsyncSession | SyncSession, catalogue: Catalogue) -> tuple[array, int]:
+    """Ids of the catalogue authors by position, creating the missing ones, and how many were created."""
+    author_ids = array("q", bytes(8 * len(catalogue.author_names)))
+    result = await session.stream(
+        select(Author.id, Author.name).where(Author.is_deleted == False).order_by(Author.id),
+        execution_options={"yield_per": settings.IMPORT_BATCH_SIZE},
+    )
+    async for partition in result.partitions():
+        for author_id, name in partition:
+            position = catalogue.author_positions.get(name)
+            # The oldest author of a repeated name wins
+            if position is not None and not author_ids[position]:
+                author_ids[position] = author_id
+    missing = [(name,) for name, position in catalogue.author_positions.items() if not author_ids[position]]
+    if missing:
+        await copy_rows(session, staging_author, missing)
+        created = await session.execute(
+            insert(Author).from_select(["name"], select(staging_author.c.name)).returning(Author.id, Author.name)
+        )
+        for author_id, name in created:
+            author_ids[catalogue.author_positions[name]] = author_id
+    return author_ids, len(missing)
+
+
+async def merge_books(session: AsyncSession | SyncSession) -> tuple[int, int]:
+    """Upsert the staged books, numbers of the books updated and inserted."""
+    same_book = exists().where(Book.author_id == staging_book.c.author_id, Book.name == staging_book.c.name)
+    # Authors embed their books, bump the authors of every book about to change, as Book.bump_author_versions does.
+    # A join on author and name: with the age limit in the lookup SQLite probes the books by ix_book_is_age_limit
+    changed = (
+        select(staging_book.c.author_id)
+        .outerjoin(Book, (Book.author_id == staging_book.c.author_id) & (Book.name == staging_book.c.name))
+        .where(or_(Book.id.is_(None), Book.is_age_limit.is_distinct_from(staging_book.c.is_age_limit)))
+    )
+    await session.execute(update(Author).where(Author.id.in_(changed)).values(version=Author.version + 1))
+    updated = await session.execute(
+        update(Book)
+        .where(
+            Book.author_id == staging_book.c.author_id,
+            Book.name == staging_book.c.name,
+            Book.is_age_limit.is_distinct_from(staging_book.c.is_age_limit),
+        )
+        .values(is_age_limit=staging_book.c.is_age_limit, version=Book.version + 1)
+    )
+    inserted = await session.execute(
+        insert(Book).from_select(
+            ["name", "is_age_limit", "author_id"],
+            select(staging_book.c.name, staging_book.c.is_age_limit, staging_book.c.author_id).where(~same_book),
+        )
+    )
+    return updated.rowcount, inserted.rowcount
+
+
+async def import_catalogue(catalogue: Catalogue) -> dict:
+    async with session_local() as session:
+        try:
+            for table in (staging_author, staging_book):
+                await session.execute(DropTable(table, if_exists=True))
+                await session.execute(CreateTable(table))
+            author_ids, created = await resolve_authors(session, catalogue)
+            await copy_rows(session, staging_book, catalogue.book_records(author_ids))
+            await session.execute(CreateIndex(staging_book_index))
+            # Temporary tables are never analyzed by autovacuum or SQLite, the merge plans need the row counts
+            await session.execute(text(f"ANALYZE {staging_book.name}"))
+            updated, inserted = await merge_books(session)
+            for table in (staging_author, staging_book):
+                await session.execute(DropTable(table))
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+    # Only a shared backend reaches the running workers, this process has its own memory
+    await response_cache.invalidate()
+    if not isinstance(response_cache.backend, RedisBackend):
+        logger.warning(
+            "Without RESPONSE_CACHE_BACKEND=redis the running workers see the import after RESPONSE_CACHE_TTL,"
+            " CATALOGUE_SNAPSHOT_TTL and NAME_INDEX_REFRESH, or once restarted"
+        )
+    return {"authors_created": created, "books_updated": updated, "books_inserted": inserted}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    started = time.perf_counter()
+    catalogue = Catalogue()
+    for paths, add in ((args.authors, catalogue.add_authors), (args.books, catalogue.add_books)):
+        for path in paths:
+            with open(path, "rb") as source:
+                add(read_rows(source, args.format == "ndjson" or path.endswith(".ndjson")), path)
+    logger.info(
+        "read {} rows in {:.1f} s: {} authors, {} books, {} invalid rows",
+        catalogue.rows,
+        time.perf_counter() - started,
+        len(catalogue.author_names),
+        len(catalogue.books),
+        catalogue.errors,
+    )
+    try:
+        report = await import_catalogue(catalogue)
+    finally:
+        await dispose_engine()
+    elapsed = time.perf_counter() - started
+    report.update(rows=catalogue.rows, invalid=catalogue.errors, seconds=round(elapsed, 2))
+    logger.info(
+        "imported {} rows in {:.1f} s, {:.0f} rows/s: {}", catalogue.rows, elapsed, catalogue.rows / elapsed, report
+    )
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--authors", action="append", default=[], help="CSV or NDJSON file of authors")
+    parser.add_argument("--books", action="append", default=[], help="CSV or NDJSON file of books")
+    parser.add_argument(
+        "--format", choices=("csv", "ndjson"), help="format of every file, by default .ndjson files are NDJSON"
+    )
+    args = parser.parse_args()
+    if not args.authors and not args.books:
+        parser.error("nothing to import, pass --authors or --books")
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
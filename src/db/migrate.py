@@ -0,0 +1,50 @@
+"""Bring the database to the latest migration, skipping alembic when it is already there.
+
+    cd src && python3 -m db.migrate
+
+Comparing the script heads with the alembic_version table takes one query,
+``alembic upgrade head`` loads the environment and every model first, on
+every container start.
+"""
+
+import os
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from loguru import logger
+from sqlalchemy import create_engine, pool
+
+from db.database import POSTGRES_URL
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def alembic_config() -> Config:
+    config = Config(os.path.join(DB_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(DB_DIR, "migrations"))
+    return config
+
+
+def current_revisions(url: str) -> set[str]:
+    engine = create_engine(url, poolclass=pool.NullPool)
+    try:
+        with engine.connect() as connection:
+            return set(MigrationContext.configure(connection).get_current_heads())
+    finally:
+        engine.dispose()
+
+
+def main(url: str = POSTGRES_URL) -> None:
+    config = alembic_config()
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    if current_revisions(url) == heads:
+        logger.info("Database is at {}, no migrations to apply", ", ".join(sorted(heads)))
+        return
+    from alembic import command
+
+    command.upgrade(config, "head")
+
+
+if __name__ == "__main__":
+    main()
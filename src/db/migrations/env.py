@@ -22,6 +22,7 @@ config.set_section_option(section, "DB_USER", settings.POSTGRES_USER)
 config.set_section_option(section, "DB_PASS", settings.POSTGRES_PASSWORD)
 config.set_section_option(section, "DB_NAME", settings.POSTGRES_DB)
 config.set_section_option(section, "DB_HOST", settings.POSTGRES_HOSTNAME)
+config.set_section_option(section, "DB_PORT", str(settings.DATABASE_PORT))
 
 fileConfig(config.config_file_name)
 
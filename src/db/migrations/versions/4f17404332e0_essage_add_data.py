@@ -9,12 +9,6 @@ from typing import Sequence, Union
 
 from alembic import op
 import sqlalchemy as sa
-from sqlalchemy import orm
-from sqlalchemy.orm import Session
-
-from db.database import get_db
-from db.models.author import Author
-from db.models.book import Book
 
 # revision identifiers, used by Alembic.
 revision: str = "4f17404332e0"
@@ -23,32 +17,46 @@ branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
+# The tables as of this revision, the models map columns added by later migrations
+author_table = sa.table(
+    "author",
+    sa.column("id", sa.Integer),
+    sa.column("name", sa.String),
+    sa.column("is_deleted", sa.Boolean),
+)
+book_table = sa.table(
+    "book",
+    sa.column("id", sa.Integer),
+    sa.column("name", sa.String),
+    sa.column("is_age_limit", sa.Boolean),
+    sa.column("author_id", sa.Integer),
+)
+
+
 def upgrade() -> None:
-    session = Session(op.get_bind())
-    new_author1 = Author(name="Автор1")
-    new_author2 = Author(name="Автор2")
-    new_author3 = Author(name="Автор3", is_deleted=True)
-    session.add(new_author1)
-    session.add(new_author2)
-    session.add(new_author3)
-    session.commit()
-    session.refresh(new_author1)
-    session.refresh(new_author2)
-    session.refresh(new_author3)
-    books = [
-        Book(name="Книга9", is_age_limit=True, author_id=new_author1.id),
-        Book(name="Книга8", is_age_limit=False, author_id=new_author1.id),
-        Book(name="Книга7", is_age_limit=True, author_id=new_author1.id),
-        Book(name="Книга6", is_age_limit=False, author_id=new_author2.id),
-        Book(name="Книга5", is_age_limit=True, author_id=new_author2.id),
-        Book(name="Книга4", is_age_limit=True, author_id=new_author2.id),
-        Book(name="Книга3", is_age_limit=False, author_id=new_author3.id),
-        Book(name="Книга2", is_age_limit=False, author_id=new_author3.id),
-        Book(name="Книга1", is_age_limit=False, author_id=new_author3.id),
-    ]
-    for book in books:
-        session.add(book)
-    session.commit()
+    op.bulk_insert(
+        author_table,
+        [
+            {"name": "Автор1", "is_deleted": False},
+            {"name": "Автор2", "is_deleted": False},
+            {"name": "Автор3", "is_deleted": True},
+        ],
+    )
+    author_ids = dict(op.get_bind().execute(sa.select(author_table.c.name, author_table.c.id)).all())
+    op.bulk_insert(
+        book_table,
+        [
+            {"name": "Книга9", "is_age_limit": True, "author_id": author_ids["Автор1"]},
+            {"name": "Книга8", "is_age_limit": False, "author_id": author_ids["Автор1"]},
+            {"name": "Книга7", "is_age_limit": True, "author_id": author_ids["Автор1"]},
+            {"name": "Книга6", "is_age_limit": False, "author_id": author_ids["Автор2"]},
+            {"name": "Книга5", "is_age_limit": True, "author_id": author_ids["Автор2"]},
+            {"name": "Книга4", "is_age_limit": True, "author_id": author_ids["Автор2"]},
+            {"name": "Книга3", "is_age_limit": False, "author_id": author_ids["Автор3"]},
+            {"name": "Книга2", "is_age_limit": False, "author_id": author_ids["Автор3"]},
+            {"name": "Книга1", "is_age_limit": False, "author_id": author_ids["Автор3"]},
+        ],
+    )
 
 
 def downgrade() -> None:
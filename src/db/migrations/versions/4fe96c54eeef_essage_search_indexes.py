@@ -0,0 +1,54 @@
+"""essage=search_indexes
+
+Revision ID: 4fe96c54eeef
+Revises: 4f17404332e0
+Create Date: 2026-10-18 10:12:41.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4fe96c54eeef"
+down_revision: Union[str, None] = "4f17404332e0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Serve lower(name) LIKE '%...%' from search_books_by_params and search_authors_by_params
+    op.create_index(
+        "ix_book_name_trgm",
+        "book",
+        [sa.text("lower(name) gin_trgm_ops")],
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_author_name_trgm",
+        "author",
+        [sa.text("lower(name) gin_trgm_ops")],
+        postgresql_using="gin",
+    )
+    # The expression must match FULL_TEXT_CONFIG in db/models/reader.py
+    op.create_index(
+        "ix_book_name_fts",
+        "book",
+        [sa.text("to_tsvector('simple'::regconfig, name)")],
+        postgresql_using="gin",
+    )
+    op.create_index(op.f("ix_book_author_id"), "book", ["author_id"], unique=False)
+    op.create_index(op.f("ix_book_is_age_limit"), "book", ["is_age_limit"], unique=False)
+    op.create_index(op.f("ix_author_is_deleted"), "author", ["is_deleted"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_author_is_deleted"), table_name="author")
+    op.drop_index(op.f("ix_book_is_age_limit"), table_name="book")
+    op.drop_index(op.f("ix_book_author_id"), table_name="book")
+    op.drop_index("ix_book_name_fts", table_name="book")
+    op.drop_index("ix_author_name_trgm", table_name="author")
+    op.drop_index("ix_book_name_trgm", table_name="book")
@@ -0,0 +1,29 @@
+"""essage=row_versions
+
+Revision ID: 9c1d7e52a3b8
+Revises: 4fe96c54eeef
+Create Date: 2026-10-18 14:36:05.518420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9c1d7e52a3b8"
+down_revision: Union[str, None] = "4fe96c54eeef"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Row versions the ETags of the book and author endpoints are derived from
+    op.add_column("book", sa.Column("version", sa.Integer(), server_default=sa.text("1"), nullable=False))
+    op.add_column("author", sa.Column("version", sa.Integer(), server_default=sa.text("1"), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column("author", "version")
+    op.drop_column("book", "version")
@@ -1,48 +1,165 @@
-from typing import Type
+from collections import defaultdict
+from typing import AsyncIterator, Sequence, Type
 
 from fastapi import HTTPException, status
 from loguru import logger
-from sqlalchemy import Column, String, Integer, Boolean
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, String, Integer, Boolean, Row, Select, select, insert, update, delete, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.sql import expression
 
-from api.v1.schemas.author import AuthorSchemaRequest, AuthorSchemaResponse, AuthorSchemaPatch
+from api.v1.schemas.author import AuthorSchemaRequest, AuthorSchemaResponse, AuthorSchemaPatch, AuthorSchemaBulkPatch
 from db.base import BaseModel
+from db.database import read_session_local, reads_primary, writes_in_cte
 from db.models.book import Book
+from settings import settings
+from utils.batch_loader import BatchLoader
+from utils.bulk import chunks
+from utils.etag import make_etag
+from utils.name_index import name_index
+from utils.response_cache import response_cache
 
 
 class Author(BaseModel):
     __tablename__ = "author"
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    is_deleted = Column(Boolean, server_default=expression.false(), default=False)
-    books = relationship(Book, back_populates="author")
+    is_deleted = Column(Boolean, server_default=expression.false(), default=False, index=True)
+    # Bumped on every update of the author or of one of its books, ETags are derived from it
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    books = relationship(Book, back_populates="author", lazy="raise_on_sql")
 
     @classmethod
-    async def get_all(cls, session: Session) -> list[Type["Author"]]:
-        return session.query(Author).all()
+    def etag(cls, authors: Sequence["Author"]) -> str:
+        return make_etag(*((author.id, author.version) for author in authors))
 
     @classmethod
-    async def get_by_id(
-        cls,
-        session: Session,
-        author_id: str,
-    ) -> AuthorSchemaResponse:
-        author = session.query(Author).filter(Author.id == author_id).first()
-        if not author:
+    async def get_page_etag(cls, session: AsyncSession, limit: int, after_id: int = 0) -> str:
+        rows = await session.execute(
+            select(Author.id, Author.version).where(Author.id > after_id).order_by(Author.id).limit(limit + 1)
+        )
+        return make_etag(*(tuple(row) for row in rows))
+
+    @classmethod
+    async def get_etag_by_id(cls, session: AsyncSession, author_id: int) -> str | None:
+        row = (await session.execute(select(Author.id, Author.version).where(Author.id == author_id))).first()
+        return make_etag(tuple(row)) if row else None
+
+    @classmethod
+    def select_with_books(cls) -> Select:
+        # One extra IN query for the books of every selected author
+        return select(Author).options(selectinload(Author.books))
+
+    @classmethod
+    def select_rows(cls) -> Select:
+        # Plain columns for the list endpoints, building ORM objects costs more than the query itself
+        return select(Author.id, Author.name, Author.version)
+
+    @classmethod
+    def rows_etag(cls, rows: Sequence[Row]) -> str:
+        return make_etag(*((row.id, row.version) for row in rows))
+
+    @classmethod
+    async def to_response(cls, session: AsyncSession, rows: Sequence[Row]) -> list[dict]:
+        """Render rows of ``select_rows`` in the shape of AuthorSchemaResponse without validating them again.
+
+        Books of all the authors are read with one extra query, like selectinload does.
+        """
+        books = defaultdict(list)
+        if rows:
+            result = await session.execute(
+                select(Book.author_id, Book.name, Book.is_age_limit)
+                .where(Book.author_id.in_([row.id for row in rows]))
+                .order_by(Book.id)
+            )
+            for author_id, name, is_age_limit in result:
+                books[author_id].append({"name": name, "is_age_limit": is_age_limit})
+        return [{"name": row.name, "id": row.id, "books": books[row.id]} for row in rows]
+
+    @classmethod
+    async def refresh_name_index(cls, session: AsyncSession, author_ids, rows: Sequence[Row] | None = None) -> None:
+        """Re-read the written authors into the name index, the write itself is already committed.
+
+        ``rows`` returned by the write with id, name and is_deleted save the query.
+        """
+        if not (name_index.ready or name_index.loading):
+            return
+        author_ids = {int(author_id) for author_id in author_ids}
+        if rows is not None:
+            name_index.update_authors(author_ids, [(row.id, row.name, row.is_deleted) for row in rows])
+            return
+        try:
+            rows = []
+            for chunk in chunks(list(author_ids)):
+                rows.extend(
+                    await session.execute(select(Author.id, Author.name, Author.is_deleted).where(Author.id.in_(chunk)))
+                )
+            name_index.update_authors(author_ids, rows)
+        except Exception as e:
+            # A stale index would hide the books of the written authors from searches
+            logger.error(e)
+            name_index.disable()
+
+    @classmethod
+    async def get_all(cls, session: AsyncSession, limit: int, after_id: int = 0) -> Sequence[Row]:
+        # One extra row tells the caller whether there is a next page
+        result = await session.execute(
+            cls.select_rows().where(Author.id > after_id).order_by(Author.id).limit(limit + 1)
+        )
+        return result.all()
+
+    @classmethod
+    async def iter_all(cls, after_id: int = 0, primary: bool = False) -> AsyncIterator[list[dict]]:
+        # Runs on its own session: the request session is closed before a streamed body is sent
+        async with read_session_local(primary) as session:
+            result = await session.stream(
+                cls.select_rows()
+                .where(Author.id > after_id)
+                .order_by(Author.id)
+                .execution_options(yield_per=settings.STREAM_BATCH_SIZE)
+            )
+            async for partition in result.partitions():
+                yield await cls.to_response(session, partition)
+
+    @classmethod
+    async def get_by_ids(cls, session: AsyncSession, author_ids: list[int]) -> dict[int, tuple[str, dict]]:
+        """ETag and rendered author by id, ids that do not exist are left out."""
+        rows = []
+        for chunk in chunks(author_ids):
+            rows.extend(await session.execute(cls.select_rows().where(Author.id.in_(chunk))))
+        return {row.id: (cls.rows_etag([row]), item) for row, item in zip(rows, await cls.to_response(session, rows))}
+
+    @classmethod
+    async def load_by_ids(cls, author_ids: list[int]) -> dict[int, tuple[str, dict]]:
+        # Runs on its own session: a batch serves several requests
+        async with read_session_local() as session:
+            return await cls.get_by_ids(session, author_ids)
+
+    @classmethod
+    async def get_by_id(cls, session: AsyncSession, author_id: int) -> tuple[str, dict]:
+        """ETag and rendered author, concurrent lookups are merged into one query by author_loader."""
+        # The loaders read from the replicas, a request kept on the primary queries its own session
+        if settings.BATCH_LOAD_WINDOW > 0 and not reads_primary(session):
+            found = await author_loader.load(author_id)
+        else:
+            found = (await cls.get_by_ids(session, [author_id])).get(author_id)
+        if not found:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"No author with this id: {author_id} found",
+                status_code=status.HTTP_404_NOT_FOUND, detail=f"No author with this id: {author_id} found"
             )
-        return author
+        return found
 
     @classmethod
-    async def create_author(cls, session: Session, author: AuthorSchemaRequest) -> AuthorSchemaResponse:
+    async def create_author(cls, session: AsyncSession, author: AuthorSchemaRequest) -> AuthorSchemaResponse:
         try:
             new_author = Author(**author.model_dump())
             session.add(new_author)
-            session.commit()
-            session.refresh(new_author)
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, [new_author.id])
+            new_author = await session.scalar(
+                cls.select_with_books().where(Author.id == new_author.id).execution_options(populate_existing=True)
+            )
         except Exception as e:
             logger.error(e)
             raise HTTPException(
@@ -52,44 +169,190 @@ class Author(BaseModel):
         return new_author
 
     @classmethod
-    async def update_author(cls, session: Session, author_id: str, author: AuthorSchemaPatch) -> AuthorSchemaResponse:
+    async def update_author(cls, session: AsyncSession, author_id: int, author: AuthorSchemaPatch) -> dict:
+        """Update the author, rendered in the shape of AuthorSchemaResponse."""
         try:
-            author_query = session.query(Author).filter(Author.id == author_id)
-            author_db = author_query.first()
-            if not author_db:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"No author with this id: {author_id} found",
+            written = (
+                update(Author)
+                .where(Author.id == author_id)
+                .values(**author.model_dump(exclude_unset=True, exclude_none=True), version=Author.version + 1)
+                .returning(Author.id, Author.name, Author.is_deleted)
+            )
+            if writes_in_cte():
+                row, response = cls.with_books_response(
+                    (await session.execute(cls.select_with_written_books(written.cte("written_author")))).all()
                 )
-            author_query.update(author.model_dump(exclude_unset=True, exclude_none=True), synchronize_session=False)
-            session.commit()
-            session.refresh(author_db)
+            else:
+                row = (await session.execute(written)).first()
+                # The books are only read for the response, in the same transaction
+                response = (await cls.to_response(session, [row]))[0] if row is not None else None
+            if row is None:
+                await session.rollback()
+            else:
+                await session.commit()
+                await response_cache.invalidate()
+                await cls.refresh_name_index(session, [row.id], [row])
         except Exception as e:
             logger.error(e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed update author with this id: {author_id}",
             )
-        return author_db
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=f"No author with this id: {author_id} found"
+            )
+        return response
 
     @classmethod
-    async def delete_author(cls, session: Session, author_id: str):
+    def select_with_written_books(cls, written) -> Select:
+        """The author written by the ``written`` CTE joined with its books, one row per book, ordered as to_response."""
+        return (
+            select(
+                written.c.id,
+                written.c.name,
+                written.c.is_deleted,
+                Book.name.label("book_name"),
+                Book.is_age_limit,
+            )
+            .outerjoin(Book, Book.author_id == written.c.id)
+            .order_by(Book.id)
+        )
+
+    @classmethod
+    def with_books_response(cls, rows: Sequence[Row]) -> tuple[Row | None, dict | None]:
+        """The author row and its rendered response from the rows of select_with_written_books."""
+        if not rows:
+            return None, None
+        books = [{"name": row.book_name, "is_age_limit": row.is_age_limit} for row in rows if row.book_name is not None]
+        return rows[0], {"name": rows[0].name, "id": rows[0].id, "books": books}
+
+    @classmethod
+    async def bulk_create_authors(cls, session: AsyncSession, authors: list[AuthorSchemaRequest]) -> list[int]:
+        ids = []
         try:
-            author_query = session.query(Author).filter(Author.id == author_id)
-            author = author_query.first()
-            if not author:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"No author with this id: {author_id} found",
-                )
-            if not author.books:
-                author_query.delete(synchronize_session=False)
+            for chunk in chunks([author.model_dump() for author in authors]):
+                # Multi-row INSERT ... RETURNING, ids come back in the order of the rows
+                result = await session.scalars(insert(Author).returning(Author.id, sort_by_parameter_order=True), chunk)
+                ids.extend(result.all())
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, ids)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed create authors",
+            )
+        return ids
+
+    @classmethod
+    async def bulk_update_authors(cls, session: AsyncSession, authors: list[AuthorSchemaBulkPatch]) -> set[int]:
+        try:
+            existing_ids = set()
+            for chunk in chunks(list({author.id for author in authors})):
+                existing_ids.update(await session.scalars(select(Author.id).where(Author.id.in_(chunk))))
+            rows = [
+                {"id": author.id, **author.model_dump(exclude_unset=True, exclude_none=True)}
+                for author in authors
+                if author.id in existing_ids
+            ]
+            # ORM bulk UPDATE by primary key, rows with the same set of fields share one executemany
+            for chunk in chunks([row for row in rows if len(row) > 1]):
+                await session.execute(update(Author), chunk)
+            for chunk in chunks(list(existing_ids)):
+                await session.execute(update(Author).where(Author.id.in_(chunk)).values(version=Author.version + 1))
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, existing_ids)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed update authors",
+            )
+        return existing_ids
+
+    @classmethod
+    async def delete_author(cls, session: AsyncSession, author_id: int):
+        """Soft delete the author if it has books, remove it otherwise."""
+        try:
+            soft_delete = (
+                update(Author)
+                .where(Author.id == author_id, Author.books.any())
+                .values(is_deleted=True, version=Author.version + 1)
+                .returning(Author.id, Author.name, Author.is_deleted)
+            )
+            hard_delete = delete(Author).where(Author.id == author_id, ~Author.books.any()).returning(Author.id)
+            if writes_in_cte():
+                # Both parts see the books as they were before the statement, exactly one of them matches
+                soft, hard = soft_delete.cte("soft_deleted_author"), hard_delete.cte("deleted_author")
+                rows = (
+                    await session.execute(
+                        select(soft.c.id, soft.c.name, soft.c.is_deleted, expression.true().label("soft")).union_all(
+                            select(hard.c.id, expression.null(), expression.null(), expression.false())
+                        )
+                    )
+                ).all()
+                soft_deleted = [row for row in rows if row.soft]
+                found = bool(rows)
+            else:
+                soft_deleted = (await session.execute(soft_delete)).all()
+                found = bool(soft_deleted) or await session.scalar(hard_delete) is not None
+            if found:
+                await session.commit()
+                await response_cache.invalidate()
+                await cls.refresh_name_index(session, [author_id], soft_deleted)
             else:
-                author_query.update({"is_deleted": True}, synchronize_session=False)
-                session.commit()
+                await session.rollback()
         except Exception as e:
             logger.error(e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed delete author with this id: {author_id}",
             )
+        if not found:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=f"No author with this id: {author_id} found"
+            )
+
+    @classmethod
+    async def bulk_delete_authors(cls, session: AsyncSession, author_ids: list[int]) -> tuple[set[int], set[int]]:
+        """Same rule as delete_author: authors with books are soft deleted, the rest are removed.
+
+        Returns the deleted and the soft deleted ids.
+        """
+        try:
+            deleted_ids, soft_deleted_ids = set(), set()
+            for chunk in chunks(author_ids):
+                soft_deleted_ids.update(
+                    await session.scalars(
+                        update(Author)
+                        .where(Author.id.in_(chunk), Author.books.any())
+                        .values(is_deleted=True, version=Author.version + 1)
+                        .returning(Author.id)
+                    )
+                )
+                deleted_ids.update(
+                    await session.scalars(
+                        delete(Author).where(Author.id.in_(chunk), ~Author.books.any()).returning(Author.id)
+                    )
+                )
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, deleted_ids | soft_deleted_ids)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed delete authors",
+            )
+        return deleted_ids, soft_deleted_ids
+
+
+author_loader = BatchLoader(
+    Author.load_by_ids,
+    window=settings.BATCH_LOAD_WINDOW,
+    max_batch=settings.BATCH_LOAD_MAX_SIZE,
+    generation=lambda: response_cache.invalidations,
+)
@@ -1,44 +1,237 @@
-from typing import Type
+from typing import AsyncIterator, Sequence, Type
 
 from fastapi import HTTPException, status
 from loguru import logger
-from sqlalchemy import Column, String, Boolean, ForeignKey, Integer
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import (
+    Column,
+    String,
+    Boolean,
+    ForeignKey,
+    Integer,
+    Row,
+    Select,
+    select,
+    insert,
+    update,
+    delete,
+    text,
+    or_,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, joinedload
 
-from api.v1.schemas.book import BookSchemaResponse, BookSchemaRequest, BookSchemaPatch
+from api.v1.schemas.book import BookSchemaResponse, BookSchemaRequest, BookSchemaPatch, BookSchemaBulkPatch
 from db.base import BaseModel
+from db.database import read_session_local, reads_primary, writes_in_cte
+from settings import settings
+from utils.batch_loader import BatchLoader
+from utils.bulk import chunks
+from utils.etag import make_etag
+from utils.name_index import name_index
+from utils.response_cache import response_cache
+
+# Columns of select_export and their types
+EXPORT_COLUMNS = {"id": int, "name": str, "is_age_limit": bool, "author_id": int, "author_name": str}
 
 
 class Book(BaseModel):
     __tablename__ = "book"
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    is_age_limit = Column(Boolean, default=False)
-    author_id = Column(Integer, ForeignKey("author.id", ondelete="RESTRICT"))
-    author = relationship("Author", back_populates="books")
+    is_age_limit = Column(Boolean, default=False, index=True)
+    author_id = Column(Integer, ForeignKey("author.id", ondelete="RESTRICT"), index=True)
+    # Bumped on every update, ETags are derived from it
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    author = relationship("Author", back_populates="books", lazy="raise_on_sql")
+
+    @classmethod
+    def author_model(cls):
+        # The author module imports this one, resolve the class through the relationship
+        return cls.author.property.mapper.class_
+
+    @classmethod
+    def etag(cls, books: Sequence["Book"]) -> str:
+        return make_etag(*((book.id, book.version, book.author.version if book.author else None) for book in books))
+
+    @classmethod
+    def select_versions(cls) -> Select:
+        author = cls.author_model()
+        return select(Book.id, Book.version, author.version).outerjoin(author, Book.author_id == author.id)
+
+    @classmethod
+    async def get_page_etag(cls, session: AsyncSession, limit: int, after_id: int = 0) -> str:
+        rows = await session.execute(cls.select_versions().where(Book.id > after_id).order_by(Book.id).limit(limit + 1))
+        return make_etag(*(tuple(row) for row in rows))
+
+    @classmethod
+    async def get_etag_by_id(cls, session: AsyncSession, book_id: int) -> str | None:
+        row = (await session.execute(cls.select_versions().where(Book.id == book_id))).first()
+        return make_etag(tuple(row)) if row else None
+
+    @classmethod
+    async def bump_author_versions(cls, session: AsyncSession, author_ids) -> None:
+        # Authors embed their books, a book write changes the author representation too
+        author_ids = {author_id for author_id in author_ids if author_id is not None}
+        if author_ids:
+            author = cls.author_model()
+            await session.execute(update(author).where(author.id.in_(author_ids)).values(version=author.version + 1))
+
+    @classmethod
+    def select_with_author(cls) -> Select:
+        # Responses serialise the author, load it with the book in a single query
+        return select(Book).options(joinedload(Book.author))
+
+    @classmethod
+    def select_rows(cls) -> Select:
+        # Plain columns for the list endpoints, building ORM objects costs more than the query itself
+        author = cls.author_model()
+        return select(
+            Book.id,
+            Book.name,
+            Book.is_age_limit,
+            Book.version,
+            author.name.label("author_name"),
+            author.version.label("author_version"),
+        ).outerjoin(author, Book.author_id == author.id)
+
+    @classmethod
+    def returning_rows(cls) -> tuple:
+        """RETURNING columns for to_response, the author name comes from a correlated subquery."""
+        author = cls.author_model()
+        return (
+            Book.id,
+            Book.name,
+            Book.is_age_limit,
+            Book.author_id,
+            select(author.name).where(author.id == Book.author_id).scalar_subquery().label("author_name"),
+        )
+
+    @classmethod
+    def rows_etag(cls, rows: Sequence[Row]) -> str:
+        # Same value as get_page_etag for the same page
+        return make_etag(*((row.id, row.version, row.author_version) for row in rows))
+
+    @classmethod
+    async def to_response(cls, session: AsyncSession, rows: Sequence[Row]) -> list[dict]:
+        """Render rows of ``select_rows`` in the shape of BookSchemaResponse without validating them again."""
+        return [
+            {
+                "name": row.name,
+                "is_age_limit": row.is_age_limit,
+                "id": row.id,
+                "author": {"name": row.author_name} if row.author_name is not None else None,
+            }
+            for row in rows
+        ]
+
+    @classmethod
+    async def refresh_name_index(cls, session: AsyncSession, book_ids, rows: Sequence[Row] | None = None) -> None:
+        """Re-read the written books into the name index, the write itself is already committed.
+
+        ``rows`` returned by the write with id, name, is_age_limit and author_id save the query.
+        """
+        if not (name_index.ready or name_index.loading):
+            return
+        book_ids = {int(book_id) for book_id in book_ids}
+        if rows is not None:
+            name_index.update_books(book_ids, [(row.id, row.name, row.is_age_limit, row.author_id) for row in rows])
+            return
+        try:
+            rows = []
+            for chunk in chunks(list(book_ids)):
+                rows.extend(
+                    await session.execute(
+                        select(Book.id, Book.name, Book.is_age_limit, Book.author_id).where(Book.id.in_(chunk))
+                    )
+                )
+            name_index.update_books(book_ids, rows)
+        except Exception as e:
+            # A stale index would hide the written books from searches
+            logger.error(e)
+            name_index.disable()
+
+    @classmethod
+    async def get_all(cls, session: AsyncSession, limit: int, after_id: int = 0) -> Sequence[Row]:
+        # One extra row tells the caller whether there is a next page
+        result = await session.execute(cls.select_rows().where(Book.id > after_id).order_by(Book.id).limit(limit + 1))
+        return result.all()
+
+    @classmethod
+    async def iter_all(cls, after_id: int = 0, primary: bool = False) -> AsyncIterator[list[dict]]:
+        # Runs on its own session: the request session is closed before a streamed body is sent
+        async with read_session_local(primary) as session:
+            result = await session.stream(
+                cls.select_rows()
+                .where(Book.id > after_id)
+                .order_by(Book.id)
+                .execution_options(yield_per=settings.STREAM_BATCH_SIZE)
+            )
+            async for partition in result.partitions():
+                yield await cls.to_response(session, partition)
+
+    @classmethod
+    def select_export(cls, is_age_limit: bool | None, include_deleted: bool) -> Select:
+        # Inner join and is_deleted as in Reader.search_books_query, ordered by id for a stable export
+        author = cls.author_model()
+        export_query = (
+            select(Book.id, Book.name, Book.is_age_limit, Book.author_id, author.name.label("author_name"))
+            .join(author, Book.author_id == author.id)
+            .order_by(Book.id)
+        )
+        if not include_deleted:
+            export_query = export_query.where(author.is_deleted == False)
+        if is_age_limit is not None:
+            export_query = export_query.where(Book.is_age_limit == is_age_limit)
+        return export_query
+
+    @classmethod
+    async def iter_export(cls, is_age_limit: bool | None, include_deleted: bool) -> AsyncIterator[Sequence[Row]]:
+        # Server-side cursor on its own session, one partition of rows is held at a time
+        async with read_session_local() as session:
+            result = await session.stream(
+                cls.select_export(is_age_limit, include_deleted).execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+            )
+            async for partition in result.partitions():
+                yield partition
 
     @classmethod
-    async def get_all(cls, session: Session) -> list[Type["Book"]]:
-        return session.query(Book).all()
+    async def get_by_ids(cls, session: AsyncSession, book_ids: list[int]) -> dict[int, tuple[str, dict]]:
+        """ETag and rendered book by id, ids that do not exist are left out."""
+        rows = []
+        for chunk in chunks(book_ids):
+            rows.extend(await session.execute(cls.select_rows().where(Book.id.in_(chunk))))
+        return {row.id: (cls.rows_etag([row]), item) for row, item in zip(rows, await cls.to_response(session, rows))}
 
     @classmethod
-    async def get_by_id(
-        cls,
-        session: Session,
-        book_id: str,
-    ) -> BookSchemaResponse:
-        book = session.query(Book).filter(Book.id == book_id).first()
-        if not book:
+    async def load_by_ids(cls, book_ids: list[int]) -> dict[int, tuple[str, dict]]:
+        # Runs on its own session: a batch serves several requests
+        async with read_session_local() as session:
+            return await cls.get_by_ids(session, book_ids)
+
+    @classmethod
+    async def get_by_id(cls, session: AsyncSession, book_id: int) -> tuple[str, dict]:
+        """ETag and rendered book, concurrent lookups are merged into one query by book_loader."""
+        # The loaders read from the replicas, a request kept on the primary queries its own session
+        if settings.BATCH_LOAD_WINDOW > 0 and not reads_primary(session):
+            found = await book_loader.load(book_id)
+        else:
+            found = (await cls.get_by_ids(session, [book_id])).get(book_id)
+        if not found:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No book with this id: {book_id} found")
-        return book
+        return found
 
     @classmethod
-    async def create_book(cls, session: Session, book: BookSchemaRequest) -> BookSchemaResponse:
+    async def create_book(cls, session: AsyncSession, book: BookSchemaRequest) -> BookSchemaResponse:
         try:
             new_book = Book(**book.model_dump())
             session.add(new_book)
-            session.commit()
-            session.refresh(new_book)
+            await cls.bump_author_versions(session, [new_book.author_id])
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, [new_book.id])
+            new_book = await session.scalar(
+                cls.select_with_author().where(Book.id == new_book.id).execution_options(populate_existing=True)
+            )
 
         except Exception as e:
             logger.error(e)
@@ -49,39 +242,201 @@ class Book(BaseModel):
         return new_book
 
     @classmethod
-    async def update_book(cls, session: Session, book_id: str, book: BookSchemaPatch) -> BookSchemaResponse:
+    async def update_book(cls, session: AsyncSession, book_id: int, book: BookSchemaPatch) -> dict:
+        """Update the book and bump its authors, rendered in the shape of BookSchemaResponse."""
         try:
-            book_query = session.query(Book).filter(Book.id == book_id)
-            book_db = book_query.first()
-            if not book_db:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail=f"No book with this id: {book_id} found"
+            values = book.model_dump(exclude_unset=True, exclude_none=True)
+            if writes_in_cte():
+                row = (await session.execute(cls.update_with_authors(book_id, values))).first()
+            else:
+                author = cls.author_model()
+                # The current author and the new one both embed the book, bump them before author_id changes
+                await session.execute(
+                    update(author)
+                    .where(
+                        or_(
+                            author.id.in_(select(Book.author_id).where(Book.id == book_id)),
+                            author.id == book.author_id,
+                        )
+                    )
+                    .values(version=author.version + 1)
                 )
-            book_query.update(book.model_dump(exclude_unset=True, exclude_none=True), synchronize_session=False)
-            session.commit()
-            session.refresh(book_db)
+                row = (
+                    await session.execute(
+                        update(Book)
+                        .where(Book.id == book_id)
+                        .values(**values, version=Book.version + 1)
+                        .returning(*cls.returning_rows())
+                    )
+                ).first()
+            if row is None:
+                await session.rollback()
+            else:
+                await session.commit()
+                await response_cache.invalidate()
+                await cls.refresh_name_index(session, [row.id], [row])
         except Exception as e:
             logger.error(e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed update book with this id: {book_id}",
             )
-        return book_db
+        if row is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No book with this id: {book_id} found")
+        return (await cls.to_response(session, [row]))[0]
+
+    @classmethod
+    def update_with_authors(cls, book_id: int, values: dict) -> Select:
+        """The book UPDATE and the bump of its current and new author in one statement, rows as returning_rows.
+
+        Every part of the statement sees the rows as they were before it, so the
+        current author is still found through book.author_id.
+        """
+        author = cls.author_model()
+        written = (
+            update(Book)
+            .where(Book.id == book_id)
+            .values(**values, version=Book.version + 1)
+            .returning(Book.id, Book.name, Book.is_age_limit, Book.author_id)
+            .cte("written_book")
+        )
+        bumped = (
+            update(author)
+            .where(
+                or_(
+                    author.id.in_(select(Book.author_id).where(Book.id == book_id)),
+                    author.id.in_(select(written.c.author_id)),
+                )
+            )
+            .values(version=author.version + 1)
+            .cte("bumped_author")
+        )
+        return select(
+            written.c.id,
+            written.c.name,
+            written.c.is_age_limit,
+            written.c.author_id,
+            select(author.name).where(author.id == written.c.author_id).scalar_subquery().label("author_name"),
+        ).add_cte(bumped)
+
+    @classmethod
+    def delete_with_author(cls, book_id: int) -> Select:
+        """The book DELETE and the bump of its author in one statement, rows of id and author_id."""
+        author = cls.author_model()
+        deleted = delete(Book).where(Book.id == book_id).returning(Book.id, Book.author_id).cte("deleted_book")
+        bumped = (
+            update(author)
+            .where(author.id.in_(select(deleted.c.author_id)))
+            .values(version=author.version + 1)
+            .cte("bumped_author")
+        )
+        return select(deleted.c.id, deleted.c.author_id).add_cte(bumped)
+
+    @classmethod
+    async def bulk_create_books(cls, session: AsyncSession, books: list[BookSchemaRequest]) -> list[int]:
+        ids = []
+        try:
+            for chunk in chunks([book.model_dump() for book in books]):
+                # Multi-row INSERT ... RETURNING, ids come back in the order of the rows
+                result = await session.scalars(insert(Book).returning(Book.id, sort_by_parameter_order=True), chunk)
+                ids.extend(result.all())
+            await cls.bump_author_versions(session, [book.author_id for book in books])
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, ids)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed create books",
+            )
+        return ids
 
     @classmethod
-    async def delete_book(cls, session: Session, book_id: str):
+    async def bulk_update_books(cls, session: AsyncSession, books: list[BookSchemaBulkPatch]) -> set[int]:
         try:
-            book_query = session.query(Book).filter(Book.id == book_id)
-            book = book_query.first()
-            if not book:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail=f"No book with this id: {book_id} found"
+            author_ids = {}
+            for chunk in chunks(list({book.id for book in books})):
+                author_ids.update(
+                    (await session.execute(select(Book.id, Book.author_id).where(Book.id.in_(chunk)))).tuples().all()
                 )
-            book_query.delete(synchronize_session=False)
-            session.commit()
+            existing_ids = set(author_ids)
+            rows = [
+                {"id": book.id, **book.model_dump(exclude_unset=True, exclude_none=True)}
+                for book in books
+                if book.id in existing_ids
+            ]
+            # ORM bulk UPDATE by primary key, rows with the same set of fields share one executemany
+            for chunk in chunks([row for row in rows if len(row) > 1]):
+                await session.execute(update(Book), chunk)
+            for chunk in chunks(list(existing_ids)):
+                await session.execute(update(Book).where(Book.id.in_(chunk)).values(version=Book.version + 1))
+            await cls.bump_author_versions(
+                session, [*author_ids.values(), *(book.author_id for book in books if book.id in existing_ids)]
+            )
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, existing_ids)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed update books",
+            )
+        return existing_ids
+
+    @classmethod
+    async def delete_book(cls, session: AsyncSession, book_id: int):
+        try:
+            if writes_in_cte():
+                row = (await session.execute(cls.delete_with_author(book_id))).first()
+            else:
+                row = (
+                    await session.execute(delete(Book).where(Book.id == book_id).returning(Book.id, Book.author_id))
+                ).first()
+                if row is not None:
+                    await cls.bump_author_versions(session, [row.author_id])
+            if row is None:
+                await session.rollback()
+            else:
+                await session.commit()
+                await response_cache.invalidate()
+                await cls.refresh_name_index(session, [row.id], [])
         except Exception as e:
             logger.error(e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed delete book with this id: {book_id}",
             )
+        if row is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No book with this id: {book_id} found")
+
+    @classmethod
+    async def bulk_delete_books(cls, session: AsyncSession, book_ids: list[int]) -> set[int]:
+        try:
+            deleted = {}
+            for chunk in chunks(book_ids):
+                deleted.update(
+                    (await session.execute(delete(Book).where(Book.id.in_(chunk)).returning(Book.id, Book.author_id)))
+                    .tuples()
+                    .all()
+                )
+            await cls.bump_author_versions(session, deleted.values())
+            await session.commit()
+            await response_cache.invalidate()
+            await cls.refresh_name_index(session, deleted)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed delete books",
+            )
+        return set(deleted)
+
+
+book_loader = BatchLoader(
+    Book.load_by_ids,
+    window=settings.BATCH_LOAD_WINDOW,
+    max_batch=settings.BATCH_LOAD_MAX_SIZE,
+    generation=lambda: response_cache.invalidations,
+)
@@ -1,20 +1,30 @@
+import asyncio
+import functools
+import time
 from typing import Type
 
 from fastapi import status, HTTPException
 from loguru import logger
-from passlib.context import CryptContext
-from psycopg2 import errors
-from sqlalchemy import Column, String, Integer, Table, ForeignKey, func
+from sqlalchemy import Column, String, Integer, Select, bindparam, func, literal_column, select, update, delete
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, selectinload
 
 from api.v1.schemas.book import BookSearch, SortingBookBy
 from api.v1.schemas.reader import ReaderSchemaRequest, ReaderSchemaResponse, ReaderSchemaPatch
 from db.base import BaseModel
-from db.database import pwd_context
+from db.database import session_local
 from db.models.author import Author
 from db.models.book import Book
 from settings import settings
+from utils.credentials import hash_password, invalidate_reader
+from utils.metrics import SEARCH_STATEMENT_OPTION
+from utils.name_index import NGramIndex, name_index
+
+UNIQUE_VIOLATION = "23505"
+SEARCH_STATEMENT = {SEARCH_STATEMENT_OPTION: True}
+# Must match the expression of the ix_book_name_fts index
+FULL_TEXT_CONFIG = literal_column("'simple'::regconfig")
 
 
 class Reader(BaseModel):
@@ -25,16 +35,24 @@ class Reader(BaseModel):
     age = Column(Integer, nullable=True)
 
     @classmethod
-    async def create_reader(cls, session: Session, reader: ReaderSchemaRequest) -> ReaderSchemaResponse:
+    def age_bucket(cls, reader: ReaderSchemaResponse) -> str:
+        """Readers in the same bucket get the same search results for the same params."""
+        if not reader.age:
+            return "unknown"
+        return "adult" if reader.age >= settings.AGE_LIMIT else "minor"
+
+    @classmethod
+    async def create_reader(cls, session: AsyncSession, reader: ReaderSchemaRequest) -> ReaderSchemaResponse:
         try:
-            reader.password = pwd_context.hash(reader.password)
+            reader.password = await hash_password(reader.password)
             new_reader = Reader(**reader.model_dump())
             session.add(new_reader)
-            session.commit()
-            session.refresh(new_reader)
+            await session.commit()
+            await session.refresh(new_reader)
             return new_reader
         except IntegrityError as e:
-            if isinstance(e.orig, errors.lookup("23505")):
+            # psycopg2 and asyncpg both expose the SQLSTATE as pgcode
+            if getattr(e.orig, "pgcode", None) == UNIQUE_VIOLATION:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Reader {reader.username} already exist",
@@ -48,16 +66,20 @@ class Reader(BaseModel):
 
     @classmethod
     async def update_reader(
-        cls, session: Session, current_reader: ReaderSchemaResponse, new_reader: ReaderSchemaPatch
+        cls, session: AsyncSession, current_reader: ReaderSchemaResponse, new_reader: ReaderSchemaPatch
     ) -> ReaderSchemaResponse:
         try:
-            reader_query = session.query(Reader).filter(Reader.id == current_reader.id)
             if new_reader.password:
-                new_reader.password = pwd_context.hash(new_reader.password)
-            reader_query.update(new_reader.model_dump(exclude_unset=True, exclude_none=True), synchronize_session=False)
-            session.commit()
-            session.refresh(current_reader)
-            return current_reader
+                new_reader.password = await hash_password(new_reader.password)
+            reader = await session.scalar(
+                update(Reader)
+                .where(Reader.id == current_reader.id)
+                .values(**new_reader.model_dump(exclude_unset=True, exclude_none=True))
+                .returning(Reader)
+            )
+            await session.commit()
+            await invalidate_reader(current_reader.username)
+            return reader
         except Exception as e:
             logger.error(e)
             raise HTTPException(
@@ -66,11 +88,13 @@ class Reader(BaseModel):
             )
 
     @classmethod
-    async def delete_reader(cls, session: Session, reader: ReaderSchemaResponse):
+    async def delete_reader(cls, session: AsyncSession, reader: ReaderSchemaResponse):
         try:
-            reader_query = session.query(Reader).filter(Reader.id == reader.id)
-            reader_query.delete(synchronize_session=False)
-            session.commit()
+            await session.execute(
+                delete(Reader).where(Reader.id == reader.id).execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            await invalidate_reader(reader.username)
         except Exception as e:
             logger.error(e)
             raise HTTPException(
@@ -80,45 +104,207 @@ class Reader(BaseModel):
 
     @classmethod
     async def search_authors_by_params(
-        cls, session: Session, params: BookSearch, reader: ReaderSchemaResponse
+        cls, session: AsyncSession, params: BookSearch, reader: ReaderSchemaResponse
     ) -> list[Type["Author"]]:
-        is_age_limit = False
-        authors_query = session.query(Author).join(Book).filter(Author.is_deleted == False)
-        if params.sorting_by == SortingBookBy.book_name:
-            authors_query = authors_query.order_by(Book.name)
-        if params.sorting_by == SortingBookBy.author:
-            authors_query = authors_query.order_by(Author.name)
+        is_age_limit = None if reader.age and reader.age >= settings.AGE_LIMIT else bool(params.is_age_limit)
+        values = {}
         if params.book_name:
-            authors_query = authors_query.filter(func.lower(Book.name).contains(params.book_name.lower()))
+            values["book_name"] = params.book_name.lower()
         if params.author:
-            authors_query = authors_query.filter(func.lower(Author.name).contains(params.author.lower()))
-        if reader.age and reader.age >= settings.AGE_LIMIT:
-            return authors_query.all()
-        if params.is_age_limit:
-            is_age_limit = params.is_age_limit
-        authors = authors_query.all()
-        for author in authors:
-            author.books = [book for book in author.books if book.is_age_limit is is_age_limit]
-        return authors
+            values["author"] = params.author.lower()
+        if name_index.ready:
+            for name, author_ids in (
+                ("book_author_ids", name_index.book_author_ids(params.book_name) if params.book_name else None),
+                ("author_ids", name_index.author_ids(params.author) if params.author else None),
+            ):
+                # A miss can be a name written by another worker or db.ingest since the load, the database decides
+                if author_ids:
+                    values[name] = author_ids
+        statement = authors_statement(
+            params.sorting_by,
+            bool(params.book_name),
+            bool(params.author),
+            is_age_limit,
+            "book_author_ids" in values,
+            "author_ids" in values,
+        )
+        return (await session.scalars(statement, values)).all()
 
     @classmethod
-    async def search_books_by_params(
-        cls, session: Session, params: BookSearch, reader: ReaderSchemaResponse
-    ) -> list[Type["Book"]]:
-        books_query = session.query(Book).join(Author).filter(Author.is_deleted == False)
-        if params.sorting_by == SortingBookBy.book_name:
-            books_query = books_query.order_by(Book.name)
-        if params.sorting_by == SortingBookBy.author:
-            books_query = books_query.order_by(Author.name)
+    def search_books_query(
+        cls,
+        params: BookSearch,
+        reader: ReaderSchemaResponse,
+        found: tuple[list[int], list[int]] | None = None,
+        author_ids: list[int] | None = None,
+    ) -> tuple[Select, dict]:
+        """The statement of the search shape and the values to execute it with.
+
+        found are the book and author ids of the book_name in the name index, author_ids the ids of the author.
+        """
+        values = {}
+        if params.query:
+            values["query"] = params.query
         if params.book_name:
-            books_query = books_query.filter(func.lower(Book.name).contains(params.book_name.lower()))
+            values["book_name"] = params.book_name.lower()
         if params.author:
-            books_query = books_query.filter(func.lower(Author.name).contains(params.author.lower()))
+            values["author"] = params.author.lower()
+        if found is not None:
+            values["book_ids"], values["book_author_ids"] = found
+        if author_ids is not None:
+            values["author_ids"] = author_ids
+        statement = books_statement(
+            params.sorting_by,
+            bool(params.query),
+            bool(params.book_name),
+            bool(params.author),
+            cls.visible_age_limit(params, reader),
+            found is not None,
+            author_ids is not None,
+        )
+        return statement, values
+
+    @classmethod
+    def visible_age_limit(cls, params: BookSearch, reader: ReaderSchemaResponse) -> bool | None:
+        """The is_age_limit of the books the reader finds, None for all of them."""
         if reader.age:
-            if reader.age < settings.AGE_LIMIT:
-                books_query = books_query.filter(Book.is_age_limit == False)
-        elif params.is_age_limit:
-            books_query = books_query.filter(Book.is_age_limit == params.is_age_limit)
-        else:
-            books_query = books_query.filter(Book.is_age_limit == False)
-        return books_query.all()
+            return None if reader.age >= settings.AGE_LIMIT else False
+        return bool(params.is_age_limit)
+
+    @classmethod
+    async def search_books_by_params(
+        cls, session: AsyncSession, params: BookSearch, reader: ReaderSchemaResponse
+    ) -> list[Type["Book"]]:
+        found = author_ids = None
+        if name_index.ready:
+            if params.book_name:
+                found = name_index.book_ids(params.book_name, cls.visible_age_limit(params, reader))
+                # A miss can be a name written by another worker or db.ingest since the load, the database decides
+                if found is not None and not found[0]:
+                    found = None
+            if params.author:
+                author_ids = name_index.author_ids(params.author) or None
+        statement, values = cls.search_books_query(params, reader, found, author_ids)
+        return (await session.scalars(statement, values)).all()
+
+    @classmethod
+    async def load_name_index(cls) -> None:
+        """Build the name index from the database and swap it in, writes meanwhile are applied again."""
+        name_index.loading = True
+        started = time.perf_counter()
+        try:
+            books, authors = NGramIndex(), NGramIndex()
+            async with session_local() as session:
+                rows = await session.scalar(select(func.count(Book.id))) + await session.scalar(
+                    select(func.count(Author.id))
+                )
+                if rows > name_index.max_rows:
+                    logger.warning("{} names are over NAME_INDEX_MAX_ROWS, searches use the database", rows)
+                    name_index.disable()
+                    return
+                for index, statement in (
+                    (authors, select(Author.id, Author.name, Author.is_deleted)),
+                    (books, select(Book.id, Book.name, Book.is_age_limit, Book.author_id)),
+                ):
+                    result = await session.stream(statement.execution_options(yield_per=settings.STREAM_BATCH_SIZE))
+                    async for partition in result.partitions():
+                        # Indexing is pure Python, the new index is only seen by the thread until the swap
+                        await asyncio.to_thread(index.extend, partition)
+                name_index.swap(books, authors)
+                name_index.loading = False
+                pending_books, pending_authors = name_index.pending_books, name_index.pending_authors
+                name_index.pending_books, name_index.pending_authors = set(), set()
+                await Author.refresh_name_index(session, pending_authors)
+                await Book.refresh_name_index(session, pending_books)
+            name_index.load_seconds = time.perf_counter() - started
+            logger.info(
+                "Name index of {} books, {} authors loaded in {:.1f} s",
+                len(books),
+                len(authors),
+                name_index.load_seconds,
+            )
+        finally:
+            name_index.loading = False
+
+
+# The statements below are built once per search shape, the values of the filters are bound on execution.
+# A reused statement keeps its cache key, so SQLAlchemy neither walks it again nor compiles it again.
+# SEARCH_STATEMENT tags them for search_statements_total, the compiled cache lookups of the searches.
+@functools.cache
+def books_statement(
+    sorting_by: SortingBookBy,
+    query: bool,
+    book_name: bool,
+    author: bool,
+    is_age_limit: bool | None,
+    book_ids: bool,
+    author_ids: bool,
+) -> Select:
+    books_query = (
+        select(Book)
+        .join(Author)
+        .options(contains_eager(Book.author))
+        .where(Author.is_deleted == False)
+        .execution_options(**SEARCH_STATEMENT)
+    )
+    if query:
+        document = func.to_tsvector(FULL_TEXT_CONFIG, Book.name)
+        tsquery = func.plainto_tsquery(FULL_TEXT_CONFIG, bindparam("query", type_=String))
+        books_query = books_query.where(document.op("@@")(tsquery)).order_by(func.ts_rank(document, tsquery).desc())
+    if sorting_by == SortingBookBy.book_name:
+        books_query = books_query.order_by(Book.name)
+    if sorting_by == SortingBookBy.author:
+        books_query = books_query.order_by(Author.name)
+    if book_name:
+        books_query = books_query.where(func.lower(Book.name).contains(bindparam("book_name")))
+    if author:
+        books_query = books_query.where(func.lower(Author.name).contains(bindparam("author")))
+    if is_age_limit is not None:
+        books_query = books_query.where(Book.is_age_limit == is_age_limit)
+    if book_ids:
+        # The name filters stay in the query, the ids let it look the rows up by primary key.
+        # Book.author_id keeps SQLite from walking every author to probe the id list.
+        books_query = books_query.where(
+            Book.id.in_(bindparam("book_ids", expanding=True)),
+            Book.author_id.in_(bindparam("book_author_ids", expanding=True)),
+        )
+    if author_ids:
+        books_query = books_query.where(Author.id.in_(bindparam("author_ids", expanding=True)))
+    return books_query
+
+
+@functools.cache
+def authors_statement(
+    sorting_by: SortingBookBy,
+    book_name: bool,
+    author: bool,
+    is_age_limit: bool | None,
+    book_author_ids: bool,
+    author_ids: bool,
+) -> Select:
+    books = Author.books
+    if is_age_limit is not None:
+        books = Author.books.and_(Book.is_age_limit == is_age_limit)
+    # EXISTS keeps authors distinct, only the eligible books are loaded into the collection
+    authors_query = (
+        select(Author)
+        .options(selectinload(books))
+        .where(Author.is_deleted == False)
+        .execution_options(populate_existing=True, **SEARCH_STATEMENT)
+    )
+    if book_name:
+        authors_query = authors_query.where(Author.books.any(func.lower(Book.name).contains(bindparam("book_name"))))
+    else:
+        authors_query = authors_query.where(Author.books.any())
+    if author:
+        authors_query = authors_query.where(func.lower(Author.name).contains(bindparam("author")))
+    if book_author_ids:
+        authors_query = authors_query.where(Author.id.in_(bindparam("book_author_ids", expanding=True)))
+    if author_ids:
+        authors_query = authors_query.where(Author.id.in_(bindparam("author_ids", expanding=True)))
+    if sorting_by == SortingBookBy.book_name:
+        first_book_name = select(func.min(Book.name)).where(Book.author_id == Author.id).scalar_subquery()
+        authors_query = authors_query.order_by(first_book_name, Author.id)
+    if sorting_by == SortingBookBy.author:
+        authors_query = authors_query.order_by(Author.name, Author.id)
+    return authors_query
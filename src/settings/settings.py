@@ -2,6 +2,34 @@ import os
 
 # For more information about these environment variables, see README.MD
 
+
+def _get_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+# ==== Server settings ====
+# FastAPI debug mode and the route dump on startup, never enable in production
+DEBUG = _get_bool("DEBUG", False)
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Worker processes, each one has its own connection pool and in-memory caches
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_KEEP_ALIVE = int(os.getenv("SERVER_KEEP_ALIVE", "5"))
+# auto picks uvloop and httptools when they are installed
+SERVER_LOOP = os.getenv("SERVER_LOOP", "auto")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "auto")
+# Connections per worker above which new requests get 503, 0 disables the limit
+SERVER_LIMIT_CONCURRENCY = int(os.getenv("SERVER_LIMIT_CONCURRENCY", "0"))
+# Seconds in-flight requests get to finish after SIGTERM
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+# Request metrics are on /metrics, a log line per request only costs time
+SERVER_ACCESS_LOG = _get_bool("SERVER_ACCESS_LOG", False)
+# Take the client address from X-Forwarded-For when the connection comes from one of the comma separated
+# SERVER_FORWARDED_ALLOW_IPS (* trusts everyone), the rate limit buckets addresses by it
+SERVER_PROXY_HEADERS = _get_bool("SERVER_PROXY_HEADERS", True)
+SERVER_FORWARDED_ALLOW_IPS = os.getenv("SERVER_FORWARDED_ALLOW_IPS", "127.0.0.1")
+
 # ==== Postgres settings ====
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
@@ -9,6 +37,119 @@ POSTGRES_HOSTNAME = os.getenv("POSTGRES_HOSTNAME", "localhost")
 DATABASE_PORT = int(os.getenv("DATABASE_PORT", "5432"))
 POSTGRES_DB = os.getenv("POSTGRES_DB", "bookcrud")
 
+# ==== Database settings ====
+# Full SQLAlchemy URL, overrides the Postgres settings above when set
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# Use AsyncEngine/AsyncSession, the blocking engine is kept for benchmarks
+DATABASE_ASYNC = _get_bool("DATABASE_ASYNC", True)
+DATABASE_ECHO = _get_bool("DATABASE_ECHO", False)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before failing the request
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced, -1 disables recycling
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_PRE_PING = _get_bool("DATABASE_POOL_PRE_PING", False)
+# Postgres statement_timeout in milliseconds, 0 disables the limit
+DATABASE_STATEMENT_TIMEOUT = int(os.getenv("DATABASE_STATEMENT_TIMEOUT", "0"))
+# Open the pool connections on startup instead of on the first requests
+DATABASE_POOL_WARM = _get_bool("DATABASE_POOL_WARM", True)
+# Comma separated URLs of read replicas, with the driver of the primary. GET requests read from them round-robin
+DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "")
+# Seconds between replica health checks, a replica that fails one gets no reads until it passes the next
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "5"))
+# Seconds reads stay on the primary after a write: for the client that wrote (a cookie) and for the worker
+# that committed it, so replica lag does not end up in the caches. 0 reads from the replicas right away
+DATABASE_READ_YOUR_WRITES = float(os.getenv("DATABASE_READ_YOUR_WRITES", "5"))
+
+# ==== Auth settings ====
+# Seconds a verified reader skips bcrypt and the username lookup, 0 disables the cache
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+# Threads used for bcrypt hashing and verification
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "4"))
+
+# ==== Pagination settings ====
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+# Rows fetched from the server-side cursor per batch when streaming
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# Rows per partition of the catalogue export, a parquet row group or an arrow record batch each
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+
+# ==== Bulk settings ====
+# Rows per multi-row INSERT/UPDATE/DELETE statement, all chunks share one transaction
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "100000"))
+# Rows per COPY (or multi-row INSERT on SQLite) into the staging tables of python3 -m db.ingest
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "50000"))
+# Concurrent GET by id arriving within the window share one query, 0 queries every request on its own
+BATCH_LOAD_WINDOW = float(os.getenv("BATCH_LOAD_WINDOW", "0.002"))
+BATCH_LOAD_MAX_SIZE = int(os.getenv("BATCH_LOAD_MAX_SIZE", "100"))
+
+# ==== Response cache settings ====
+# memory - per-process LRU, redis - shared by all workers, empty - disabled.
+# A write only invalidates the memory backend of the worker that made it, so it is refused with SERVER_WORKERS > 1
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "")
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Searches without filters are served from an in-memory snapshot of the catalogue per age bucket.
+# It is rebuilt in the background after a write or after the TTL, the previous one is served meanwhile.
+# Catalogues with more books than the limit are not snapshotted, a build takes about a second per 20000 books.
+# With SERVER_WORKERS > 1 it needs RESPONSE_CACHE_BACKEND=redis to see the writes of the other workers
+CATALOGUE_SNAPSHOT_MAX_BOOKS = int(os.getenv("CATALOGUE_SNAPSHOT_MAX_BOOKS", "20000"))
+CATALOGUE_SNAPSHOT_TTL = float(os.getenv("CATALOGUE_SNAPSHOT_TTL", "30"))
+# In-process trigram index of book and author names for the search filters, loaded at startup.
+# Searches matching more than NAME_INDEX_MAX_IDS rows use the database indexes instead. Refused with SERVER_WORKERS > 1
+NAME_INDEX_ENABLED = _get_bool("NAME_INDEX_ENABLED", False)
+NAME_INDEX_MAX_ROWS = int(os.getenv("NAME_INDEX_MAX_ROWS", "5000000"))
+NAME_INDEX_MAX_IDS = int(os.getenv("NAME_INDEX_MAX_IDS", "200"))
+# Seconds between reloads picking up the writes of db.ingest, at least 20 times the last load so reloads take at
+# most 5% of the worker. 0 reloads only once the writes cleared more slots than the index has live ones
+NAME_INDEX_REFRESH = float(os.getenv("NAME_INDEX_REFRESH", "60"))
+
+# ==== Rate limit settings ====
+# Requests per second per client address on RATE_LIMIT_PATHS, over it the client gets 429 before the credentials
+# are checked. 0 disables the limit
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "0"))
+# Requests per second of one reader, counted once the password is verified so a client cannot spend the bucket of
+# another reader by sending its name, nor get a fresh one by changing the name. 0 disables the limit
+RATE_LIMIT_READER_RATE = float(os.getenv("RATE_LIMIT_READER_RATE", str(RATE_LIMIT_RATE)))
+# Requests a client or a reader can send at once after being idle
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+# Comma separated path prefixes
+RATE_LIMIT_PATHS = os.getenv("RATE_LIMIT_PATHS", "/v1/reader")
+# memory - per worker, every worker lets the rates through, redis - shared by all workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "redis://localhost:6379/0")
+# Addresses tracked by the memory backend
+RATE_LIMIT_SIZE = int(os.getenv("RATE_LIMIT_SIZE", "100000"))
+# Requests to /v1/ a worker serves at once, over it they wait in a queue and get 503 when it is full or after
+# ADMISSION_TIMEOUT seconds. At most DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW keeps them from waiting for
+# a connection with one held by the worker. 0 disables the limit
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "1"))
+
+# ==== Metrics settings ====
+# Request, SQL and pool metrics served on /metrics in the Prometheus text format. Per worker: each scrape is
+# answered by one worker, every sample carries its pid in the worker label
+METRICS_ENABLED = _get_bool("METRICS_ENABLED", True)
+# Server-Timing header with the auth, db and serialize time of every response, needs METRICS_ENABLED
+SERVER_TIMING = _get_bool("SERVER_TIMING", True)
+
+# ==== Profiling settings ====
+# Requests to these comma separated paths are always profiled
+PROFILING_PATHS = os.getenv("PROFILING_PATHS", "")
+# Requests with X-Profile: <expires>.HMAC-SHA256(secret, "<METHOD> <path> <expires>") are profiled until the unix
+# time expires, empty disables the header
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", "")
+# Seconds a signature is valid, one expiring later is refused
+PROFILING_SIGNATURE_TTL = int(os.getenv("PROFILING_SIGNATURE_TTL", "300"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_ENABLED = bool(PROFILING_PATHS or PROFILING_SECRET)
+
 
 # Programm Settings
 AGE_LIMIT = int(os.getenv("AGE_LIMIT", "18"))
@@ -0,0 +1,97 @@
+import asyncio
+from collections import deque
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from settings import settings
+from utils.rate_limit import shed_response
+
+# Served without the database, they must answer while the worker is overloaded
+EXEMPT_PATHS = ("/v1/internal/database", "/v1/internal/cache")
+ADMITTED_PATHS = "/v1/"
+
+
+class AdmissionController:
+    """Caps the requests of this worker that may use the database at once.
+
+    Requests over ``limit`` wait in a queue of at most ``queue`` for
+    ``timeout`` seconds and are refused after that. Waiting here costs no
+    connection, unlike waiting for the pool, so the cap is meant to stay at or
+    under DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW. Per worker on purpose:
+    the pool it protects is per worker too.
+    """
+
+    def __init__(self, limit: int, queue: int, timeout: float):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.rejected = 0
+        # Futures are created on the running loop, the controller itself is not bound to one
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        """Take a slot, False when the request has to be refused."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # release() hands its slot over to the waiter, active is not decremented for it
+            await asyncio.wait_for(waiter, self.timeout)
+            return True
+        except TimeoutError:
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionMiddleware:
+    """Answer 503 with Retry-After when ADMISSION_MAX_CONCURRENCY requests are served and the queue is full."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not path.startswith(ADMITTED_PATHS) or path.startswith(EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+        if not await admission.acquire():
+            await shed_response(503, "Service overloaded", admission.timeout)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release()
+
+
+admission = AdmissionController(
+    settings.ADMISSION_MAX_CONCURRENCY, settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_TIMEOUT
+)
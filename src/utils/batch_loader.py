@@ -0,0 +1,92 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from loguru import logger
+
+Key = TypeVar("Key", bound=Hashable)
+Value = TypeVar("Value")
+
+
+class BatchLoader(Generic[Key, Value]):
+    """Coalesce concurrent loads by key into one call of ``load_many``.
+
+    Loads arriving within ``window`` seconds of the first one are sent together,
+    at most ``max_batch`` keys at a time. A key that is already being loaded
+    shares that result, unless ``generation`` changed since its batch was sent:
+    a request that starts after a write must not get what was read before it.
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[list[Key]], Awaitable[dict[Key, Value]]],
+        window: float,
+        max_batch: int,
+        generation: Callable[[], int] = lambda: 0,
+    ):
+        self.load_many = load_many
+        self.window = window
+        self.max_batch = max_batch
+        self.generation = generation
+        self.pending: dict[Key, asyncio.Future] = {}
+        self.in_flight: dict[Key, tuple[int, asyncio.Future]] = {}
+        self.timer: asyncio.TimerHandle | None = None
+        # Keeps the batch tasks referenced until they finish
+        self.tasks: set[asyncio.Task] = set()
+        self.loads = 0
+        self.shared = 0
+        self.batches = 0
+
+    async def load(self, key: Key) -> Value | None:
+        """Value of ``key``, None when ``load_many`` did not return it."""
+        self.loads += 1
+        future = self.pending.get(key)
+        if future is None and key in self.in_flight:
+            generation, in_flight = self.in_flight[key]
+            if generation == self.generation():
+                future = in_flight
+        if future is not None:
+            self.shared += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = self.pending[key] = loop.create_future()
+            if len(self.pending) >= self.max_batch:
+                self.dispatch()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.window, self.dispatch)
+        # A cancelled request must not cancel the load the others are waiting for
+        return await asyncio.shield(future)
+
+    def dispatch(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        generation = self.generation()
+        for key, future in batch.items():
+            self.in_flight[key] = (generation, future)
+        task = asyncio.create_task(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: dict[Key, asyncio.Future]) -> None:
+        self.batches += 1
+        try:
+            values = await self.load_many(list(batch))
+        except Exception as e:
+            logger.error(e)
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values.get(key))
+        finally:
+            for key, future in batch.items():
+                if key in self.in_flight and self.in_flight[key][1] is future:
+                    del self.in_flight[key]
+
+    def stats(self) -> dict:
+        return {"loads": self.loads, "shared": self.shared, "batches": self.batches}
@@ -0,0 +1,73 @@
+import json
+from typing import TypeVar
+
+from fastapi import HTTPException, Request, status
+from pydantic import BaseModel, ValidationError
+
+from api.v1.schemas.bulk import BulkItemResult, BulkStatus
+from settings import settings
+from utils.pagination import NDJSON_MEDIA_TYPE
+
+Schema = TypeVar("Schema", bound=BaseModel)
+
+
+def chunks(items: list, size: int = settings.BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def parse_ids(ids: str) -> list[int]:
+    """Ids of a comma separated list in the order given, without repeats."""
+    try:
+        parsed = [int(item) for item in ids.split(",") if item.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be a comma separated list of integers"
+        )
+    if len(parsed) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"No more than {settings.BULK_MAX_ITEMS} items per request",
+        )
+    return list(dict.fromkeys(parsed))
+
+
+async def read_bulk_items(
+    request: Request, schema: type[Schema]
+) -> tuple[list[tuple[int, Schema]], list[BulkItemResult]]:
+    """Parse a JSON array or NDJSON body into valid items and ``invalid`` results for the rest."""
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+            raw_items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            raw_items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid request body: {e}")
+    if not isinstance(raw_items, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Request body must be a JSON array or NDJSON"
+        )
+    if len(raw_items) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"No more than {settings.BULK_MAX_ITEMS} items per request",
+        )
+    items, invalid = [], []
+    for index, raw_item in enumerate(raw_items):
+        try:
+            items.append((index, schema.model_validate(raw_item)))
+        except ValidationError as e:
+            invalid.append(BulkItemResult(index=index, status=BulkStatus.invalid, detail=str(e)))
+    return items, invalid
+
+
+def id_results(
+    indexed_ids: list[tuple[int, int]], found: dict[int, BulkStatus], invalid: list[BulkItemResult]
+) -> list[BulkItemResult]:
+    """Per-item results for operations addressed by id, ids missing from ``found`` are reported as not found."""
+    results = invalid + [
+        BulkItemResult(index=index, id=item_id, status=found.get(item_id, BulkStatus.not_found))
+        for index, item_id in indexed_ids
+    ]
+    return sorted(results, key=lambda result: result.index)
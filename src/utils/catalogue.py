@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+import orjson
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.v1.schemas.book import BookSearch, SortingBookBy
+from api.v1.schemas.reader import ReaderSchemaResponse
+from db.database import session_local
+from db.models.author import Author
+from db.models.book import Book
+from settings import settings
+from utils.response_cache import response_cache
+
+# Books a reader may see, the age rules of Reader.search_* map every reader and params to one of them
+VISIBLE_ALL = "all"
+VISIBLE_UNLIMITED = "unlimited"
+VISIBLE_LIMITED = "limited"
+VISIBILITIES = (VISIBLE_ALL, VISIBLE_UNLIMITED, VISIBLE_LIMITED)
+
+
+def _is_adult(reader: ReaderSchemaResponse) -> bool:
+    return bool(reader.age) and reader.age >= settings.AGE_LIMIT
+
+
+def books_visibility(params: BookSearch, reader: ReaderSchemaResponse) -> str:
+    """Same rule as Reader.search_books_query, a minor never sees limited books."""
+    if reader.age:
+        return VISIBLE_ALL if reader.age >= settings.AGE_LIMIT else VISIBLE_UNLIMITED
+    return VISIBLE_LIMITED if params.is_age_limit else VISIBLE_UNLIMITED
+
+
+def authors_visibility(params: BookSearch, reader: ReaderSchemaResponse) -> str:
+    """Same rule as Reader.search_authors_by_params, which filters the books of everyone but adults."""
+    if _is_adult(reader):
+        return VISIBLE_ALL
+    return VISIBLE_LIMITED if params.is_age_limit else VISIBLE_UNLIMITED
+
+
+def _visible(visibility: str, is_age_limit: bool) -> bool:
+    return visibility == VISIBLE_ALL or is_age_limit == (visibility == VISIBLE_LIMITED)
+
+
+@dataclass
+class Snapshot:
+    version: tuple[int, int | None]
+    built: float
+    # (visibility, sorting) -> rendered JSON, None when the catalogue is over CATALOGUE_SNAPSHOT_MAX_BOOKS
+    books: dict[tuple[str, SortingBookBy], bytes] | None
+    authors: dict[tuple[str, SortingBookBy], bytes] | None
+
+
+class CatalogueSnapshot:
+    """Search results without filters, rendered ahead for every visibility and sorting.
+
+    The reader searches only differ by the age rule when no name or full-text
+    filter is given, so the whole catalogue is read once, with both orders taken
+    from the database to keep its collation, and every combination is rendered.
+    The snapshot is rebuilt in the background from the primary on the first
+    search after a write seen through the response cache version, or after
+    CATALOGUE_SNAPSHOT_TTL when writes of other workers are not visible to this
+    one, and replaced as a whole once built.
+    """
+
+    def __init__(self, max_books: int, ttl: float):
+        self.max_books = max_books
+        self.ttl = ttl
+        self.snapshot: Snapshot | None = None
+        self.task: asyncio.Task | None = None
+        self.hits = 0
+        self.builds = 0
+
+    @staticmethod
+    def applies(params: BookSearch) -> bool:
+        return not (params.book_name or params.author or params.query)
+
+    def is_fresh(self, snapshot: Snapshot | None, version: tuple[int, int | None]) -> bool:
+        return snapshot is not None and snapshot.version == version and time.monotonic() - snapshot.built < self.ttl
+
+    async def books(self, params: BookSearch, reader: ReaderSchemaResponse) -> bytes | None:
+        """Rendered result of Reader.search_books_by_params, None when it has to be queried."""
+        snapshot = await self.current(params)
+        if snapshot is None or snapshot.books is None:
+            return None
+        self.hits += 1
+        return snapshot.books[books_visibility(params, reader), params.sorting_by]
+
+    async def authors(self, params: BookSearch, reader: ReaderSchemaResponse) -> bytes | None:
+        """Rendered result of Reader.search_authors_by_params, None when it has to be queried."""
+        snapshot = await self.current(params)
+        if snapshot is None or snapshot.authors is None:
+            return None
+        self.hits += 1
+        return snapshot.authors[authors_visibility(params, reader), params.sorting_by]
+
+    async def current(self, params: BookSearch) -> Snapshot | None:
+        """The last snapshot built, a rebuild is started when it is out of date.
+
+        Searches are served the previous snapshot until the next one is swapped
+        in. Only before the first one they wait for the build, instead of each
+        reading the whole catalogue.
+        """
+        if self.max_books <= 0 or not self.applies(params):
+            return None
+        snapshot = self.snapshot
+        if not self.is_fresh(snapshot, await response_cache.catalogue_version()) and not self.building:
+            # A fresh context: the build is not part of the request that started it, nor of its timings
+            self.task = asyncio.create_task(self.rebuild(), context=contextvars.Context())
+        if snapshot is None and self.building:
+            # A cancelled request must not cancel the build the others wait for
+            await asyncio.shield(self.task)
+            snapshot = self.snapshot
+        return snapshot
+
+    @property
+    def building(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def stop(self) -> None:
+        if self.building:
+            self.task.cancel()
+
+    async def rebuild(self) -> None:
+        # Read before the catalogue, a write committed during the build makes the next search rebuild again
+        version = await response_cache.catalogue_version()
+        try:
+            # From the primary: a replica behind it would be stored under the new version
+            async with session_local() as session:
+                self.snapshot = await self.build(session, version)
+        except Exception as e:
+            # Searches query the database until a build succeeds
+            logger.error(e)
+            self.snapshot = None
+
+    async def build(self, session: AsyncSession, version: tuple[int, int | None]) -> Snapshot:
+        started = time.perf_counter()
+        count = await session.scalar(select(func.count(Book.id)))
+        if count > self.max_books:
+            logger.info("Catalogue of {} books is over CATALOGUE_SNAPSHOT_MAX_BOOKS, searches query it", count)
+            return Snapshot(version=version, built=time.monotonic(), books=None, authors=None)
+        books = (await session.execute(self.select_books())).all()
+        authors = (await session.execute(self.select_authors())).all()
+        # Rendering takes seconds on large catalogues, the worker keeps serving meanwhile
+        snapshot = Snapshot(
+            version=version,
+            built=time.monotonic(),
+            books=await asyncio.to_thread(self.render_books, books),
+            authors=await asyncio.to_thread(self.render_authors, authors, books),
+        )
+        self.builds += 1
+        logger.info(
+            "Catalogue snapshot of {} books, {} authors built in {:.1f} ms",
+            len(books),
+            len(authors),
+            (time.perf_counter() - started) * 1000,
+        )
+        return snapshot
+
+    @staticmethod
+    def select_books():
+        # Ties are broken by id, the search queries leave their order to the database
+        return (
+            select(
+                Book.id,
+                Book.name,
+                Book.is_age_limit,
+                Book.author_id,
+                Author.name.label("author_name"),
+                func.row_number().over(order_by=(Book.name, Book.id)).label("book_name_rank"),
+                func.row_number().over(order_by=(Author.name, Book.id)).label("author_rank"),
+            )
+            .join(Author, Book.author_id == Author.id)
+            .where(Author.is_deleted == False)
+            .order_by(Book.id)
+        )
+
+    @staticmethod
+    def select_authors():
+        # The first book name is taken over all books of the author, as in search_authors_by_params
+        first_books = (
+            select(Book.author_id, func.min(Book.name).label("first_book_name")).group_by(Book.author_id).subquery()
+        )
+        return (
+            select(
+                Author.id,
+                Author.name,
+                func.row_number().over(order_by=(first_books.c.first_book_name, Author.id)).label("book_name_rank"),
+                func.row_number().over(order_by=(Author.name, Author.id)).label("author_rank"),
+            )
+            .join(first_books, first_books.c.author_id == Author.id)
+            .where(Author.is_deleted == False)
+        )
+
+    @staticmethod
+    def render_books(rows) -> dict[tuple[str, SortingBookBy], bytes]:
+        # Every book is built once and shared by the six lists
+        items = [
+            (
+                row,
+                {"name": row.name, "is_age_limit": row.is_age_limit, "id": row.id, "author": {"name": row.author_name}},
+            )
+            for row in rows
+        ]
+        rendered = {}
+        for sorting in SortingBookBy:
+            rank = f"{sorting}_rank"
+            ordered = sorted(items, key=lambda item: getattr(item[0], rank))
+            for visibility in VISIBILITIES:
+                rendered[visibility, sorting] = orjson.dumps(
+                    [item for row, item in ordered if _visible(visibility, row.is_age_limit)]
+                )
+        return rendered
+
+    @staticmethod
+    def render_authors(rows, books) -> dict[tuple[str, SortingBookBy], bytes]:
+        # Books come ordered by id, the order selectinload returns them in. The visible books of an author are
+        # collected once per visibility instead of once per list
+        books_by_author = {visibility: defaultdict(list) for visibility in VISIBILITIES}
+        for book in books:
+            item = {"name": book.name, "is_age_limit": book.is_age_limit}
+            for visibility in VISIBILITIES:
+                if _visible(visibility, book.is_age_limit):
+                    books_by_author[visibility][book.author_id].append(item)
+        rendered = {}
+        for sorting in SortingBookBy:
+            rank = f"{sorting}_rank"
+            ordered = sorted(rows, key=lambda row: getattr(row, rank))
+            for visibility in VISIBILITIES:
+                visible_books = books_by_author[visibility]
+                rendered[visibility, sorting] = orjson.dumps(
+                    [{"name": row.name, "id": row.id, "books": visible_books.get(row.id, [])} for row in ordered]
+                )
+        return rendered
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "enabled": self.max_books > 0,
+            "hits": self.hits,
+            "builds": self.builds,
+            "age_seconds": time.monotonic() - snapshot.built if snapshot else None,
+            "over_limit": snapshot is not None and snapshot.books is None,
+        }
+
+
+def make_snapshot() -> CatalogueSnapshot:
+    if settings.CATALOGUE_SNAPSHOT_MAX_BOOKS > 0 and settings.SERVER_WORKERS > 1:
+        if settings.RESPONSE_CACHE_BACKEND != "redis":
+            # Only the shared version tells a worker about the writes of the others, it would serve them after the TTL
+            raise RuntimeError(
+                "CATALOGUE_SNAPSHOT_MAX_BOOKS > 0 serves stale searches with SERVER_WORKERS > 1,"
+                " use RESPONSE_CACHE_BACKEND=redis or CATALOGUE_SNAPSHOT_MAX_BOOKS=0"
+            )
+    return CatalogueSnapshot(max_books=settings.CATALOGUE_SNAPSHOT_MAX_BOOKS, ttl=settings.CATALOGUE_SNAPSHOT_TTL)
+
+
+catalogue_snapshot = make_snapshot()
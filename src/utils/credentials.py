@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import hmac
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from api.v1.schemas.reader import ReaderSchemaResponse
+from db.database import get_pwd_context
+from settings import settings
+from utils.cache import TTLCache
+from utils.response_cache import RedisBackend, response_cache
+
+# Version namespace of the reader generations in the shared response cache backend
+GENERATION_NAMESPACE = "reader"
+
+
+def make_cache() -> TTLCache:
+    if settings.AUTH_CACHE_TTL > 0 and settings.SERVER_WORKERS > 1 and settings.RESPONSE_CACHE_BACKEND != "redis":
+        # Invalidations would only reach the worker that made them
+        raise RuntimeError(
+            "AUTH_CACHE_TTL > 0 keeps deleted readers and old passwords working on the other workers with"
+            " SERVER_WORKERS > 1, use RESPONSE_CACHE_BACKEND=redis or AUTH_CACHE_TTL=0"
+        )
+    return TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+
+# Recently verified credentials: username -> (keyed password digest, reader, generation).
+# The key is generated per process, so digests never leave memory in a usable form.
+credentials_cache = make_cache()
+_digest_key = secrets.token_bytes(32)
+_executor = ThreadPoolExecutor(max_workers=settings.AUTH_WORKERS, thread_name_prefix="bcrypt")
+# Invalidations per username made by this process, the ones of other workers are counted by the shared backend.
+# Only readers updated or deleted by this process have an entry
+_generations: dict[str, int] = {}
+
+
+def password_digest(password: str) -> bytes:
+    return hmac.new(_digest_key, password.encode(), hashlib.sha256).digest()
+
+
+def _shared_backend() -> RedisBackend | None:
+    backend = response_cache.backend
+    return backend if isinstance(backend, RedisBackend) else None
+
+
+async def reader_generation(username: str) -> tuple[int, int] | None:
+    """Changes on every invalidation of the reader in any worker, None when it cannot be told."""
+    backend = _shared_backend()
+    if backend is None:
+        return _generations.get(username, 0), 0
+    try:
+        shared = await backend.get_version(f"{GENERATION_NAMESPACE}:{username}")
+    except Exception as e:
+        # Without the shared generation an entry may be stale, bcrypt is checked instead
+        logger.error(e)
+        return None
+    return _generations.get(username, 0), shared
+
+
+async def get_cached_reader(username: str, password: str) -> ReaderSchemaResponse | None:
+    item = credentials_cache.get(username)
+    if item is None:
+        return None
+    digest, reader, generation = item
+    if not hmac.compare_digest(digest, password_digest(password)):
+        return None
+    current = await reader_generation(username)
+    if current is None or current != generation:
+        # Invalidated by another worker since it was cached
+        credentials_cache.pop(username)
+        return None
+    return reader
+
+
+async def cache_reader(
+    username: str, password: str, reader: ReaderSchemaResponse, generation: tuple[int, int] | None
+) -> None:
+    """Cache the reader unless it was invalidated since ``generation`` was taken."""
+    if generation is not None and await reader_generation(username) == generation:
+        credentials_cache.set(username, (password_digest(password), reader, generation))
+
+
+async def invalidate_reader(username: str) -> None:
+    _generations[username] = _generations.get(username, 0) + 1
+    credentials_cache.pop(username)
+    backend = _shared_backend()
+    if backend is not None:
+        try:
+            await backend.bump_version(f"{GENERATION_NAMESPACE}:{username}")
+        except Exception as e:
+            # The other workers keep the reader until AUTH_CACHE_TTL
+            logger.error(e)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    # bcrypt is CPU bound, keep it off the event loop
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, get_pwd_context().verify, password, password_hash
+    )
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executor, get_pwd_context().hash, password)
@@ -0,0 +1,151 @@
+import csv
+import io
+import zlib
+from typing import AsyncIterator, Sequence
+
+import orjson
+from sqlalchemy import Row
+
+from api.v1.schemas.export import ExportCompression, ExportFormat
+
+MEDIA_TYPES = {
+    ExportFormat.csv: "text/csv",
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.parquet: "application/vnd.apache.parquet",
+    ExportFormat.arrow: "application/vnd.apache.arrow.stream",
+}
+COMPRESSED_MEDIA_TYPES = {ExportCompression.gzip: "application/gzip", ExportCompression.zstd: "application/zstd"}
+EXTENSIONS = {ExportCompression.none: "", ExportCompression.gzip: ".gz", ExportCompression.zstd: ".zst"}
+REQUIRED_PACKAGES = {
+    ExportFormat.parquet: "pyarrow",
+    ExportFormat.arrow: "pyarrow",
+    ExportCompression.zstd: "zstandard",
+}
+
+
+def missing_package(export_format: ExportFormat, compression: ExportCompression) -> str | None:
+    """Optional package the export needs but is not installed."""
+    for option in (export_format, compression):
+        package = REQUIRED_PACKAGES.get(option)
+        if package is None:
+            continue
+        try:
+            __import__(package)
+        except ImportError:
+            return package
+    return None
+
+
+def media_type(export_format: ExportFormat, compression: ExportCompression) -> str:
+    return COMPRESSED_MEDIA_TYPES.get(compression, MEDIA_TYPES[export_format])
+
+
+def file_name(name: str, export_format: ExportFormat, compression: ExportCompression) -> str:
+    return f"{name}.{export_format}{EXTENSIONS[compression]}"
+
+
+async def csv_chunks(partitions: AsyncIterator[Sequence[Row]], columns: dict[str, type]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for partition in partitions:
+        # Booleans as in JSON, None as an empty field
+        writer.writerows(
+            [("true" if value else "false") if value is True or value is False else value for value in row]
+            for row in partition
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def ndjson_chunks(partitions: AsyncIterator[Sequence[Row]], columns: dict[str, type]) -> AsyncIterator[bytes]:
+    async for partition in partitions:
+        yield b"".join(orjson.dumps(dict(zip(columns, row)), option=orjson.OPT_APPEND_NEWLINE) for row in partition)
+
+
+class _ArrowSink:
+    """File object collecting what pyarrow writes, drained after every batch."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+async def arrow_chunks(
+    partitions: AsyncIterator[Sequence[Row]], columns: dict[str, type], export_format: ExportFormat
+) -> AsyncIterator[bytes]:
+    """Parquet with a row group per partition, or an Arrow IPC stream with a record batch per partition."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {int: pa.int64(), str: pa.string(), bool: pa.bool_()}
+    schema = pa.schema([(name, types[column_type]) for name, column_type in columns.items()])
+    sink = _ArrowSink()
+    if export_format == ExportFormat.parquet:
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    async for partition in partitions:
+        arrays = [pa.array([row[index] for row in partition], type=field.type) for index, field in enumerate(schema)]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield sink.drain()
+    # The parquet footer, or the end of stream marker
+    writer.close()
+    yield sink.drain()
+
+
+async def compress(chunks: AsyncIterator[bytes], compression: ExportCompression) -> AsyncIterator[bytes]:
+    if compression == ExportCompression.none:
+        async for chunk in chunks:
+            yield chunk
+        return
+    if compression == ExportCompression.gzip:
+        compressor = zlib.compressobj(wbits=31)
+    else:
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor().compressobj()
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def encode(
+    partitions: AsyncIterator[Sequence[Row]],
+    columns: dict[str, type],
+    export_format: ExportFormat,
+    compression: ExportCompression,
+) -> AsyncIterator[bytes]:
+    """Chunks of the export, one or more per partition, so memory does not grow with the table."""
+    if export_format == ExportFormat.csv:
+        chunks = csv_chunks(partitions, columns)
+    elif export_format == ExportFormat.ndjson:
+        chunks = ndjson_chunks(partitions, columns)
+    else:
+        chunks = arrow_chunks(partitions, columns, export_format)
+    return compress(chunks, compression)
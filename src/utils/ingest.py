@@ -0,0 +1,98 @@
+import csv
+import io
+from array import array
+from typing import IO, Iterable, Iterator
+
+import orjson
+from loguru import logger
+
+from settings import settings
+
+TRUE = {"true", "t", "1", "yes"}
+FALSE = {"false", "f", "0", "no", ""}
+# Invalid rows reported one by one, the rest only counted
+REPORTED_ERRORS = 10
+
+
+def parse_bool(value) -> bool:
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    lowered = str(value).strip().lower()
+    if lowered in TRUE:
+        return True
+    if lowered in FALSE:
+        return False
+    raise ValueError(f"expected a boolean, got {value!r}")
+
+
+def read_rows(source: IO[bytes], ndjson: bool) -> Iterator[dict]:
+    """Rows of a CSV file with a header line or of an NDJSON file, as dicts."""
+    if ndjson:
+        for line in source:
+            if line.strip():
+                yield orjson.loads(line)
+    else:
+        yield from csv.DictReader(io.TextIOWrapper(source, encoding="utf-8", newline=""))
+
+
+class Catalogue:
+    """Authors and books to import, deduplicated in memory.
+
+    Authors are identified by name, books by author and name, so a repeated
+    book only keeps its last age limit. Author names are stored once and books
+    refer to them by position, which keeps a million books in well under a
+    gigabyte.
+    """
+
+    def __init__(self):
+        self.author_names: list[str] = []
+        self.author_positions: dict[str, int] = {}
+        # (author position, book name) -> is_age_limit
+        self.books: dict[tuple[int, str], bool] = {}
+        self.rows = 0
+        self.errors = 0
+
+    def author(self, name: str) -> int:
+        position = self.author_positions.get(name)
+        if position is None:
+            position = self.author_positions[name] = len(self.author_names)
+            self.author_names.append(name)
+        return position
+
+    def error(self, source: str, line: int, detail: str) -> None:
+        self.errors += 1
+        if self.errors <= REPORTED_ERRORS:
+            logger.warning("{}:{}: {}, row skipped", source, line, detail)
+
+    def add_authors(self, rows: Iterable[dict], source: str) -> None:
+        """Rows with a ``name``."""
+        for line, row in enumerate(rows, start=1):
+            self.rows += 1
+            name = (row.get("name") or "").strip()
+            if not name:
+                self.error(source, line, "author name is empty")
+                continue
+            self.author(name)
+
+    def add_books(self, rows: Iterable[dict], source: str) -> None:
+        """Rows with ``name``, ``author_name`` and optionally ``is_age_limit``, the columns of the export."""
+        for line, row in enumerate(rows, start=1):
+            self.rows += 1
+            name = (row.get("name") or "").strip()
+            author_name = (row.get("author_name") or "").strip()
+            if not name or not author_name:
+                self.error(source, line, "book name or author name is empty")
+                continue
+            try:
+                is_age_limit = parse_bool(row.get("is_age_limit"))
+            except ValueError as e:
+                self.error(source, line, str(e))
+                continue
+            self.books[(self.author(author_name), name)] = is_age_limit
+            if self.rows % settings.IMPORT_BATCH_SIZE == 0:
+                logger.info("read {} rows", self.rows)
+
+    def book_records(self, author_ids: array) -> Iterator[tuple[str, bool, int]]:
+        """(name, is_age_limit, author_id) of every book, ``author_ids`` indexed by author position."""
+        for (position, name), is_age_limit in self.books.items():
+            yield name, is_age_limit, author_ids[position]
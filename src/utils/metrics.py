@@ -0,0 +1,271 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.interfaces import CacheStats
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from settings import settings
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+UNMATCHED_ROUTE = "unmatched"
+# Execution option of the statements counted in search_statements_total
+SEARCH_STATEMENT_OPTION = "search_statement"
+# ExecutionContext.cache_hit, statements without a cache key are text() and exec_driver_sql
+COMPILED_CACHE_RESULTS = {
+    CacheStats.CACHE_HIT: "hit",
+    CacheStats.CACHE_MISS: "miss",
+    CacheStats.CACHING_DISABLED: "disabled",
+    CacheStats.NO_CACHE_KEY: "none",
+    CacheStats.NO_DIALECT_SUPPORT: "unsupported",
+}
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    # Every worker counts on its own, the pid keeps the series of the workers apart for sum()
+    pairs = (("worker", os.getpid()), *zip(names, values))
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, *labels) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def set(self, value: float, *labels) -> None:
+        # For values counted elsewhere and copied at scrape time
+        self.values[labels] = value
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> counts per bucket, then sum and count
+        self.values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self) -> Iterator[str]:
+        names = (*self.labels, "le")
+        for labels, series in self.values.items():
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{_labels(names, (*labels, _number(bound)))} {count}"
+            yield f"{self.name}_bucket{_labels(names, (*labels, '+Inf'))} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(series[-2])}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {series[-1]}"
+
+
+REQUEST_LABELS = ("method", "route", "status")
+
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served", ("method",))
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time until the response is sent", REQUEST_LABELS, DURATION_BUCKETS
+)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Size of the response body", REQUEST_LABELS, SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements issued by one request", REQUEST_LABELS, QUERY_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time one request spent in SQL statements", REQUEST_LABELS, DURATION_BUCKETS
+)
+DB_QUERIES = Counter("db_queries_total", "SQL statements issued by the application")
+DB_DURATION = Counter("db_query_duration_seconds_total", "Time spent in SQL statements")
+DB_POOL = Gauge("db_pool_connections", "Connections of the pool by state", ("state",))
+RESPONSE_CACHE = Counter("response_cache_requests_total", "Response cache lookups by result", ("result",))
+CATALOGUE_SNAPSHOT = Counter(
+    "catalogue_snapshot_events_total", "Searches served from the catalogue snapshot and its builds", ("event",)
+)
+NAME_INDEX = Gauge("name_index_rows", "Names in the in-process search index", ("kind",))
+NAME_INDEX_BYTES = Gauge("name_index_bytes", "Memory taken by the arrays of the in-process search index")
+SEARCH_STATEMENTS = Counter(
+    "search_statements_total",
+    "Reader search statements by the lookup of their compiled form in the SQLAlchemy cache",
+    ("result",),
+)
+DB_COMPILED_CACHE = Counter(
+    "db_compiled_cache_total",
+    "SQL statements by the lookup of their compiled form in the SQLAlchemy cache",
+    ("result",),
+)
+REQUESTS_SHED = Counter(
+    "http_requests_shed_total", "Requests refused before reaching the application by reason", ("reason",)
+)
+ADMISSION = Gauge("admission_requests", "Database bound requests being served and waiting for a slot", ("state",))
+
+METRICS = (
+    REQUESTS_IN_FLIGHT,
+    REQUEST_DURATION,
+    RESPONSE_SIZE,
+    REQUEST_QUERIES,
+    REQUEST_DB_DURATION,
+    DB_QUERIES,
+    DB_DURATION,
+    DB_POOL,
+    RESPONSE_CACHE,
+    CATALOGUE_SNAPSHOT,
+    NAME_INDEX,
+    NAME_INDEX_BYTES,
+    SEARCH_STATEMENTS,
+    DB_COMPILED_CACHE,
+    REQUESTS_SHED,
+    ADMISSION,
+)
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+@dataclass
+class RequestTimings:
+    """Time spent by the current request per phase, phases can overlap (auth includes its query)."""
+
+    started: float = field(default_factory=time.perf_counter)
+    phases: dict[str, float] = field(default_factory=dict)
+    queries: int = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        metrics = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in self.phases.items()]
+        if self.queries:
+            metrics.append(f'queries;desc="{self.queries}"')
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+# Set by MetricsMiddleware, contextvars follow the request into the SQLAlchemy greenlet and thread pools
+request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERIES.inc()
+    DB_DURATION.inc(seconds)
+    if context is not None:
+        result = COMPILED_CACHE_RESULTS.get(context.cache_hit, "none")
+        DB_COMPILED_CACHE.inc(1, result)
+        if context.execution_options.get(SEARCH_STATEMENT_OPTION):
+            SEARCH_STATEMENTS.inc(1, result)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.queries += 1
+        timings.add("db", seconds)
+
+
+def _handle_error(context) -> None:
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count statements and their time, globally and for the request being served."""
+    if event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, cheaper than BaseHTTPMiddleware that runs the app in a separate task."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        method = scope["method"]
+        status_code, size = 500, 0
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.SERVER_TIMING:
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(1, method)
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            REQUESTS_IN_FLIGHT.inc(-1, method)
+            # FastAPI puts the matched route into the scope, its template keeps the label cardinality low
+            route = scope.get("route")
+            labels = (method, getattr(route, "path", UNMATCHED_ROUTE), status_code)
+            REQUEST_DURATION.observe(time.perf_counter() - timings.started, *labels)
+            RESPONSE_SIZE.observe(size, *labels)
+            REQUEST_QUERIES.observe(timings.queries, *labels)
+            REQUEST_DB_DURATION.observe(timings.phases.get("db", 0.0), *labels)
+            request_timings.reset(token)
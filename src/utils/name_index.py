@@ -0,0 +1,243 @@
+import asyncio
+from array import array
+from typing import Iterable, Iterator
+
+from settings import settings
+
+NGRAM = 3
+# Bytes per slot of the parallel arrays: id, parent, name offset and the flag
+SLOT_BYTES = 8 + 8 + 8 + 1
+
+
+def ngrams(text: str) -> set[str]:
+    return {text[i : i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class NGramIndex:
+    """Trigram index over lower-cased names, kept in flat arrays.
+
+    Every indexed row takes one slot of the parallel arrays, its name is stored
+    UTF-8 encoded back to back with the others. The postings of a trigram list
+    the slots containing it in ascending order. Changing a row clears its slot
+    and appends a new one, the cleared slots are only reclaimed by building a
+    new index.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.parents = array("q")
+        self.flags = bytearray()
+        self.offsets = array("q", [0])
+        self.names = bytearray()
+        self.postings: dict[str, array] = {}
+        # Row id -> slot + 1, 0 when the row is not indexed
+        self.slots = array("q")
+        self.live = 0
+
+    def __len__(self) -> int:
+        return self.live
+
+    @property
+    def cleared(self) -> int:
+        return len(self.ids) - self.live
+
+    def slot(self, row_id: int) -> int | None:
+        if 0 <= row_id < len(self.slots) and self.slots[row_id]:
+            return self.slots[row_id] - 1
+        return None
+
+    def flag(self, row_id: int) -> bool | None:
+        slot = self.slot(row_id)
+        return None if slot is None else bool(self.flags[slot])
+
+    def name(self, slot: int) -> bytes:
+        return self.names[self.offsets[slot] : self.offsets[slot + 1]]
+
+    def add(self, row_id: int, name: str, flag: bool, parent: int | None = None) -> None:
+        self.remove(row_id)
+        slot = len(self.ids)
+        lowered = name.lower()
+        self.ids.append(row_id)
+        self.parents.append(parent or 0)
+        self.flags.append(bool(flag))
+        self.names += lowered.encode()
+        self.offsets.append(len(self.names))
+        for gram in ngrams(lowered):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(slot)
+        if row_id >= len(self.slots):
+            self.slots.frombytes(bytes(self.slots.itemsize * (row_id + 1 - len(self.slots))))
+        self.slots[row_id] = slot + 1
+        self.live += 1
+
+    def extend(self, rows: Iterable[tuple]) -> None:
+        for row in rows:
+            self.add(*row)
+
+    def remove(self, row_id: int) -> None:
+        slot = self.slot(row_id)
+        if slot is None:
+            return
+        self.ids[slot] = 0
+        self.slots[row_id] = 0
+        self.live -= 1
+
+    def search(self, needle: str) -> Iterator[int] | None:
+        """Slots of the names containing ``needle`` ignoring case, None when it is shorter than a trigram.
+
+        Lazy, so callers can stop once they have seen enough matches.
+        """
+        lowered = needle.lower()
+        grams = ngrams(lowered)
+        if not grams:
+            return None
+        postings = [self.postings.get(gram) for gram in grams]
+        if any(slots is None for slots in postings):
+            return iter(())
+        # The rarest trigram gives the candidates, the substring check drops the false positives
+        encoded = lowered.encode()
+        return (slot for slot in min(postings, key=len) if self.ids[slot] and encoded in self.name(slot))
+
+    def nbytes(self) -> int:
+        postings = sum(slots.itemsize * len(slots) for slots in self.postings.values())
+        return len(self.ids) * SLOT_BYTES + len(self.names) + self.slots.itemsize * len(self.slots) + postings
+
+
+class NameIndex:
+    """In-process substring search over book and author names.
+
+    Answers which ids can match a ``book_name`` or ``author`` search filter, so
+    the search query only looks rows up by primary key. Loaded at startup by
+    Reader.load_name_index and kept up to date by the write methods of Book and
+    Author. Writes of db.ingest are only seen after NAME_INDEX_REFRESH, so a
+    miss is not trusted: the search then runs on the database indexes. The
+    search queries still apply every filter, a stale hit never returns wrong
+    rows but can leave out rows written elsewhere until the next refresh, which
+    is why the index is refused with several workers.
+
+    Reloads are spaced by their own duration, so large indexes are rebuilt less
+    often. Once the slots cleared by writes outnumber the live ones, ``reload``
+    is set to rebuild the index early.
+    """
+
+    # Reloads take at most this share of the time of the worker
+    RELOAD_SHARE = 0.05
+
+    def __init__(self, max_rows: int, max_ids: int):
+        self.max_rows = max_rows
+        self.max_ids = max_ids
+        self.books = NGramIndex()
+        self.authors = NGramIndex()
+        self.ready = False
+        self.load_seconds = 0.0
+        self.reload = asyncio.Event()
+        # Ids written while a load is running, applied again once it is swapped in
+        self.loading = False
+        self.pending_books: set[int] = set()
+        self.pending_authors: set[int] = set()
+
+    def swap(self, books: NGramIndex, authors: NGramIndex) -> None:
+        self.books, self.authors = books, authors
+        self.ready = True
+        self.reload.clear()
+
+    def reload_interval(self, refresh: float) -> float | None:
+        """Seconds until the next reload, None when only the cleared slots trigger one."""
+        if refresh <= 0:
+            return None
+        return max(refresh, self.load_seconds / self.RELOAD_SHARE)
+
+    def disable(self) -> None:
+        self.books, self.authors = NGramIndex(), NGramIndex()
+        self.ready = False
+
+    def book_ids(self, book_name: str, is_age_limit: bool | None) -> tuple[list[int], set[int]] | None:
+        """Visible books whose name contains ``book_name`` and their authors.
+
+        None when the index cannot narrow the search.
+        """
+        slots = self.books.search(book_name)
+        if slots is None:
+            return None
+        ids, author_ids = [], set()
+        for slot in slots:
+            if is_age_limit is not None and bool(self.books.flags[slot]) != is_age_limit:
+                continue
+            # Flag of an author is is_deleted, books of missing or deleted authors are not searched
+            author_id = self.books.parents[slot]
+            if self.authors.flag(author_id) is not False:
+                continue
+            ids.append(self.books.ids[slot])
+            author_ids.add(author_id)
+            if len(ids) > self.max_ids:
+                return None
+        return ids, author_ids
+
+    def author_ids(self, author: str) -> list[int] | None:
+        """Authors not deleted whose name contains ``author``, None when the index cannot narrow the search."""
+        slots = self.authors.search(author)
+        if slots is None:
+            return None
+        ids = []
+        for slot in slots:
+            if not self.authors.flags[slot]:
+                ids.append(self.authors.ids[slot])
+                if len(ids) > self.max_ids:
+                    return None
+        return ids
+
+    def book_author_ids(self, book_name: str) -> list[int] | None:
+        """Authors having a book whose name contains ``book_name``, whatever its age limit."""
+        slots = self.books.search(book_name)
+        if slots is None:
+            return None
+        ids = set()
+        for slot in slots:
+            if self.books.parents[slot]:
+                ids.add(self.books.parents[slot])
+                if len(ids) > self.max_ids:
+                    return None
+        return list(ids)
+
+    def update_books(self, book_ids: Iterable[int], rows: Iterable[tuple[int, str, bool, int | None]]) -> None:
+        """Index ``rows`` of (id, name, is_age_limit, author_id), drop the other ``book_ids``."""
+        if self.loading:
+            self.pending_books.update(book_ids)
+        self._update(self.books, book_ids, rows)
+
+    def update_authors(self, author_ids: Iterable[int], rows: Iterable[tuple[int, str, bool]]) -> None:
+        """Index ``rows`` of (id, name, is_deleted), drop the other ``author_ids``."""
+        if self.loading:
+            self.pending_authors.update(author_ids)
+        self._update(self.authors, author_ids, rows)
+
+    def _update(self, index: NGramIndex, row_ids: Iterable[int], rows: Iterable[tuple]) -> None:
+        found = set()
+        for row in rows:
+            index.add(*row)
+            found.add(row[0])
+        for row_id in set(row_ids) - found:
+            index.remove(row_id)
+        if index.cleared > max(len(index), 1024):
+            self.reload.set()
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "books": len(self.books),
+            "authors": len(self.authors),
+            "bytes": self.books.nbytes() + self.authors.nbytes(),
+            "load_seconds": self.load_seconds,
+        }
+
+
+def make_index() -> NameIndex:
+    if settings.NAME_INDEX_ENABLED and settings.SERVER_WORKERS > 1:
+        # A hit would leave out the rows the other workers wrote until NAME_INDEX_REFRESH
+        raise RuntimeError("NAME_INDEX_ENABLED leaves out rows written by other workers with SERVER_WORKERS > 1")
+    return NameIndex(max_rows=settings.NAME_INDEX_MAX_ROWS, max_ids=settings.NAME_INDEX_MAX_IDS)
+
+
+name_index = make_index()
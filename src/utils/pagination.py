@@ -0,0 +1,40 @@
+import base64
+import json
+from typing import AsyncIterator, Sequence
+
+import orjson
+from fastapi import HTTPException, Response, status
+
+from api.v1.schemas.pagination import Pagination
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str | None) -> int:
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {cursor}",
+        )
+
+
+def paginate(items: Sequence, pagination: Pagination, response: Response) -> Sequence:
+    """Trim the ``limit + 1`` rows fetched by a keyset query and set the next cursor header."""
+    if len(items) > pagination.limit:
+        items = items[: pagination.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1].id)
+    return items
+
+
+async def ndjson_lines(partitions: AsyncIterator[Sequence[dict]]) -> AsyncIterator[bytes]:
+    async for partition in partitions:
+        yield b"".join(orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE) for item in partition)
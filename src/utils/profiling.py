@@ -0,0 +1,166 @@
+import asyncio
+import cProfile
+import hashlib
+import hmac
+import os
+import pstats
+import re
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from settings import settings
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_FILE_HEADER = "X-Profile-File"
+
+# Statements of the request being profiled, None for every other request
+profiled_statements: ContextVar[list[str] | None] = ContextVar("profiled_statements", default=None)
+
+
+def _sign(method: str, path: str, expires: int) -> str:
+    message = f"{method} {path} {expires}".encode()
+    return hmac.new(settings.PROFILING_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+
+def profile_signature(method: str, path: str, ttl: int = settings.PROFILING_SIGNATURE_TTL) -> str:
+    """Value of the X-Profile header that makes the app profile ``method`` ``path`` for the next ``ttl`` seconds."""
+    expires = int(time.time()) + ttl
+    return f"{expires}.{_sign(method, path, expires)}"
+
+
+def signature_valid(value: str, method: str, path: str) -> bool:
+    """A signature of ``method`` ``path`` that has not expired and expires within PROFILING_SIGNATURE_TTL."""
+    expires, _, signature = value.partition(".")
+    if not expires.isdecimal():
+        return False
+    now = time.time()
+    if not now <= int(expires) <= now + settings.PROFILING_SIGNATURE_TTL:
+        return False
+    return hmac.compare_digest(signature, _sign(method, path, int(expires)))
+
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    statements = profiled_statements.get()
+    if statements is not None:
+        statements.append(statement)
+
+
+def instrument_engine(engine: Engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", _record_statement):
+        event.listen(engine, "before_cursor_execute", _record_statement)
+
+
+class Profiler:
+    """pyinstrument when it is installed, cProfile otherwise.
+
+    pyinstrument follows the request across awaits. cProfile sees everything the
+    event loop runs meanwhile, so concurrent requests show up in its stats too.
+    """
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler as Sampler
+        except ImportError:
+            self._sampler = None
+            self._profile = cProfile.Profile()
+        else:
+            self._sampler = Sampler(async_mode="enabled")
+
+    @property
+    def extension(self) -> str:
+        return "html" if self._sampler else "prof"
+
+    def start(self) -> None:
+        if self._sampler:
+            self._sampler.start()
+        else:
+            self._profile.enable()
+
+    def stop(self) -> None:
+        if self._sampler:
+            self._sampler.stop()
+        else:
+            self._profile.disable()
+
+    def save(self, path: str) -> None:
+        if self._sampler:
+            with open(path, "w") as file:
+                file.write(self._sampler.output_html())
+        else:
+            # Loads with pstats, snakeviz or gprof2dot for a flamegraph
+            pstats.Stats(self._profile).dump_stats(path)
+
+
+class ProfilingMiddleware:
+    """Profile requests to PROFILING_PATHS or signed with PROFILING_SECRET.
+
+    Only added by make_app when one of them is set, so there is no cost otherwise.
+    The profile and the SQL it issued are saved to PROFILING_DIR and the file name
+    is returned in the X-Profile-File header. One request is profiled at a time,
+    the others are served as usual.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.paths = {path.strip() for path in settings.PROFILING_PATHS.split(",") if path.strip()}
+        self.busy = False
+
+    def wants_profile(self, scope: Scope) -> bool:
+        if scope["path"] in self.paths:
+            return True
+        signature = Headers(scope=scope).get(PROFILE_HEADER)
+        if not signature or not settings.PROFILING_SECRET:
+            return False
+        return signature_valid(signature, scope["method"], scope["path"])
+
+    @staticmethod
+    def save(profiler: Profiler, name: str, statements: list[str]) -> None:
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        profiler.save(os.path.join(settings.PROFILING_DIR, f"{name}.{profiler.extension}"))
+        with open(os.path.join(settings.PROFILING_DIR, f"{name}.sql"), "w") as file:
+            file.write(";\n\n".join(statements))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.busy or not self.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        self.busy = True
+        profiler = Profiler()
+        statements = []
+        token = profiled_statements.set(statements)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+        name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{scope['method']}-{slug}-{os.getpid()}"
+
+        async def send_with_file(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(PROFILE_FILE_HEADER, f"{name}.{profiler.extension}")
+            await send(message)
+
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_file)
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - started
+            profiled_statements.reset(token)
+            try:
+                # The HTML report and the files would block the event loop for every other request
+                await asyncio.to_thread(self.save, profiler, name, statements)
+            finally:
+                self.busy = False
+            logger.info(
+                "Profiled {} {} in {:.1f} ms, {} SQL statements: {}",
+                scope["method"],
+                scope["path"],
+                elapsed * 1000,
+                len(statements),
+                statements,
+            )
@@ -0,0 +1,188 @@
+import math
+import time
+from typing import Any
+
+from loguru import logger
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from settings import settings
+from utils.cache import TTLCache
+
+# Compare-and-set attempts on the shared backend before the request is let through
+MAX_ATTEMPTS = 5
+
+
+def next_arrival(arrival: float | None, now: float, rate: float, burst: int) -> tuple[float | None, float]:
+    """Token bucket of ``burst`` tokens refilled at ``rate`` per second, kept as a single timestamp (GCRA).
+
+    ``arrival`` is the time at which the bucket is full again, None for a full
+    bucket. Returns the new arrival time and 0 when a token is taken, or None
+    and the seconds until the next token.
+    """
+    arrival = max(arrival or now, now) + 1 / rate
+    allowed_at = arrival - burst / rate
+    if now < allowed_at:
+        return None, allowed_at - now
+    return arrival, 0.0
+
+
+class InMemoryBackend:
+    """Buckets of this worker, with several workers every one of them lets RATE_LIMIT_RATE through."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        # An entry expires once the bucket is full again, which is the same as not having it: ttl is burst / rate
+        self._buckets = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        arrival, retry_after = next_arrival(self._buckets.get(key), time.monotonic(), rate, burst)
+        if arrival is not None:
+            self._buckets.set(key, arrival)
+        return retry_after
+
+
+class RedisBackend:
+    """Buckets shared by all workers, on any server speaking the Redis protocol.
+
+    The arrival time is updated with WATCH/MULTI against the server clock, so no
+    scripting is needed and a local stand-in such as fakeredis can be passed as
+    ``client``.
+    """
+
+    def __init__(self, url: str, client: Any = None):
+        if client is None:
+            try:
+                from redis import asyncio as redis
+            except ImportError:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+            client = redis.from_url(url)
+        self.client = client
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        from redis.exceptions import WatchError
+
+        key = f"rate:{key}"
+        for _ in range(MAX_ATTEMPTS):
+            async with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    seconds, microseconds = await pipe.time()
+                    now = seconds + microseconds / 1_000_000
+                    stored = await pipe.get(key)
+                    arrival, retry_after = next_arrival(float(stored) if stored else None, now, rate, burst)
+                    if arrival is None:
+                        return retry_after
+                    pipe.multi()
+                    pipe.set(key, repr(arrival), px=max(math.ceil((arrival - now) * 1000), 1))
+                    await pipe.execute()
+                    return 0.0
+                except WatchError:
+                    # Another request of the same key took a token meanwhile
+                    continue
+        return 0.0
+
+
+class RateLimiter:
+    """Requests per second of one client, by its address, and of one reader, by its verified username."""
+
+    def __init__(self, backend: InMemoryBackend | RedisBackend | None, rate: float, burst: int, reader_rate: float):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.reader_rate = reader_rate
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    async def retry_after(self, key: str, rate: float | None = None) -> float:
+        """0 when the request may go on, otherwise the seconds until it may.
+
+        ``rate`` defaults to the rate of client addresses.
+        """
+        rate = self.rate if rate is None else rate
+        if self.backend is None or rate <= 0:
+            return 0.0
+        try:
+            retry_after = await self.backend.take(key, rate, self.burst)
+        except Exception as e:
+            # The limiter protects the database, it must not take the service down with its backend
+            logger.error(e)
+            self.errors += 1
+            return 0.0
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.__class__.__name__ if self.backend else None,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors,
+        }
+
+
+def client_key(scope: Scope) -> str:
+    """The client address.
+
+    Not the Basic username: it is not verified yet, so anyone could drain the
+    bucket of another reader with its name or get a fresh bucket for every
+    request by changing the name. The reader is limited by ``reader_key`` once
+    its password is checked.
+    """
+    client = scope.get("client")
+    return f"address:{client[0] if client else 'unknown'}"
+
+
+def reader_key(username: str) -> str:
+    return f"reader:{username}"
+
+
+def retry_after_header(retry_after: float) -> dict[str, str]:
+    return {"Retry-After": str(max(math.ceil(retry_after), 1))}
+
+
+def shed_response(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=retry_after_header(retry_after))
+
+
+class RateLimitMiddleware:
+    """Answer 429 with Retry-After to clients over RATE_LIMIT_RATE on RATE_LIMIT_PATHS.
+
+    Runs before the credentials are checked, so a client over the limit costs
+    neither bcrypt nor a database query.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.paths = tuple(path.strip() for path in settings.RATE_LIMIT_PATHS.split(",") if path.strip())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        retry_after = await rate_limiter.retry_after(client_key(scope))
+        if retry_after:
+            await shed_response(429, "Too many requests", retry_after)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+def make_backend() -> InMemoryBackend | RedisBackend | None:
+    if settings.RATE_LIMIT_BACKEND == "memory":
+        # The slowest bucket takes the longest to fill up again
+        rate = min(rate for rate in (settings.RATE_LIMIT_RATE, settings.RATE_LIMIT_READER_RATE) if rate > 0)
+        return InMemoryBackend(maxsize=settings.RATE_LIMIT_SIZE, ttl=settings.RATE_LIMIT_BURST / rate)
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisBackend(url=settings.RATE_LIMIT_URL)
+    return None
+
+
+rate_limiter = RateLimiter(
+    make_backend() if settings.RATE_LIMIT_RATE > 0 or settings.RATE_LIMIT_READER_RATE > 0 else None,
+    settings.RATE_LIMIT_RATE,
+    settings.RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_READER_RATE,
+)
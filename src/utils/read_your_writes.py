@@ -0,0 +1,43 @@
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from settings import settings
+
+READ_PRIMARY_COOKIE = "read_primary"
+# For clients that do not keep cookies, any value reads from the primary
+READ_PRIMARY_HEADER = "x-read-primary"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def wants_primary(request: Request) -> bool:
+    """Whether the client wrote less than DATABASE_READ_YOUR_WRITES seconds ago or asks for the primary."""
+    return READ_PRIMARY_COOKIE in request.cookies or READ_PRIMARY_HEADER in request.headers
+
+
+class ReadYourWritesMiddleware:
+    """Send clients back to the primary for a while after a successful write.
+
+    Replicas may not have the write yet, so the response to a request that
+    changed something sets a cookie that expires after DATABASE_READ_YOUR_WRITES
+    seconds. Only added by make_app when replicas are configured.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.cookie = (
+            f"{READ_PRIMARY_COOKIE}=1; Max-Age={max(int(settings.DATABASE_READ_YOUR_WRITES), 1)};"
+            " Path=/; HttpOnly; SameSite=Lax"
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                MutableHeaders(scope=message).append("Set-Cookie", self.cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
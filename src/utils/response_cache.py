@@ -0,0 +1,174 @@
+import json
+from typing import Any, Awaitable, Callable
+
+import orjson
+from fastapi import Response
+from loguru import logger
+from pydantic import TypeAdapter
+
+from settings import settings
+from utils.cache import TTLCache
+from utils.metrics import timed
+
+CATALOGUE = "catalogue"
+CACHED_HEADERS = ("etag", "x-next-cursor")
+
+
+class InMemoryBackend:
+    """Per-process LRU backend, versions are not shared between workers."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions: dict[str, int] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        return self._entries.get(key)
+
+    async def set(self, key: str, value: bytes) -> None:
+        self._entries.set(key, value)
+
+    async def get_version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    async def bump_version(self, namespace: str) -> int:
+        self._versions[namespace] = self._versions.get(namespace, 0) + 1
+        # Old entries can never be looked up again, free the memory right away
+        self._entries.clear()
+        return self._versions[namespace]
+
+
+class RedisBackend:
+    """Backend for any server speaking the Redis protocol, shared by all workers.
+
+    ``client`` can be any ``redis.asyncio.Redis`` compatible object, which lets
+    a local stand-in such as fakeredis replace the server.
+    """
+
+    def __init__(self, url: str, ttl: float, client: Any = None):
+        if client is None:
+            try:
+                from redis import asyncio as redis
+            except ImportError:
+                raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires the redis package")
+            client = redis.from_url(url)
+        self.client = client
+        self.ttl = int(ttl)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes) -> None:
+        await self.client.set(key, value, ex=self.ttl)
+
+    async def get_version(self, namespace: str) -> int:
+        return int(await self.client.get(f"version:{namespace}") or 0)
+
+    async def bump_version(self, namespace: str) -> int:
+        return await self.client.incr(f"version:{namespace}")
+
+
+class ResponseCache:
+    """Read-through cache of rendered JSON responses.
+
+    Keys embed the catalogue version, so a write only has to bump the version
+    for every entry rendered before it to become unreachable.
+    """
+
+    def __init__(self, backend: InMemoryBackend | RedisBackend | None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # Writes seen by this process, still counted when the backend is off or down
+        self.invalidations = 0
+
+    async def catalogue_version(self) -> tuple[int, int | None]:
+        """Changes on every write in this process and, with a shared backend, on writes in any worker."""
+        version = None
+        if self.backend is not None:
+            try:
+                version = await self.backend.get_version(CATALOGUE)
+            except Exception as e:
+                logger.error(e)
+                self.errors += 1
+        return self.invalidations, version
+
+    async def respond(
+        self,
+        endpoint: str,
+        params: dict,
+        build: Callable[[], Awaitable[Any]],
+        adapter: TypeAdapter | None,
+        response: Response | None = None,
+    ) -> Response:
+        """Return the cached response or render the result of ``build`` with ``adapter`` and store it.
+
+        Without ``adapter`` the result is trusted to be JSON ready already and is dumped as is.
+        Headers ``build`` sets on ``response`` are cached along with the body.
+        """
+        key = None
+        if self.backend is not None:
+            try:
+                version = await self.backend.get_version(CATALOGUE)
+                key = f"response:{version}:{endpoint}:{json.dumps(params, sort_keys=True, default=str)}"
+                entry = await self.backend.get(key)
+            except Exception as e:
+                # The cache is an optimisation, serve from the database when it is down
+                logger.error(e)
+                self.errors += 1
+                key, entry = None, None
+            if entry is not None:
+                self.hits += 1
+                headers, body = entry.split(b"\n", 1)
+                return Response(content=body, media_type="application/json", headers=json.loads(headers))
+            self.misses += 1
+        content = await build()
+        with timed("serialize"):
+            if adapter is None:
+                body = orjson.dumps(content)
+            else:
+                body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+        headers = (
+            {name: value for name, value in response.headers.items() if name in CACHED_HEADERS} if response else {}
+        )
+        if key is not None:
+            try:
+                await self.backend.set(key, json.dumps(headers).encode() + b"\n" + body)
+            except Exception as e:
+                logger.error(e)
+                self.errors += 1
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def invalidate(self) -> None:
+        self.invalidations += 1
+        if self.backend is None:
+            return
+        try:
+            await self.backend.bump_version(CATALOGUE)
+        except Exception as e:
+            logger.error(e)
+            self.errors += 1
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "backend": self.backend.__class__.__name__ if self.backend else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+def make_backend() -> InMemoryBackend | RedisBackend | None:
+    if settings.RESPONSE_CACHE_BACKEND == "memory":
+        if settings.SERVER_WORKERS > 1:
+            # The other workers would keep serving what a write changed until the TTL
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=memory serves stale entries with SERVER_WORKERS > 1, use redis")
+        return InMemoryBackend(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL)
+    if settings.RESPONSE_CACHE_BACKEND == "redis":
+        return RedisBackend(url=settings.RESPONSE_CACHE_URL, ttl=settings.RESPONSE_CACHE_TTL)
+    return None
+
+
+response_cache = ResponseCache(make_backend())
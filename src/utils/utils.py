@@ -3,33 +3,58 @@ from typing import Annotated
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from loguru import logger
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.v1.schemas.reader import ReaderSchemaResponse
-from db.database import get_db, pwd_context
+from db.database import get_db
 from db.models.reader import Reader
+from utils.credentials import get_cached_reader, cache_reader, reader_generation, verify_password
+from utils.metrics import timed
+from utils.rate_limit import rate_limiter, reader_key, retry_after_header
 
 
 async def verify_and_get_reader(
-    credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())], db: Session = Depends(get_db)
+    credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())], db: AsyncSession = Depends(get_db)
 ) -> ReaderSchemaResponse:
-    reader = db.query(Reader).filter(Reader.username == credentials.username).first()
-    if not reader:
+    reader = await authenticate(credentials, db)
+    # The address was limited before the credentials were checked, the reader only can be now
+    retry_after = await rate_limiter.retry_after(reader_key(reader.username), rate_limiter.reader_rate)
+    if retry_after:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"No reader with this id: {credentials.username} found",
-        )
-    try:
-        is_correct = pwd_context.verify(credentials.password, reader.password)
-    except Exception as e:
-        logger.error(e)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed check password",
-        )
-    if not is_correct:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Invalid password for {credentials.username}",
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers=retry_after_header(retry_after),
         )
     return reader
+
+
+async def authenticate(credentials: HTTPBasicCredentials, db: AsyncSession) -> ReaderSchemaResponse:
+    with timed("auth"):
+        cached_reader = await get_cached_reader(credentials.username, credentials.password)
+        if cached_reader:
+            return cached_reader
+        # An update or delete committed while the password is checked must not be undone by the cache
+        generation = await reader_generation(credentials.username)
+        reader = await db.scalar(select(Reader).where(Reader.username == credentials.username))
+        if not reader:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No reader with this id: {credentials.username} found",
+            )
+        try:
+            is_correct = await verify_password(credentials.password, reader.password)
+        except Exception as e:
+            logger.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed check password",
+            )
+        if not is_correct:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Invalid password for {credentials.username}",
+            )
+        reader = ReaderSchemaResponse.model_validate(reader, from_attributes=True)
+        await cache_reader(credentials.username, credentials.password, reader, generation)
+        return reader